@@ -0,0 +1,167 @@
+import os
+import sys
+import time
+import threading
+from collections import deque
+
+# Number of records kept in memory, the oldest unwritten records are dropped beyond it
+DEFAULT_CAPACITY = 16384
+
+# Seconds between two flushes of the background writer
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+# Number of pending records which wakes the background writer before the flush interval has passed
+DEFAULT_BATCH_SIZE = 1024
+
+# Characters which would break the one-record-per-line, tab-separated format
+ESCAPES = str.maketrans({"\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+class AccessLog:
+    """
+    Structured access log of a server process.
+    Serving code appends one tuple per response to a bounded ring buffer, which costs no system call.
+    A background thread turns the pending records into tab-separated lines
+        timestamp  connection id  method  path  status  bytes  latency in microseconds
+    and appends them to the log file with a single write per batch.
+    Per-request diagnostic prints go through verbose and are disabled by default.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 batch_size: int = DEFAULT_BATCH_SIZE):
+        self.records = deque(maxlen=capacity)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.path = None
+        self.verbose_enabled = False
+
+        # Opened by start in the process which serves requests, workers each open their own descriptor
+        self.file_descriptor = None
+        self.wake_up = threading.Event()
+        self.writer_lock = threading.Lock()
+
+        # Records appended by the serving thread and records taken by the writer, each counter is only changed
+        # by one thread. The records overwritten in the ring buffer before the writer could flush them are
+        # derived from both and the length of the buffer, and the writer reports how many it has counted so far
+        self.appended = 0
+        self.taken = 0
+        self.reported_dropped = 0
+
+    def configure(self, path: str = None, verbose: bool = False):
+        """
+        :param path: File the records are appended to, records are not kept when None
+        :param verbose: Whether per-request diagnostic prints are written to stdout
+        :return: None
+        """
+        self.path = path
+        self.verbose_enabled = verbose
+
+    @property
+    def enabled(self) -> bool:
+        return self.file_descriptor is not None
+
+    def start(self):
+        """
+        :return: None
+        Opens the log file and starts the background writer.
+        Called in every process which serves requests, after any fork, since threads do not survive a fork.
+        The file is opened with O_APPEND, so batches written by several workers never overwrite each other.
+        """
+        if self.path is None or self.file_descriptor is not None:
+            return
+        self.file_descriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        threading.Thread(target=self.run_writer, name="access-log-writer", daemon=True).start()
+
+    def record(self, connection_id: int, method: str, path: str, status_code: int, bytes_sent: int,
+               started_at: float):
+        """
+        :param connection_id: Number of the connection within the process
+        :param method: Request method, "-" when the request could not be parsed
+        :param path: Request target, "-" when the request could not be parsed
+        :param status_code: Status code of the response
+        :param bytes_sent: Length of the response, header included
+        :param started_at: Monotonic time at which the request was received
+        :return: None
+        """
+        if self.file_descriptor is None:
+            return
+        self.records.append((time.time(), connection_id, method, path, status_code, bytes_sent,
+                             time.monotonic() - started_at))
+        # Counted after the append, so the writer never sees a record counted which is not in the buffer yet
+        self.appended += 1
+        if len(self.records) >= self.batch_size:
+            self.wake_up.set()
+
+    def verbose(self, *values):
+        """
+        :param values: Values printed like print would
+        :return: None
+        """
+        if self.verbose_enabled:
+            print(*values)
+
+    def run_writer(self):
+        """
+        :return: None
+        Body of the background writer thread.
+        """
+        while True:
+            self.wake_up.wait(self.flush_interval)
+            self.wake_up.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                print("Could not write access log", self.path, e, file=sys.stderr)
+
+    def flush(self):
+        """
+        :return: None
+        Formats every pending record and appends them to the log file in one write.
+        """
+        with self.writer_lock:
+            if self.file_descriptor is None:
+                return
+            lines = []
+            while True:
+                try:
+                    timestamp, connection_id, method, path, status_code, bytes_sent, latency = self.records.popleft()
+                except IndexError:
+                    break
+                self.taken += 1
+                lines.append("%.3f\t%d\t%s\t%s\t%d\t%d\t%d\n" % (timestamp, connection_id, method.translate(ESCAPES),
+                                                                 path.translate(ESCAPES), status_code, bytes_sent,
+                                                                 latency * 1000000))
+            # appended is read before the length, a record appended in between is then in the buffer but not
+            # counted yet, which can only make the count too low until the next flush
+            appended = self.appended
+            dropped = appended - self.taken - len(self.records)
+            if dropped > self.reported_dropped:
+                lines.append("# %d records dropped\n" % (dropped - self.reported_dropped))
+                self.reported_dropped = dropped
+            if not lines:
+                return
+            data = memoryview("".join(lines).encode("UTF-8"))
+            while data:
+                written = os.write(self.file_descriptor, data)
+                data = data[written:]
+
+    def close(self):
+        """
+        :return: None
+        Writes the pending records and closes the log file.
+        """
+        try:
+            self.flush()
+        finally:
+            with self.writer_lock:
+                if self.file_descriptor is not None:
+                    os.close(self.file_descriptor)
+                    self.file_descriptor = None
+
+
+def response_status(response_parts: list) -> int:
+    """
+    :param response_parts: Response parts starting with the encoded header
+    :return: Status code read back from the status line
+    """
+    return int(response_parts[0][9:12])
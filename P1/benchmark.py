@@ -0,0 +1,347 @@
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+# Directory holding the server scripts
+P1_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SERVER_SCRIPTS = {
+    "1": "http_server1.py",
+    "2": "http_server2.py",
+    "3": "http_server3.py"
+}
+
+# Seconds a single request may take before it is counted as an error
+REQUEST_TIMEOUT = 10
+
+# Seconds to wait for a freshly started server to accept connections
+STARTUP_TIMEOUT = 10
+
+
+def find_free_port() -> int:
+    """
+    :return: A port number which is currently free on localhost
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe_socket:
+        probe_socket.bind(("127.0.0.1", 0))
+        return probe_socket.getsockname()[1]
+
+
+def create_document_root(file_sizes: list) -> str:
+    """
+    :param file_sizes: Sizes in bytes of the files to be served
+    :return: Path of a temporary directory holding one bench_<size>.html file per size
+    """
+    document_root = tempfile.mkdtemp(prefix="p1_bench_")
+    for file_size in file_sizes:
+        prefix = b"<!DOCTYPE html><html><body>"
+        suffix = b"</body></html>"
+        filler = b"x" * max(0, file_size - len(prefix) - len(suffix))
+        with open(os.path.join(document_root, "bench_" + str(file_size) + ".html"), "wb") as file:
+            # Files smaller than the markup itself are simply truncated
+            file.write((prefix + filler + suffix)[:file_size])
+    return document_root
+
+
+def start_server_process(server: str, port_number: int, document_root: str, worker_count: int):
+    """
+    :param server: Key of SERVER_SCRIPTS
+    :param port_number: Port the server listens on
+    :param document_root: Working directory of the server, the files are served from it
+    :param worker_count: Value of --workers, 1 runs a single process
+    :return: Popen of the server, once it accepts connections
+    """
+    command = [sys.executable, os.path.join(P1_DIR, SERVER_SCRIPTS[server]), str(port_number)]
+    if worker_count > 1:
+        command += ["--workers", str(worker_count)]
+    server_process = subprocess.Popen(command, cwd=document_root, stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if server_process.poll() is not None:
+            raise RuntimeError(SERVER_SCRIPTS[server] + " exited with status " + str(server_process.returncode))
+        try:
+            socket.create_connection(("127.0.0.1", port_number), timeout=0.2).close()
+            return server_process
+        except OSError:
+            time.sleep(0.05)
+    server_process.kill()
+    raise RuntimeError(SERVER_SCRIPTS[server] + " did not start listening in time")
+
+
+def stop_server_process(server_process):
+    """
+    :param server_process: Popen of the server
+    :return: None
+    """
+    server_process.terminate()
+    try:
+        server_process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        server_process.kill()
+        server_process.wait()
+
+
+def process_cpu_seconds(pid: int):
+    """
+    :param pid: Process id of the server
+    :return: User plus system CPU seconds of the process and its direct children, None where /proc is missing
+    Children are included so that --workers runs are measured too.
+    """
+    clock_ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+    total_ticks = 0
+    try:
+        process_ids = [entry for entry in os.listdir("/proc") if entry.isdigit()]
+    except OSError:
+        return None
+
+    for process_id in process_ids:
+        try:
+            with open("/proc/" + process_id + "/stat") as stat_file:
+                stat_fields = stat_file.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # Fields after the command name: state, ppid, ... utime is the 12th and stime the 13th
+        parent_id = int(stat_fields[1])
+        if int(process_id) == pid or parent_id == pid:
+            total_ticks += int(stat_fields[11]) + int(stat_fields[12])
+    return total_ticks / clock_ticks
+
+
+async def read_response(reader):
+    """
+    :param reader: Stream of the connection
+    :return: Tuple of the status code and whether the server closes the connection, once the body has been read
+    The response body is framed by Content-Length; the P1 servers always send it.
+    """
+    header_bytes = await reader.readuntil(b"\r\n\r\n")
+    header_lines = header_bytes.decode("latin-1").split("\r\n")
+    status_code = int(header_lines[0].split(" ")[1])
+    content_length = 0
+    connection_close = False
+    for header_line in header_lines[1:]:
+        header_name, _, header_value = header_line.partition(":")
+        header_name = header_name.strip().lower()
+        if header_name == "content-length":
+            content_length = int(header_value.strip())
+        elif header_name == "connection":
+            connection_close = header_value.strip().lower() == "close"
+    if content_length:
+        await reader.readexactly(content_length)
+    return status_code, connection_close
+
+
+async def run_client(port_number: int, request_bytes: bytes, keep_alive: bool, deadline: float,
+                     latencies: list, status_codes: dict, errors: list):
+    """
+    :param port_number: Port the server listens on
+    :param request_bytes: Encoded request sent over and over
+    :param keep_alive: Whether requests reuse one connection
+    :param deadline: Monotonic time at which the client stops sending new requests
+    :param latencies: Request latencies in seconds are appended to this list
+    :param status_codes: Number of responses per status code
+    :param errors: Error messages are appended to this list
+    :return: None
+    Sends one request at a time until the deadline, reconnecting whenever the server closes the connection.
+    """
+    reader = writer = None
+    while time.monotonic() < deadline:
+        request_start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection("127.0.0.1", port_number), REQUEST_TIMEOUT)
+            writer.write(request_bytes)
+            status_code, connection_close = await asyncio.wait_for(read_response(reader), REQUEST_TIMEOUT)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ValueError, IndexError) as e:
+            errors.append(type(e).__name__)
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            continue
+
+        latencies.append(time.perf_counter() - request_start)
+        status_codes[status_code] = status_codes.get(status_code, 0) + 1
+        if not keep_alive or connection_close:
+            # The server closes persistent connections after a number of requests
+            writer.close()
+            reader = writer = None
+
+    if writer is not None:
+        writer.close()
+
+
+async def run_load(port_number: int, request_bytes: bytes, keep_alive: bool, concurrency: int, duration: float):
+    """
+    :param port_number: Port the server listens on
+    :param request_bytes: Encoded request
+    :param keep_alive: Whether requests reuse connections
+    :param concurrency: Number of concurrent clients
+    :param duration: Seconds the load is applied for
+    :return: Tuple of latencies, status code counts, errors and the elapsed wall time
+    """
+    latencies = []
+    status_codes = {}
+    errors = []
+    started = time.monotonic()
+    deadline = started + duration
+    await asyncio.gather(*[run_client(port_number, request_bytes, keep_alive, deadline, latencies,
+                                      status_codes, errors) for _ in range(concurrency)])
+    return latencies, status_codes, errors, time.monotonic() - started
+
+
+def percentile(sorted_values: list, fraction: float):
+    """
+    :param sorted_values: Values in ascending order
+    :param fraction: Percentile between 0 and 1
+    :return: Nearest-rank percentile, None for an empty list
+    """
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def build_request(server: str, file_size: int, query: str, keep_alive: bool) -> bytes:
+    """
+    :param server: Key of SERVER_SCRIPTS
+    :param file_size: Size of the requested file, ignored for http_server3
+    :param query: Path and query string requested from http_server3
+    :param keep_alive: Whether the connection should be kept open
+    :return: Encoded GET request
+    """
+    path = query if server == "3" else "/bench_" + str(file_size) + ".html"
+    connection = "keep-alive" if keep_alive else "close"
+    return ("GET " + path + " HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: " + connection + "\r\n\r\n").encode("UTF-8")
+
+
+def run_benchmark(server: str, concurrency: int, keep_alive: bool, file_size: int, arguments, document_root: str):
+    """
+    :param server: Key of SERVER_SCRIPTS
+    :param concurrency: Number of concurrent clients
+    :param keep_alive: Whether requests reuse connections
+    :param file_size: Size of the requested file, ignored for http_server3
+    :param arguments: Parsed command line arguments
+    :param document_root: Directory the files are served from
+    :return: Result dictionary of this run
+    Starts a fresh server, warms it up, applies the load and measures the server's CPU time around it.
+    """
+    port_number = find_free_port()
+    server_process = start_server_process(server, port_number, document_root, arguments.workers)
+    request_bytes = build_request(server, file_size, arguments.query, keep_alive)
+    try:
+        if arguments.warmup > 0:
+            asyncio.run(run_load(port_number, request_bytes, keep_alive, concurrency, arguments.warmup))
+        cpu_before = process_cpu_seconds(server_process.pid)
+        latencies, status_codes, errors, elapsed = asyncio.run(
+            run_load(port_number, request_bytes, keep_alive, concurrency, arguments.duration))
+        cpu_after = process_cpu_seconds(server_process.pid)
+    finally:
+        stop_server_process(server_process)
+
+    latencies.sort()
+    error_counts = {}
+    for error in errors:
+        error_counts[error] = error_counts.get(error, 0) + 1
+
+    def to_milliseconds(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        "server": SERVER_SCRIPTS[server],
+        "concurrency": concurrency,
+        "keep_alive": keep_alive,
+        "file_size": None if server == "3" else file_size,
+        "workers": arguments.workers,
+        "requests": len(latencies),
+        "duration_seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+        "latency_ms": {
+            "mean": to_milliseconds(sum(latencies) / len(latencies)) if latencies else None,
+            "p50": to_milliseconds(percentile(latencies, 0.50)),
+            "p95": to_milliseconds(percentile(latencies, 0.95)),
+            "p99": to_milliseconds(percentile(latencies, 0.99)),
+            "max": to_milliseconds(latencies[-1] if latencies else None)
+        },
+        "status_codes": {str(status_code): count for status_code, count in sorted(status_codes.items())},
+        "errors": len(errors),
+        "error_types": error_counts,
+        "server_cpu_seconds": None if cpu_before is None or cpu_after is None else round(cpu_after - cpu_before, 3)
+    }
+
+
+def parse_int_list(value: str) -> list:
+    """
+    :param value: Comma separated integers
+    :return: List of integers
+    """
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load test the P1 servers over localhost and report throughput and latency as JSON.")
+    parser.add_argument("--servers", default="1,2,3",
+                        help="comma separated servers to benchmark, out of 1, 2 and 3")
+    parser.add_argument("--concurrency", type=parse_int_list, default=[1, 10, 50],
+                        help="comma separated numbers of concurrent clients")
+    parser.add_argument("--keep-alive", dest="keep_alive", default="both", choices=["on", "off", "both"],
+                        help="whether clients reuse connections")
+    parser.add_argument("--file-sizes", dest="file_sizes", type=parse_int_list, default=[1024, 65536],
+                        help="comma separated sizes in bytes of the files requested from servers 1 and 2")
+    parser.add_argument("--query", default="/product?a=2&b=3.5", help="path requested from server 3")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of load per run")
+    parser.add_argument("--warmup", type=float, default=0.5, help="seconds of load before each measured run")
+    parser.add_argument("--workers", type=int, default=1, help="value of --workers passed to the servers")
+    parser.add_argument("--out", dest="output", default=None, help="file the JSON results are written to")
+    args = parser.parse_args()
+
+    servers = [server.strip() for server in args.servers.split(",") if server.strip()]
+    for server in servers:
+        if server not in SERVER_SCRIPTS:
+            sys.stderr.write("Unknown server " + server + ", expected 1, 2 or 3\n")
+            sys.exit(7)
+    keep_alive_modes = {"on": [True], "off": [False], "both": [True, False]}[args.keep_alive]
+
+    benchmark_root = create_document_root(args.file_sizes)
+    results = []
+    try:
+        for server in servers:
+            # http_server3 does not serve files, so it is only run once per setting
+            sizes = [None] if server == "3" else args.file_sizes
+            for file_size in sizes:
+                for keep_alive in keep_alive_modes:
+                    for concurrency in args.concurrency:
+                        result = run_benchmark(server, concurrency, keep_alive, file_size, args, benchmark_root)
+                        print(json.dumps(result), file=sys.stderr)
+                        results.append(result)
+    finally:
+        shutil.rmtree(benchmark_root, ignore_errors=True)
+
+    report = json.dumps({
+        "config": {
+            "servers": [SERVER_SCRIPTS[server] for server in servers],
+            "concurrency": args.concurrency,
+            "keep_alive": args.keep_alive,
+            "file_sizes": args.file_sizes,
+            "query": args.query,
+            "duration_seconds": args.duration,
+            "warmup_seconds": args.warmup,
+            "workers": args.workers
+        },
+        "results": results
+    }, indent=4)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report + "\n")
+    else:
+        print(report)
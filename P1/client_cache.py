@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import threading
+
+# Seconds a resolved address is reused, getaddrinfo does not report the TTL of the DNS records
+DEFAULT_DNS_TTL = 60.0
+
+# Seconds a failed resolution is remembered, so a missing host is not looked up for every URL of a batch
+DEFAULT_NEGATIVE_DNS_TTL = 5.0
+
+# Number of permanent redirects kept on disk, the oldest ones are dropped beyond it
+DEFAULT_MAX_REDIRECTS = 10000
+
+# File the permanent redirects are stored in by default
+DEFAULT_REDIRECT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "http_client", "redirects.json")
+
+
+class DnsCache:
+    """
+    In-process cache of resolved addresses keyed by (host, port), shared by every connection of the client.
+    Entries expire after ttl seconds; failed lookups are cached for negative_ttl seconds.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_DNS_TTL, negative_ttl: float = DEFAULT_NEGATIVE_DNS_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+
+        # Maps (host, port) to (expiry time, addresses or the socket.gaierror raised by the lookup)
+        self.entries = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, host_name: str, port: int) -> list:
+        """
+        :param host_name: Host to resolve
+        :param port: Port to connect to
+        :return: getaddrinfo tuples of the TCP addresses of the host
+        Raises socket.gaierror if the host cannot be resolved.
+        """
+        key = (host_name, port)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                result = entry[1]
+            else:
+                self.misses += 1
+                result = None
+
+        if result is None:
+            try:
+                result = socket.getaddrinfo(host_name, port, type=socket.SOCK_STREAM)
+                expiry = now + self.ttl
+            except socket.gaierror as e:
+                result = e
+                expiry = now + self.negative_ttl
+            with self.lock:
+                self.entries[key] = (expiry, result)
+
+        if isinstance(result, socket.gaierror):
+            raise result
+        return result
+
+    def invalidate(self, host_name: str = None, port: int = None):
+        """
+        :param host_name: Host whose addresses are dropped, every entry is dropped when None
+        :param port: Port whose entry of the host is dropped, the entries of every port are dropped when None
+        :return: None
+        """
+        with self.lock:
+            if host_name is None:
+                self.entries.clear()
+            elif port is not None:
+                self.entries.pop((host_name, port), None)
+            else:
+                for key in [key for key in self.entries if key[0] == host_name]:
+                    del self.entries[key]
+
+    def stats(self) -> dict:
+        """
+        :return: Hit and miss counters and current size
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+
+class RedirectCache:
+    """
+    Persistent cache of permanent (301) redirects, mapping a URL to the absolute URL it moved to.
+    Entries are kept in a JSON file, which is loaded on creation and written back by save when it changed.
+    """
+
+    def __init__(self, path: str = DEFAULT_REDIRECT_CACHE_PATH, max_entries: int = DEFAULT_MAX_REDIRECTS):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+        # Maps a URL to {"location": ..., "stored_at": ...}, in insertion order
+        self.entries = {}
+        self.modified = False
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.load()
+
+    def load(self):
+        """
+        :return: None
+        Reads the entries from the cache file. A missing or unreadable file leaves the cache empty.
+        """
+        try:
+            with open(self.path) as cache_file:
+                entries = json.load(cache_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print("Ignoring redirect cache", self.path, e, file=sys.stderr)
+            return
+        if isinstance(entries, dict):
+            self.entries = {url: entry for url, entry in entries.items()
+                            if isinstance(entry, dict) and isinstance(entry.get("location"), str)}
+
+    def get(self, url: str):
+        """
+        :param url: URL about to be requested
+        :return: URL it permanently moved to, or None if no redirect is known
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry["location"]
+
+    def put(self, url: str, location: str):
+        """
+        :param url: URL which answered 301
+        :param location: Absolute URL it moved to
+        :return: None
+        """
+        with self.lock:
+            self.entries.pop(url, None)
+            self.entries[url] = {"location": location, "stored_at": int(time.time())}
+            while len(self.entries) > self.max_entries:
+                del self.entries[next(iter(self.entries))]
+            self.stores += 1
+            self.modified = True
+
+    def invalidate(self, url: str = None):
+        """
+        :param url: URL whose redirect is dropped, every entry is dropped when None
+        :return: None
+        """
+        with self.lock:
+            if url is None:
+                self.entries.clear()
+            elif self.entries.pop(url, None) is None:
+                return
+            self.modified = True
+
+    def save(self):
+        """
+        :return: None
+        Writes the entries to a temporary file which then replaces the cache file,
+        so a crash while saving never leaves a truncated cache behind.
+        """
+        with self.lock:
+            if not self.modified:
+                return
+            entries = dict(self.entries)
+            self.modified = False
+
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix=".redirects_")
+        try:
+            with os.fdopen(file_descriptor, "w") as cache_file:
+                json.dump(entries, cache_file)
+            os.replace(temporary_path, self.path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    def stats(self) -> dict:
+        """
+        :return: Hit, miss and store counters and current size
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "stores": self.stores, "entries": len(self.entries)}
@@ -0,0 +1,293 @@
+import os
+import gzip
+import time
+from collections import OrderedDict
+from static_cache import CacheEntry
+from static_files import FileBody, MIN_COMPRESS_BYTES, build_entity_headers, build_validator_headers, \
+    close_response_parts, create_file_response
+
+# Content codings the servers can send, in order of preference, with the suffix of their precompressed siblings.
+# Only gzip can be produced on the fly, the standard library has no Brotli encoder.
+PRECOMPRESSED_SUFFIXES = (("br", ".br"), ("gzip", ".gz"))
+
+# Content codings which are compressed on the first request when no precompressed sibling exists
+ON_THE_FLY_ENCODINGS = ("gzip",)
+
+# zlib compression level of gzip bodies compressed on the fly
+COMPRESSION_LEVEL = 6
+
+# Total number of compressed body bytes kept in memory by default
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+# Precompressed siblings larger than this are streamed with sendfile instead of being cached
+DEFAULT_MAX_ENTRY_BYTES = 1024 * 1024
+
+# Files larger than this are not compressed on the fly, compressing them would stall the server for too long
+DEFAULT_MAX_SOURCE_BYTES = 4 * 1024 * 1024
+
+# Seconds during which a cached variant or a failed lookup is trusted without calling stat again
+DEFAULT_REVALIDATE_INTERVAL = 1.0
+
+# Number of failed variant lookups remembered, the whole table is dropped beyond it
+MAX_MISSES = 4096
+
+# A compressed body has to be smaller than this fraction of the original to be worth sending
+MIN_COMPRESSION_RATIO = 0.9
+
+
+class CompressedEntry(CacheEntry):
+    """
+    A content-coded variant of a static file held in memory, either compressed on the fly or read from a
+    precompressed sibling. It carries its own ETag, so validators of different codings never match each other.
+    """
+
+    def __init__(self, body: bytes, stat_result: os.stat_result, content_encoding: str, source_version: tuple,
+                 sibling_path: str = None):
+        super().__init__(body, stat_result)
+        self.content_encoding = content_encoding
+        self.header_block = build_entity_headers(self.length, content_encoding=content_encoding)
+        if sibling_path is None:
+            # Compressed from the file itself, the ETag of the file is extended by the coding
+            self.etag = self.etag[:-1] + "-" + content_encoding + '"'
+        self.validator_headers = build_validator_headers(self.etag, self.last_modified, True)
+
+        # (mtime_ns, length) of the file the variant was made from, and the sibling it was read from, if any
+        self.source_version = source_version
+        self.sibling_path = sibling_path
+
+
+def accepted_encodings(request_headers: dict) -> list:
+    """
+    :param request_headers: Request headers with lower case names
+    :return: Content codings the server can send and the client accepts, most preferred first
+    Codings are ordered by their q-value, ties are broken by the order of PRECOMPRESSED_SUFFIXES.
+    A "*" entry applies to every coding the client did not list, a q-value of 0 refuses a coding.
+    """
+    accept_encoding = request_headers.get("accept-encoding")
+    if not accept_encoding:
+        return []
+
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, parameters = item.partition(";")
+        coding = coding.strip().lower()
+        if coding == "x-gzip":
+            coding = "gzip"
+        quality = 1.0
+        name, _, value = parameters.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[coding] = quality
+
+    wildcard = qualities.get("*", 0.0)
+    candidates = []
+    for preference, (coding, _) in enumerate(PRECOMPRESSED_SUFFIXES):
+        quality = qualities.get(coding, wildcard)
+        if quality > 0:
+            candidates.append((-quality, preference, coding))
+    return [coding for _, _, coding in sorted(candidates)]
+
+
+def create_negotiated_response(compression_cache, path: str, file_content, request_headers: dict,
+                               keep_alive: bool = False) -> list:
+    """
+    :param compression_cache: CompressionCache of the server process
+    :param path: Resolved path of the requested file
+    :param file_content: CacheEntry or FileBody of the file
+    :param request_headers: Request headers with lower case names
+    :param keep_alive: Whether the connection stays open after the response
+    :return: Response parts for the best variant the client accepts
+    Validators and ranges are checked against the chosen variant, which carries its own ETag.
+    """
+    file_content = compression_cache.negotiate(path, file_content, request_headers)
+    return create_file_response(file_content, request_headers, keep_alive)
+
+
+class CompressionCache:
+    """
+    Byte-bounded LRU cache of content-coded variants of static files, keyed by resolved path and coding.
+    A variant is only reused while the file keeps the modification time and length it was made from.
+    Precompressed siblings (index.html.br, index.html.gz) are preferred when they are at least as new as the file;
+    otherwise gzip variants are compressed on the first request.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, max_entry_bytes: int = DEFAULT_MAX_ENTRY_BYTES,
+                 max_source_bytes: int = DEFAULT_MAX_SOURCE_BYTES,
+                 revalidate_interval: float = DEFAULT_REVALIDATE_INTERVAL):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.max_source_bytes = max_source_bytes
+        self.revalidate_interval = revalidate_interval
+
+        # Least recently used entries are at the front
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+
+        # Maps (path, coding) to the (source version, monotonic time) of a lookup which found no variant
+        self.misses = {}
+
+    def negotiate(self, path: str, file_content, request_headers: dict):
+        """
+        :param path: Resolved path of the requested file
+        :param file_content: CacheEntry or FileBody of the file
+        :param request_headers: Request headers with lower case names
+        :return: The best variant the client accepts, or file_content itself if the identity coding is sent
+        Range requests and files below MIN_COMPRESS_BYTES are always answered with the identity coding.
+        The identity FileBody is closed when a variant replaces it.
+        """
+        if file_content.length < MIN_COMPRESS_BYTES or "range" in request_headers:
+            return file_content
+
+        source_version = (file_content.mtime_ns, file_content.length)
+        for content_encoding in accepted_encodings(request_headers):
+            variant = self.variant(path, file_content, source_version, content_encoding)
+            if variant is not None:
+                if variant is not file_content:
+                    close_response_parts([file_content])
+                return variant
+        return file_content
+
+    def variant(self, path: str, file_content, source_version: tuple, content_encoding: str):
+        """
+        :param path: Resolved path of the requested file
+        :param file_content: CacheEntry or FileBody of the file
+        :param source_version: (mtime_ns, length) of the file
+        :param content_encoding: Content coding of the variant
+        :return: CompressedEntry or FileBody of the variant, or None if there is none for this coding
+        """
+        key = (path, content_encoding)
+        now = time.monotonic()
+        entry = self.get(key, source_version, now)
+        if entry is not None:
+            return entry
+
+        miss = self.misses.get(key)
+        if miss is not None and miss[0] == source_version and now - miss[1] < self.revalidate_interval:
+            return None
+
+        variant = self.load_sibling(key, source_version)
+        if variant is None and content_encoding in ON_THE_FLY_ENCODINGS and (miss is None or
+                                                                             miss[0] != source_version):
+            # Compression is only tried once per version of the file, an incompressible file stays a miss
+            variant = self.compress(key, file_content, source_version)
+        if variant is None:
+            if len(self.misses) >= MAX_MISSES:
+                self.misses.clear()
+            self.misses[key] = (source_version, now)
+        return variant
+
+    def get(self, key: tuple, source_version: tuple, now: float):
+        """
+        :param key: (resolved path, content coding)
+        :param source_version: Current (mtime_ns, length) of the file
+        :param now: Current monotonic time
+        :return: Cached CompressedEntry, or None if there is none or it is stale
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.source_version != source_version:
+            self.evict(key)
+            return None
+        if entry.sibling_path is not None and now - entry.checked_at >= self.revalidate_interval:
+            try:
+                stat_result = os.stat(entry.sibling_path)
+            except OSError:
+                stat_result = None
+            if stat_result is None or not entry.matches(stat_result):
+                self.evict(key)
+                return None
+            entry.checked_at = now
+        self.entries.move_to_end(key)
+        return entry
+
+    def load_sibling(self, key: tuple, source_version: tuple):
+        """
+        :param key: (resolved path, content coding)
+        :param source_version: Current (mtime_ns, length) of the file
+        :return: CompressedEntry or FileBody of the precompressed sibling, or None if there is no current sibling
+        """
+        path, content_encoding = key
+        sibling_path = path + dict(PRECOMPRESSED_SUFFIXES)[content_encoding]
+        try:
+            file_descriptor = os.open(sibling_path, os.O_RDONLY)
+        except OSError:
+            return None
+
+        file_body = FileBody.from_descriptor(file_descriptor)
+        if file_body.mtime_ns < source_version[0]:
+            # Older than the file, the sibling was not regenerated after the last edit
+            file_body.close()
+            return None
+        file_body.content_encoding = content_encoding
+        file_body.validator_headers = build_validator_headers(file_body.etag, file_body.last_modified, True)
+        if file_body.length > self.max_entry_bytes:
+            return file_body
+
+        try:
+            body = os.pread(file_body.file_descriptor, file_body.length, 0)
+            stat_result = os.fstat(file_body.file_descriptor)
+        finally:
+            file_body.close()
+        entry = CompressedEntry(body, stat_result, content_encoding, source_version, sibling_path)
+        self.store(key, entry)
+        return entry
+
+    def compress(self, key: tuple, file_content, source_version: tuple):
+        """
+        :param key: (resolved path, content coding)
+        :param file_content: CacheEntry or FileBody of the file
+        :param source_version: Current (mtime_ns, length) of the file
+        :return: CompressedEntry of the gzip-compressed file, or None if the file is too large or incompressible
+        """
+        if file_content.length > self.max_source_bytes:
+            return None
+        if isinstance(file_content, CacheEntry):
+            source = file_content.body
+            try:
+                stat_result = os.stat(key[0])
+            except OSError:
+                # Removed or renamed since the lookup, the identity body is still sent
+                return None
+            if not file_content.matches(stat_result):
+                return None
+        else:
+            source = os.pread(file_content.file_descriptor, file_content.length, file_content.offset)
+            stat_result = os.fstat(file_content.file_descriptor)
+        if len(source) != file_content.length:
+            # The file changed while it was read
+            return None
+
+        # A fixed mtime makes the output, and therefore its length, depend on the content only
+        body = gzip.compress(source, COMPRESSION_LEVEL, mtime=0)
+        if len(body) >= len(source) * MIN_COMPRESSION_RATIO or len(body) > self.max_bytes:
+            return None
+        entry = CompressedEntry(body, stat_result, key[1], source_version)
+        self.store(key, entry)
+        return entry
+
+    def store(self, key: tuple, entry: CompressedEntry):
+        """
+        :param key: (resolved path, content coding)
+        :param entry: Variant to be cached
+        :return: None
+        Stores a variant, evicting least recently used entries to stay within max_bytes.
+        """
+        self.evict(key)
+        while self.entries and self.current_bytes + entry.length > self.max_bytes:
+            self.evict(next(iter(self.entries)))
+        self.entries[key] = entry
+        self.current_bytes += entry.length
+        self.misses.pop(key, None)
+
+    def evict(self, key: tuple):
+        """
+        :param key: (resolved path, content coding)
+        :return: None
+        """
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry.length
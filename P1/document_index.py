@@ -0,0 +1,325 @@
+import os
+import sys
+import time
+import stat
+import posixpath
+import mimetypes
+import urllib.parse
+from compression import create_negotiated_response
+from static_files import FileBody, HTML_CONTENT_TYPE, create_response
+
+# Seconds between two checks of the indexed directories for added, removed or renamed files
+DEFAULT_REFRESH_INTERVAL = 2.0
+
+# File answering a request for a directory
+DIRECTORY_INDEX_FILE = "index.html"
+
+# File extensions which are served, every other indexed file is answered with 403 Forbidden.
+# Compared case-sensitively, so the answer does not depend on the mimetypes database of the host
+SERVABLE_EXTENSIONS = (".html", ".htm")
+
+
+class IndexEntry:
+    """
+    A file below the document root: its resolved path, its metadata at scan time and its media type.
+    """
+
+    def __init__(self, path: str, stat_result: os.stat_result):
+        self.path = path
+        self.size = stat_result.st_size
+        self.mtime_ns = stat_result.st_mtime_ns
+        self.content_type = guess_content_type(path)
+
+    @property
+    def servable(self) -> bool:
+        return os.path.splitext(self.path)[1] in SERVABLE_EXTENSIONS
+
+
+def guess_content_type(path: str) -> str:
+    """
+    :param path: Path of a file
+    :return: Media type derived from the file extension, HTML_CONTENT_TYPE for .html and .htm files
+    Only used for the Content-Type value, whether a file is served depends on SERVABLE_EXTENSIONS.
+    """
+    content_type, content_encoding = mimetypes.guess_type(path, strict=False)
+    if content_encoding is not None or content_type is None:
+        # Compressed siblings such as index.html.gz are not served on their own
+        return "application/octet-stream"
+    if content_type == "text/html":
+        return HTML_CONTENT_TYPE
+    return content_type
+
+
+def normalize_target(target: str):
+    """
+    :param target: Request target as sent by the client
+    :return: Normalized URL path, or None if the target is malformed or climbs above the root with ".."
+    The query string and fragment are dropped and percent-escapes are decoded before normalizing,
+    so "/a/%2e%2e/index.html" and "/a/../index.html" both resolve to "/index.html".
+    """
+    path = target.split("?", 1)[0].split("#", 1)[0]
+    try:
+        path = urllib.parse.unquote(path, errors="strict")
+    except UnicodeDecodeError:
+        return None
+    if not path.startswith("/") or "\x00" in path or "\\" in path:
+        return None
+
+    depth = 0
+    for segment in path.split("/"):
+        if segment == "..":
+            depth -= 1
+            if depth < 0:
+                return None
+        elif segment and segment != ".":
+            depth += 1
+
+    # normpath keeps a leading "//", which would never match an index entry
+    normalized = "/" + posixpath.normpath(path).lstrip("/")
+    if path.endswith("/") and normalized != "/":
+        # The trailing slash marks a directory request
+        normalized += "/"
+    return normalized
+
+
+class DocumentIndex:
+    """
+    Index of the files below a document root, built once at startup, mapping each normalized URL path to an
+    IndexEntry. A request is resolved with one dictionary lookup; paths which are not in the index, including
+    every path outside the root, are not found. Directory URLs ("/" and "/docs/") map to their DIRECTORY_INDEX_FILE.
+    Hidden files and directories, and symbolic links leading outside the root, are never indexed.
+    The standard library offers no inotify binding, so the index is kept current by polling instead:
+    at most once per refresh_interval the modification time of every indexed directory is checked,
+    and only the directories which changed are scanned again.
+    """
+
+    def __init__(self, root: str, refresh_interval: float = DEFAULT_REFRESH_INTERVAL):
+        self.root = os.path.realpath(root)
+        self.refresh_interval = refresh_interval
+
+        # Maps URL paths to IndexEntry objects
+        self.entries = {}
+
+        # Maps the URL path of every indexed directory (with trailing slash) to its st_mtime_ns
+        self.directories = {}
+        self.checked_at = None
+
+    def build(self):
+        """
+        :return: None
+        Scans the whole document root.
+        """
+        self.entries = {}
+        self.directories = {}
+        self.scan_tree("/")
+        self.checked_at = time.monotonic()
+        print("Indexed", len(self.entries), "files under", self.root, file=sys.stderr)
+
+    def lookup(self, target: str):
+        """
+        :param target: Request target as sent by the client
+        :return: IndexEntry of the requested file, or None if there is none
+        """
+        if self.checked_at is None:
+            self.build()
+        elif time.monotonic() - self.checked_at >= self.refresh_interval:
+            self.refresh()
+
+        url_path = normalize_target(target)
+        if url_path is None:
+            return None
+        return self.entries.get(url_path)
+
+    def forget(self, target: str):
+        """
+        :param target: Request target whose file turned out to be gone
+        :return: None
+        """
+        url_path = normalize_target(target)
+        if url_path is not None:
+            self.entries.pop(url_path, None)
+
+    def refresh(self):
+        """
+        :return: None
+        Scans again every indexed directory whose modification time changed, and drops the ones which are gone.
+        Creating, removing or renaming a file changes the modification time of its directory,
+        changes to the content of a file are picked up when it is opened.
+        """
+        self.checked_at = time.monotonic()
+        for directory_url in list(self.directories):
+            if directory_url not in self.directories:
+                # Dropped together with a parent directory which is gone
+                continue
+            try:
+                mtime_ns = os.stat(self.file_path(directory_url)).st_mtime_ns
+            except OSError:
+                self.drop_directory(directory_url)
+                continue
+            if mtime_ns != self.directories[directory_url]:
+                self.rescan_directory(directory_url)
+
+    def rescan_directory(self, directory_url: str):
+        """
+        :param directory_url: URL path of an indexed directory, with trailing slash
+        :return: None
+        Replaces the files of the directory in the index, indexes new subdirectories and drops removed ones.
+        """
+        for url_path in [url_path for url_path in self.entries
+                         if url_path.startswith(directory_url) and "/" not in url_path[len(directory_url):]]:
+            del self.entries[url_path]
+        old_subdirectories = [url_path for url_path in self.directories if url_path.startswith(directory_url) and
+                              url_path != directory_url and "/" not in url_path[len(directory_url):-1]]
+
+        subdirectories = self.scan_directory(directory_url)
+        for url_path in old_subdirectories:
+            if url_path not in subdirectories:
+                self.drop_directory(url_path)
+        for url_path in subdirectories:
+            if url_path not in self.directories:
+                self.scan_tree(url_path)
+
+    def drop_directory(self, directory_url: str):
+        """
+        :param directory_url: URL path of an indexed directory, with trailing slash
+        :return: None
+        Removes the directory and everything below it from the index.
+        """
+        for url_path in [url_path for url_path in self.entries if url_path.startswith(directory_url)]:
+            del self.entries[url_path]
+        for url_path in [url_path for url_path in self.directories if url_path.startswith(directory_url)]:
+            del self.directories[url_path]
+
+    def scan_tree(self, directory_url: str):
+        """
+        :param directory_url: URL path of the directory to scan, with trailing slash
+        :return: None
+        Adds the files of the directory and of all its subdirectories to the index.
+        """
+        pending = [directory_url]
+        while pending:
+            pending.extend(self.scan_directory(pending.pop()))
+
+    def scan_directory(self, directory_url: str) -> list:
+        """
+        :param directory_url: URL path of the directory to scan, with trailing slash
+        :return: URL paths of its subdirectories, with trailing slash
+        Adds the files directly inside the directory to the index and records its modification time.
+        Symbolic links to files are followed when they stay below the root, symbolic links to directories
+        are not, so a link cycle cannot make the index grow without bounds.
+        """
+        directory_path = self.file_path(directory_url)
+        try:
+            self.directories[directory_url] = os.stat(directory_path).st_mtime_ns
+            with os.scandir(directory_path) as directory_entries:
+                directory_entries = list(directory_entries)
+        except OSError as e:
+            print("Could not index", directory_path, e, file=sys.stderr)
+            self.directories.pop(directory_url, None)
+            return []
+
+        subdirectories = []
+        for directory_entry in directory_entries:
+            if directory_entry.name.startswith("."):
+                continue
+            url_path = directory_url + directory_entry.name
+            try:
+                if directory_entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(url_path + "/")
+                    continue
+                if directory_entry.is_symlink() and not self.contains(os.path.realpath(directory_entry.path)):
+                    continue
+                stat_result = os.stat(directory_entry.path)
+            except OSError:
+                continue
+            if stat.S_ISREG(stat_result.st_mode):
+                self.entries[url_path] = IndexEntry(directory_entry.path, stat_result)
+
+        index_entry = self.entries.get(directory_url + DIRECTORY_INDEX_FILE)
+        if index_entry is not None:
+            self.entries[directory_url] = index_entry
+        return subdirectories
+
+    def contains(self, path: str) -> bool:
+        """
+        :param path: Resolved path
+        :return: True if the path is the document root or below it
+        """
+        return path == self.root or path.startswith(self.root + os.sep)
+
+    def file_path(self, url_path: str) -> str:
+        """
+        :param url_path: Normalized URL path
+        :return: Path of the file or directory below the document root
+        """
+        return self.root + url_path.rstrip("/")
+
+
+class StaticResponder:
+    """
+    Answers GET requests for the files below a document root, shared by http_server1 and http_server2.
+    Each server process passes in its own document index, static cache and compression cache,
+    and the function its per-request diagnostic prints go through.
+    """
+
+    def __init__(self, document_index: DocumentIndex, static_cache, compression_cache, verbose=print):
+        self.document_index = document_index
+        self.static_cache = static_cache
+        self.compression_cache = compression_cache
+        self.verbose = verbose
+
+    def get_response_for_requested_file(self, requested_file, keep_alive=False, request_headers=None):
+        """
+        :param requested_file: Requested file
+        :param keep_alive: Whether the connection stays open after the response
+        :param request_headers: Request headers with lower case names
+        :return: Response parts for requested file
+        Resolves the request target with a lookup in the document index, which also rejects paths leaving the root.
+        Determines which status code should be shown in the HTTP response.
+        Files found in the static cache are answered from memory without touching the file system.
+        Clients accepting a content coding get a precompressed or cached compressed variant when one is available.
+        A file which cannot be opened is answered with 403 Forbidden if it is not readable, 500 otherwise,
+        so the connection stays framed and pipelined requests behind it are still served.
+        """
+        self.verbose("File name = ", requested_file)
+        if request_headers is None:
+            request_headers = {}
+
+        index_entry = self.document_index.lookup(requested_file)
+        if index_entry is None:
+            # Neither in the index nor below the document root
+            self.verbose("404 Not Found")
+            return create_response(404, "Not Found", None, keep_alive)
+        path = index_entry.path
+
+        cache_entry = self.static_cache.get(path)
+        if cache_entry is not None:
+            # Only files which passed the checks below are ever cached
+            return create_negotiated_response(self.compression_cache, path, cache_entry, request_headers, keep_alive)
+
+        self.verbose("File Exists")
+        if not index_entry.servable:
+            # If the file exists but is not an HTML document, a 403 error response is sent
+            self.verbose("403 Forbidden")
+            return create_response(403, "Forbidden", None, keep_alive)
+
+        try:
+            cache_entry = self.static_cache.load(path)
+            if cache_entry is not None:
+                return create_negotiated_response(self.compression_cache, path, cache_entry, request_headers,
+                                                  keep_alive)
+            file_body = FileBody.open(path)
+        except FileNotFoundError:
+            # Removed since the index was last refreshed
+            self.document_index.forget(requested_file)
+            self.verbose("404 Not Found")
+            return create_response(404, "Not Found", None, keep_alive)
+        except PermissionError:
+            # The file exists but the server process may not read it
+            self.verbose("403 Forbidden")
+            return create_response(403, "Forbidden", None, keep_alive)
+        except OSError as e:
+            print("Could not open", path, e, file=sys.stderr)
+            return create_response(500, "Internal Server Error", None, keep_alive)
+        # Files too large for the cache are streamed from their descriptor, they are never read into memory
+        return create_negotiated_response(self.compression_cache, path, file_body, request_headers, keep_alive)
@@ -1,179 +1,839 @@
+import io
+import re
 import sys
+import json
+import time
 import socket
+import argparse
+import threading
+import functools
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from client_cache import DnsCache, RedirectCache, DEFAULT_DNS_TTL, DEFAULT_REDIRECT_CACHE_PATH
 
-recursion_count = 0
+# Largest number of redirects followed for a single URL
+MAX_REDIRECTS = 10
 
+# Seconds a connection attempt or a single socket read may take
+DEFAULT_TIMEOUT = 10
 
-def perform_http_get(queried_url: str):
+# Number of URLs fetched at the same time in batch mode
+DEFAULT_CONCURRENCY = 8
+
+# Number of connections kept open to a single host
+DEFAULT_MAX_PER_HOST = 4
+
+# Number of bytes read from a connection at once
+RECV_SIZE = 65536
+
+# Largest status line plus headers accepted from a server
+MAX_HEADER_BYTES = 64 * 1024
+
+# Size of the single buffer a response body is streamed through
+STREAM_BUFFER_SIZE = 64 * 1024
+
+# Numbers sent by servers and found in URLs, str.isdigit and int(..., 16) also accept "²", "0x", "_" and "+"
+DECIMAL_NUMBER = re.compile(r"[0-9]+")
+HEXADECIMAL_NUMBER = re.compile(rb"[0-9A-Fa-f]+")
+
+
+# Resolved addresses shared by every connection pool of the process
+dns_cache = DnsCache()
+
+
+class HttpClientError(Exception):
     """
-    :param queried_url: URL entered as an argument to the program
-    :return: None
-    Performs HTTP GET request if the maximum recursion limit is not exceeded.
+    Raised when a URL cannot be fetched: unsupported URL, malformed response or too many redirects.
     """
-    if recursion_count >= 10:
-        sys.stderr.write("Maximum number of redirects exceeded\n")
-        sys.exit(7)
 
-    check_url_correctness(queried_url)
-    get_http_get_response(queried_url)
 
+class HttpResponse:
+    """
+    A response received from a server.
+    Header names are stored in lower case; repeated headers are joined with ", ".
+    The status line and headers are parsed first; the body stays on the connection until it is
+    streamed with stream_to, read into memory with read, or dropped with discard or close.
+    """
+
+    # How the end of the body is found
+    NO_BODY = 0
+    LENGTH_BODY = 1
+    CHUNKED_BODY = 2
+    CLOSE_DELIMITED_BODY = 3
+
+    def __init__(self, url: str, status_code: int, phrase: str, headers: dict):
+        self.url = url
+        self.status_code = status_code
+        self.phrase = phrase
+        self.headers = headers
+
+        # Body bytes once read into memory, and the number of body bytes received
+        self.body = b""
+        self.body_length = 0
+
+        # (status code, Location) of every redirect followed before this response
+        self.redirects = []
+
+        self.framing = HttpResponse.NO_BODY
+        self.content_length = 0
 
-def check_argument_correctness(args: list):
+        # Connection the body is read from, and the function giving it back once the body is consumed
+        self.connection = None
+        self.release_connection = None
+        self.reusable = False
+
+    @property
+    def content_type(self) -> str:
+        return self.headers.get("content-type", "")
+
+    def stream_to(self, sink, buffer_size: int = STREAM_BUFFER_SIZE) -> int:
+        """
+        :param sink: Object with a write method, it receives the body in pieces of at most buffer_size bytes
+        :param buffer_size: Size of the buffer the body is received into
+        :return: Length of the body in bytes
+        Every piece is a view of the same fixed-size buffer, so memory use does not depend on the body size;
+        a sink keeping the data has to copy it.
+        The connection goes back to the pool once the whole body has been read.
+        """
+        if self.connection is None:
+            raise HttpClientError("Response body has already been consumed")
+        connection = self.connection
+        self.connection = None
+        buffer = memoryview(bytearray(buffer_size))
+        complete = False
+        try:
+            if self.framing == HttpResponse.LENGTH_BODY:
+                self.body_length = connection.copy_to(sink, buffer, self.content_length)
+            elif self.framing == HttpResponse.CHUNKED_BODY:
+                self.body_length = copy_chunked_body(connection, sink, buffer)
+            elif self.framing == HttpResponse.CLOSE_DELIMITED_BODY:
+                self.body_length = connection.copy_to(sink, buffer)
+            complete = True
+        finally:
+            self.release_connection(connection, complete and self.reusable)
+        return self.body_length
+
+    def read(self) -> bytes:
+        """
+        :return: The whole body, which is also kept in body
+        """
+        body_sink = io.BytesIO()
+        self.stream_to(body_sink)
+        self.body = body_sink.getvalue()
+        return self.body
+
+    def discard(self):
+        """
+        :return: None
+        Reads and drops the body, so the connection can carry the next request.
+        """
+        self.stream_to(NullSink())
+
+    def close(self):
+        """
+        :return: None
+        Gives the connection back without reading the body, which makes the connection unusable.
+        """
+        if self.connection is not None:
+            connection = self.connection
+            self.connection = None
+            self.release_connection(connection, False)
+
+    def text(self) -> str:
+        """
+        :return: Body decoded as UTF-8, undecodable bytes are dropped
+        """
+        return self.body.decode("utf-8", "ignore")
+
+
+class HttpConnection:
     """
-    :param args: List of arguments passed during program execution
-    :return: None
-    Checks the number of arguments passed to the program.
-    If more or less than 2 parameters are passed the program would exit with a non-zero code.
+    A persistent connection to one host, together with the bytes received but not consumed yet.
     """
-    if len(args) != 2:
-        sys.stderr.write("Enter in format: python3 http_client.py http://<url>\n")
-        sys.exit(7)
 
+    def __init__(self, host_name: str, port: int, timeout: float = DEFAULT_TIMEOUT, resolver: DnsCache = None):
+        self.conn_socket = open_socket(host_name, port, timeout, resolver or dns_cache)
+        self.conn_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = bytearray()
+        self.requests_sent = 0
+
+    def receive(self) -> bool:
+        """
+        :return: False once the server has closed the connection
+        """
+        message = self.conn_socket.recv(RECV_SIZE)
+        self.buffer += message
+        return len(message) > 0
+
+    def read_line(self) -> bytes:
+        """
+        :return: Next CRLF terminated line without its terminator
+        """
+        while True:
+            line_end = self.buffer.find(b"\r\n")
+            if line_end != -1:
+                line = bytes(self.buffer[:line_end])
+                del self.buffer[:line_end + 2]
+                return line
+            if len(self.buffer) > MAX_HEADER_BYTES:
+                raise HttpClientError("Response line too long")
+            if not self.receive():
+                raise HttpClientError("Connection closed before the response was complete")
+
+    def read_into(self, view: memoryview) -> int:
+        """
+        :param view: Buffer the bytes are written to
+        :return: Number of bytes written, 0 once the server has closed the connection
+        Bytes left over from reading the header are returned first, then the socket is read directly into view.
+        """
+        if self.buffer:
+            length = min(len(view), len(self.buffer))
+            view[:length] = self.buffer[:length]
+            del self.buffer[:length]
+            return length
+        return self.conn_socket.recv_into(view)
+
+    def copy_to(self, sink, buffer: memoryview, length: int = None) -> int:
+        """
+        :param sink: Object with a write method
+        :param buffer: Buffer the bytes are received into before being written to sink
+        :param length: Number of bytes to copy, None copies until the server closes the connection
+        :return: Number of bytes copied
+        """
+        copied = 0
+        while length is None or copied < length:
+            view = buffer if length is None else buffer[:min(len(buffer), length - copied)]
+            received = self.read_into(view)
+            if received == 0:
+                if length is None:
+                    break
+                raise HttpClientError("Connection closed before the response was complete")
+            sink.write(view[:received])
+            copied += received
+        return copied
 
-def check_url_correctness(url: str):
+    def close(self):
+        self.conn_socket.close()
+
+
+def open_socket(host_name: str, port: int, timeout: float, resolver: DnsCache):
     """
-    :param url: URL entered
-    :return: None
-    Checks correctness on the URL entered for the program.
-    If the URL entered follows an HTTPS protocol or any unsupported protocol, program exits with a non-zero code.
+    :param host_name: Host to connect to
+    :param port: Port to connect to
+    :param timeout: Seconds a connection attempt may take
+    :param resolver: Cache the addresses of the host are looked up in
+    :return: Socket connected to the first address of the host which accepts the connection
+    If no address accepts the connection the cached addresses of the port are dropped, so the next attempt resolves
+    again while the entries of the other ports of the host stay cached.
     """
-    if url[0:8] == "https://":
-        sys.stderr.write("HTTPS not supported\n")
-        sys.exit(7)
+    last_error = None
+    for family, socket_type, protocol, _, address in resolver.resolve(host_name, port):
+        # Creates a socket via which communication takes place.
+        # Following the python socket programming documentation found online
+        conn_socket = socket.socket(family, socket_type, protocol)
+        try:
+            conn_socket.settimeout(timeout)
+            conn_socket.connect(address)
+            return conn_socket
+        except OSError as e:
+            conn_socket.close()
+            last_error = e
+    resolver.invalidate(host_name, port)
+    raise last_error or OSError("No address found for " + host_name)
 
-    if url[0:7] != "http://":
-        sys.stderr.write("Enter in format: python3 http_client.py http://<url>/<path>\n")
+
+class NullSink:
+    """
+    Sink dropping everything written to it.
+    """
+
+    def write(self, data) -> int:
+        return len(data)
+
+
+class HtmlContentFilter:
+    """
+    Sink passing on the HTML document of a body to output: from the first doctype or <html tag
+    to the first </html> tag, both included.
+    Bytes are scanned as they arrive, keeping only enough of the previous piece to find tags split across pieces.
+    """
+
+    START_TAGS = (b"<!DOCTYPE html", b"<!doctype html", b"<html")
+    END_TAG = b"</html>"
+
+    def __init__(self, output):
+        self.output = output
+        self.started = False
+        self.finished = False
+
+        # Bytes held back because a tag may continue in the next piece
+        self.tail = b""
+
+    def write(self, data) -> int:
+        """
+        :param data: Next piece of the body
+        :return: Number of bytes consumed
+        """
+        if self.finished:
+            return len(data)
+        window = self.tail + bytes(data)
+
+        if not self.started:
+            start_positions = [position for position in (window.find(tag) for tag in HtmlContentFilter.START_TAGS)
+                               if position != -1]
+            if not start_positions:
+                self.tail = window[-(len(HtmlContentFilter.START_TAGS[0]) - 1):]
+                return len(data)
+            self.started = True
+            window = window[min(start_positions):]
+
+        end_position = window.find(HtmlContentFilter.END_TAG)
+        if end_position != -1:
+            self.output.write(window[:end_position + len(HtmlContentFilter.END_TAG)])
+            self.finished = True
+            self.tail = b""
+            return len(data)
+
+        held_back = len(HtmlContentFilter.END_TAG) - 1
+        self.output.write(window[:-held_back])
+        self.tail = window[-held_back:]
+        return len(data)
+
+    def flush(self):
+        """
+        :return: None
+        Writes the bytes held back, for documents without a closing </html> tag.
+        """
+        if self.started and not self.finished:
+            self.output.write(self.tail)
+        self.tail = b""
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections shared by concurrent fetches, keyed by (host, port).
+    At most max_per_host connections to a single host are in use at the same time;
+    further fetches to that host wait for a connection to be released.
+    """
+
+    def __init__(self, max_per_host: int = DEFAULT_MAX_PER_HOST, timeout: float = DEFAULT_TIMEOUT,
+                 resolver: DnsCache = None):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.resolver = resolver or dns_cache
+        self.lock = threading.Lock()
+
+        # Idle connections and connection slots of every host
+        self.idle = {}
+        self.slots = {}
+
+    def acquire(self, host_name: str, port: int):
+        """
+        :param host_name: Host to connect to
+        :param port: Port to connect to
+        :return: Tuple of an HttpConnection and whether it was reused from an earlier request
+        """
+        key = (host_name, port)
+        with self.lock:
+            slot = self.slots.setdefault(key, threading.BoundedSemaphore(self.max_per_host))
+        slot.acquire()
+        with self.lock:
+            idle_connections = self.idle.get(key)
+            if idle_connections:
+                return idle_connections.pop(), True
+        try:
+            return HttpConnection(host_name, port, self.timeout, self.resolver), False
+        except BaseException:
+            slot.release()
+            raise
+
+    def release(self, host_name: str, port: int, connection: HttpConnection, reusable: bool):
+        """
+        :param host_name: Host the connection belongs to
+        :param port: Port the connection belongs to
+        :param connection: Connection acquired with acquire
+        :param reusable: Whether the connection can carry another request
+        :return: None
+        """
+        key = (host_name, port)
+        if reusable:
+            with self.lock:
+                self.idle.setdefault(key, []).append(connection)
+        else:
+            connection.close()
+        self.slots[key].release()
+
+    def close(self):
+        """
+        :return: None
+        Closes every idle connection.
+        """
+        with self.lock:
+            for idle_connections in self.idle.values():
+                for connection in idle_connections:
+                    connection.close()
+            self.idle.clear()
+
+
+def check_argument_correctness(args: list) -> dict:
+    """
+    :param args: List of arguments passed during program execution
+    :return: Redirect cache options given after the URL
+    Checks the arguments passed to the program, unless they start with "--batch".
+    The URL may be followed by "--redirect-cache <file>", "--no-redirect-cache" and "--clear-redirect-cache"
+    in any order, like in batch mode. Without a URL, or with any other argument, the program would exit
+    with a non-zero code.
+    """
+    options = {"redirect_cache": DEFAULT_REDIRECT_CACHE_PATH, "no_redirect_cache": False,
+               "clear_redirect_cache": False}
+    index = 2
+    valid = len(args) >= 2 and not args[1].startswith("--")
+    while valid and index < len(args):
+        if args[index] == "--no-redirect-cache":
+            options["no_redirect_cache"] = True
+            index += 1
+        elif args[index] == "--clear-redirect-cache":
+            options["clear_redirect_cache"] = True
+            index += 1
+        elif args[index] == "--redirect-cache" and index + 1 < len(args):
+            options["redirect_cache"] = args[index + 1]
+            index += 2
+        else:
+            valid = False
+    if not valid:
+        sys.stderr.write("Enter in format: python3 http_client.py http://<url> [--redirect-cache <file>] "
+                         "[--no-redirect-cache] [--clear-redirect-cache]\n" +
+                         "             or: python3 http_client.py --batch <file> [--concurrency N] "
+                         "[--per-host N] [--jsonl <file>]\n")
         sys.exit(7)
+    return options
 
 
-def get_http_get_response(url: str):
+def parse_url(url: str) -> tuple:
     """
-    :param url: URL entered
-    :return: None
-    Creates a socket to connect to the server to query the requested URL.
-    Parses the URL to split and create a valid HTTP request message to be sent.
+    :param url: URL to be fetched
+    :return: Tuple of the host name, the port number and the path
+    Checks correctness on the URL.
+    URLs following an HTTPS protocol or any unsupported protocol raise HttpClientError.
     """
+    if url[0:8] == "https://":
+        raise HttpClientError("HTTPS not supported")
+
+    if url[0:7] != "http://":
+        raise HttpClientError("Enter in format: python3 http_client.py http://<url>/<path>")
+
     url = url[7:]
-    splitted_url = url.split("/")
-    url_host = splitted_url[0]
+    path_addr_index = url.find("/")
+    if path_addr_index != -1:
+        # Check to see if the URL contains a path name
+        url_host = url[:path_addr_index]
+        path = url[path_addr_index:]
+    else:
+        url_host = url
+        path = "/"
+
     port = 80
+    host_name = url_host
     if url_host.find(":") != -1:
         # Check to see if a port number is passed in the URL
-        port_index = url.find(":")
-        port = url_host[port_index + 1:]
+        host_name, port = url_host.split(":", 1)
+        if not DECIMAL_NUMBER.fullmatch(port):
+            raise HttpClientError("Invalid port number in URL")
         port = int(port)
-        host_name = url_host[0:port_index]
+    if not host_name:
+        raise HttpClientError("Missing host name in URL")
+    return host_name, port, path
+
+
+def fetch(url: str, pool: ConnectionPool = None, sink=None, max_redirects: int = MAX_REDIRECTS,
+          redirect_cache: RedirectCache = None) -> HttpResponse:
+    """
+    :param url: URL to be fetched
+    :param pool: Connection pool to send the requests over, a private pool is used when None
+    :param sink: Object with a write method the final body is streamed to, the body is kept in memory when None
+    :param max_redirects: Largest number of 301, 302, 303, 307 or 308 redirects followed
+    :param redirect_cache: Cache of permanent redirects, known hops are skipped without a request
+    :return: Final response, with the redirects which led to it
+    Raises HttpClientError, or OSError for network errors.
+    """
+    private_pool = pool is None
+    if private_pool:
+        pool = ConnectionPool()
+    try:
+        response = open_url(url, pool, max_redirects, redirect_cache)
+        if sink is None:
+            response.read()
+        else:
+            response.stream_to(sink)
+        return response
+    finally:
+        if private_pool:
+            pool.close()
+
+
+def open_url(url: str, pool: ConnectionPool, max_redirects: int = MAX_REDIRECTS,
+             redirect_cache: RedirectCache = None) -> HttpResponse:
+    """
+    :param url: URL to be fetched
+    :param pool: Connection pool to send the requests over
+    :param max_redirects: Largest number of 301, 302, 303, 307 or 308 redirects followed
+    :param redirect_cache: Cache of permanent redirects, known hops are skipped without a request
+    :return: Final response, whose body has not been read yet
+    Performs HTTP GET requests until a response which is not a redirect is received.
+    Every 301 received is stored in redirect_cache.
+    The caller has to consume the body with stream_to, read, discard or close.
+    """
+    redirects = []
+    cached_urls = []
+    while True:
+        location = redirect_cache.get(url) if redirect_cache is not None else None
+        if location is not None:
+            status_code = 301
+            cached_urls.append(url)
+        else:
+            response = fetch_once(url, pool)
+            location = response.headers.get("location")
+            if response.status_code not in (301, 302, 303, 307, 308) or location is None:
+                response.redirects = redirects
+                return response
+            response.discard()
+            status_code = response.status_code
+            location = urllib.parse.urljoin(url, location.strip())
+            if status_code == 301 and redirect_cache is not None:
+                redirect_cache.put(url, location)
+
+        if len(redirects) >= max_redirects:
+            # A cached chain may have turned into a loop, it is looked up again next time
+            for cached_url in cached_urls:
+                redirect_cache.invalidate(cached_url)
+            raise HttpClientError("Maximum number of redirects exceeded")
+        url = location
+        redirects.append((status_code, url))
+
+
+def fetch_once(url: str, pool: ConnectionPool) -> HttpResponse:
+    """
+    :param url: URL to be fetched
+    :param pool: Connection pool to send the request over
+    :return: Response of a single HTTP GET request, whose body has not been read yet
+    A request failing on a reused connection before any response byte arrived is retried once on a new
+    connection, since the server may have closed the idle connection in the meantime.
+    """
+    host_name, port, path = parse_url(url)
+    host_header = host_name if port == 80 else host_name + ":" + str(port)
+    client_data = ("GET " + path + " HTTP/1.1\r\nHost: " + host_header + "\r\n" +
+                   "Connection: keep-alive\r\n\r\n").encode()
+
+    while True:
+        connection, reused = pool.acquire(host_name, port)
+        try:
+            connection.conn_socket.sendall(client_data)
+            connection.requests_sent += 1
+            if reused and not connection.buffer and not connection.receive():
+                # Stale keep-alive connection, the server closed it while it was idle
+                pool.release(host_name, port, connection, False)
+                continue
+            response = read_response_head(connection, url)
+        except OSError as e:
+            pool.release(host_name, port, connection, False)
+            if reused and not connection.buffer and not isinstance(e, socket.timeout):
+                continue
+            raise
+        except BaseException:
+            pool.release(host_name, port, connection, False)
+            raise
+        response.connection = connection
+        response.release_connection = functools.partial(pool.release, host_name, port)
+        return response
+
+
+def read_response_head(connection: HttpConnection, url: str) -> HttpResponse:
+    """
+    :param connection: Connection the request was sent over
+    :param url: URL the request was sent for
+    :return: HttpResponse with its status line and headers
+    Determines whether the body is framed by chunked transfer coding, by Content-Length
+    or by the server closing the connection, and whether the connection can carry another request.
+    """
+    http_response_message = connection.read_line().decode("utf-8", "ignore")
+    status_text = http_response_message.split(" ", 2)
+    if len(status_text) < 2 or not status_text[0].startswith("HTTP/") or not DECIMAL_NUMBER.fullmatch(status_text[1]):
+        raise HttpClientError("Malformed status line: " + http_response_message)
+    http_version = status_text[0]
+    status_code = int(status_text[1])
+    phrase = status_text[2] if len(status_text) == 3 else ""
+
+    http_fields_dict = {}
+    while True:
+        field = connection.read_line().decode("utf-8", "ignore")
+        if not field:
+            break
+        # Creating a dictionary storing the HTTP response headers and their values
+        key, separator, value = field.partition(":")
+        if not separator:
+            raise HttpClientError("Malformed header line: " + field)
+        key = key.strip().lower()
+        value = value.strip()
+        http_fields_dict[key] = http_fields_dict[key] + ", " + value if key in http_fields_dict else value
+
+    response = HttpResponse(url, status_code, phrase, http_fields_dict)
+    connection_tokens = [token.strip().lower() for token in http_fields_dict.get("connection", "").split(",")]
+    if "close" in connection_tokens:
+        response.reusable = False
     else:
-        host_name = url_host
+        response.reusable = http_version == "HTTP/1.1" or "keep-alive" in connection_tokens
 
-    path_addr_index = url.find("/")
-    if path_addr_index != -1:
-        # Check to see if the URL contains a path name
-        path = "/" + url[path_addr_index + 1:]
+    if status_code < 200 or status_code in (204, 304):
+        response.framing = HttpResponse.NO_BODY
+    elif http_fields_dict.get("transfer-encoding", "").lower().endswith("chunked"):
+        response.framing = HttpResponse.CHUNKED_BODY
+    elif "content-length" in http_fields_dict:
+        content_length = http_fields_dict["content-length"]
+        if not DECIMAL_NUMBER.fullmatch(content_length):
+            raise HttpClientError("Invalid Content-Length: " + content_length)
+        response.framing = HttpResponse.LENGTH_BODY
+        response.content_length = int(content_length)
     else:
-        path = "/"
+        response.framing = HttpResponse.CLOSE_DELIMITED_BODY
+        response.reusable = False
+    return response
+
+
+def copy_chunked_body(connection: HttpConnection, sink, buffer: memoryview) -> int:
+    """
+    :param connection: Connection the body is read from
+    :param sink: Object with a write method the decoded body is written to
+    :param buffer: Buffer the chunk data is received into
+    :return: Length of the decoded body in bytes
+    """
+    body_length = 0
+    while True:
+        chunk_size = connection.read_line().split(b";", 1)[0].strip()
+        if not HEXADECIMAL_NUMBER.fullmatch(chunk_size):
+            raise HttpClientError("Invalid chunk size")
+        chunk_size = int(chunk_size, 16)
+        if chunk_size == 0:
+            break
+        body_length += connection.copy_to(sink, buffer, chunk_size)
+        if connection.read_line():
+            raise HttpClientError("Missing CRLF after chunk")
+    # Trailer fields end with an empty line
+    while connection.read_line():
+        pass
+    return body_length
+
+
+def fetch_all(urls: list, concurrency: int = DEFAULT_CONCURRENCY, max_per_host: int = DEFAULT_MAX_PER_HOST,
+              timeout: float = DEFAULT_TIMEOUT, keep_bodies: bool = True, redirect_cache: RedirectCache = None):
+    """
+    :param urls: URLs to be fetched
+    :param concurrency: Number of URLs fetched at the same time
+    :param max_per_host: Number of connections kept open to a single host
+    :param timeout: Seconds a connection attempt or a single socket read may take
+    :param keep_bodies: Whether bodies are kept in memory, otherwise only their length is counted
+    :param redirect_cache: Cache of permanent redirects shared by the fetches
+    :return: Generator of (url, HttpResponse or None, error message or None, elapsed seconds) tuples,
+             in the order the fetches complete
+    """
+    pool = ConnectionPool(max_per_host, timeout)
 
-    conn_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    # Creates a socket via which communication takes place.
-    # Following the python socket programming documentation found online
-    conn_socket.connect((host_name, port))
+    def timed_fetch(url):
+        started_at = time.monotonic()
+        try:
+            response = fetch(url, pool, None if keep_bodies else NullSink(), redirect_cache=redirect_cache)
+            return url, response, None, time.monotonic() - started_at
+        except (HttpClientError, OSError) as e:
+            return url, None, str(e) or type(e).__name__, time.monotonic() - started_at
 
-    client_data = "GET " + path + " HTTP/1.0\r\nHost: " + host_name + "\r\n\r\n"
-    conn_socket.sendall(client_data.encode())
-    message = receive_socket_data(conn_socket)
-    conn_socket.close()
-    # Closing the socket connection once the response has been received
-    parse_http_response(message)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(timed_fetch, url) for url in urls]
+            for future in as_completed(futures):
+                yield future.result()
+    finally:
+        pool.close()
 
 
-def parse_http_response(response: str):
+def perform_http_get(queried_url: str, redirect_cache: RedirectCache = None):
     """
-    :param response: Response received from the server
+    :param queried_url: URL entered as an argument to the program
+    :param redirect_cache: Cache of permanent redirects, every redirect is followed over the network when None
     :return: None
-    Performs parsing of the response received from the server.
-    Handles different status codes.
-    Performs redirection upon receiving 301 or 302 code.
-    """
-    arr = response.split("\r\n\r\n")
-    # Response ends with the sequence of characters as found on Wireshark
-    http_headers = arr[0]
-    http_response_content = arr[1]
-    http_fields = http_headers.split("\r\n")
-    http_response_message = http_fields[0]
-    http_fields = http_fields[1:]
-    http_fields_dict = {}
-    for field in http_fields:
-        # Creating a dictionary storing the HTTP response headers and their values
-        key, value = field.split(":", 1)
-        http_fields_dict[key] = value
+    Performs HTTP GET request, following redirects if the maximum redirect limit is not exceeded.
+    Handles different status codes and exits with a non-zero code on failure.
+    The HTML content of the body is streamed to stdout as it arrives.
+    Permanent redirects are remembered in the on-disk redirect cache between runs.
+    """
+    pool = ConnectionPool()
+    try:
+        response = open_url(queried_url, pool, redirect_cache=redirect_cache)
+    except (HttpClientError, OSError) as e:
+        sys.stderr.write(str(e) + "\n")
+        sys.exit(7)
+    finally:
+        if redirect_cache is not None:
+            save_redirect_cache(redirect_cache)
+
+    for status_code, new_url in response.redirects:
+        sys.stderr.write("Redirected to: " + new_url)
+        if status_code == 301:
+            sys.stderr.write("\n" + str(status_code) + " Resource Moved Permanently\n")
+        elif status_code == 302:
+            sys.stderr.write("\n" + str(status_code) + " Resource Temporarily Moved\n")
+        else:
+            sys.stderr.write("\n" + str(status_code) + " Resource Redirected\n")
 
-    if "text/html" not in http_fields_dict["Content-Type"]:
+    if "text/html" not in response.content_type:
+        response.close()
         sys.stderr.write("Content type is not text/html\n")
         sys.exit(7)
 
-    http_version = http_response_message[:8]
-    status_message = http_response_message[9:]
-    status_code = int(status_message.split(" ")[0])
-    phrase = " ".join(status_message.split(" ")[1:])
-    # Extracting the status code and phrase
-
-    if status_code >= 400:
-        content = get_body_content(http_response_content)
-        sys.stderr.write("Encountered " + str(status_code) + "\n")
-        sys.stdout.write(content + "\n")
+    if response.status_code >= 400:
+        sys.stderr.write("Encountered " + str(response.status_code) + "\n")
+        write_body_content(response)
         sys.exit(7)
 
-    elif status_code >= 300:
-        if "Location" in http_fields_dict:
-            new_url = http_fields_dict["Location"]
-            sys.stderr.write("Redirected to: " + new_url)
-            if status_code == 301:
-                sys.stderr.write("\n" + str(status_code) + " Resource Moved Permanently\n")
-            elif status_code == 302:
-                sys.stderr.write("\n" + str(status_code) + " Resource Temporarily Moved\n")
-            global recursion_count
-            recursion_count += 1
-            new_url = new_url.strip()
-            perform_http_get(new_url)
-
-    elif status_code >= 200:
-        body_content = get_body_content(http_response_content)
-        sys.stdout.write(body_content + "\n")
+    elif response.status_code >= 200:
+        write_body_content(response)
         sys.exit(0)
+    response.close()
 
 
-def get_body_content(html_content: str):
+def open_redirect_cache(path: str, disabled: bool, clear: bool):
     """
-    :param html_content: HTTP response content received from the server
-    :return: HTML content with tags
-    Filters the HTML content from the response.
+    :param path: File permanent redirects are remembered in
+    :param disabled: Whether every redirect is followed over the network instead
+    :param clear: Whether the stored redirects are forgotten first
+    :return: RedirectCache, or None if the cache is disabled
     """
-    body_index_start = html_content.find("<!DOCTYPE html")
-    if body_index_start == -1:
-        body_index_start = html_content.find("<!doctype html")
-    if body_index_start == -1:
-        body_index_start = html_content.find("<html")
-    body_index_end = html_content.find("</html>")
-    body_content = html_content[body_index_start:body_index_end + 7]
-    return body_content
+    if disabled:
+        return None
+    redirect_cache = RedirectCache(path)
+    if clear:
+        redirect_cache.invalidate()
+    return redirect_cache
 
 
-def receive_socket_data(conn_socket):
+def save_redirect_cache(redirect_cache: RedirectCache):
     """
-    :param conn_socket: Socket connection created to perform communication with server
-    :return: Response returned by the server
-    Receives the response from the server until the message content is fully received on the socket.
+    :param redirect_cache: Cache of permanent redirects
+    :return: None
+    A cache which cannot be written only costs the skipped hops, so the error is reported and ignored.
     """
-    server_response = ""
-    while True:
-        message = conn_socket.recv(4096)
-        if len(message) == 0:
-            break
-        server_response += message.decode("utf-8", "ignore")
-    return server_response
+    try:
+        redirect_cache.save()
+    except OSError as e:
+        print("Could not save redirect cache", redirect_cache.path, e, file=sys.stderr)
+
+
+def write_body_content(response: HttpResponse):
+    """
+    :param response: Response whose body has not been read yet
+    :return: None
+    Streams the HTML content of the body to stdout.
+    """
+    content_filter = HtmlContentFilter(sys.stdout.buffer)
+    try:
+        response.stream_to(content_filter)
+    except (HttpClientError, OSError) as e:
+        sys.stderr.write(str(e) + "\n")
+        sys.exit(7)
+    content_filter.flush()
+    sys.stdout.buffer.write(b"\n")
+    sys.stdout.flush()
+
+
+def perform_batch_get(args: list):
+    """
+    :param args: Arguments passed after the program name, starting with "--batch"
+    :return: None
+    Fetches every URL of the batch file concurrently over pooled keep-alive connections.
+    One line is written per URL as soon as its fetch completes: a summary line on stdout,
+    or a JSON object including the body when --jsonl is given.
+    Without --jsonl bodies are only counted, so they are never held in memory.
+    Exits with a non-zero code if any URL could not be fetched.
+    """
+    parser = argparse.ArgumentParser(prog="http_client.py")
+    parser.add_argument("--batch", required=True, help="File with one URL per line, - for stdin")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--per-host", type=int, default=DEFAULT_MAX_PER_HOST, help="Connections per host")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument("--jsonl", help="Write one JSON object per URL to this file, - for stdout")
+    parser.add_argument("--redirect-cache", default=DEFAULT_REDIRECT_CACHE_PATH,
+                        help="File permanent redirects are remembered in")
+    parser.add_argument("--no-redirect-cache", action="store_true", help="Follow every redirect over the network")
+    parser.add_argument("--clear-redirect-cache", action="store_true", help="Forget the stored redirects first")
+    parser.add_argument("--dns-ttl", type=float, default=DEFAULT_DNS_TTL, help="Seconds resolved addresses are reused")
+    parser.add_argument("--stats", action="store_true", help="Write DNS and redirect cache statistics to stderr")
+    options = parser.parse_args(args)
+
+    dns_cache.ttl = options.dns_ttl
+    redirect_cache = open_redirect_cache(options.redirect_cache, options.no_redirect_cache,
+                                         options.clear_redirect_cache)
+
+    batch_file = sys.stdin if options.batch == "-" else open(options.batch)
+    with batch_file:
+        urls = [line.strip() for line in batch_file if line.strip() and not line.startswith("#")]
+
+    if options.jsonl is None:
+        output = None
+    elif options.jsonl == "-":
+        output = sys.stdout
+    else:
+        output = open(options.jsonl, "w")
+
+    failures = 0
+    try:
+        results = fetch_all(urls, options.concurrency, options.per_host, options.timeout, output is not None,
+                            redirect_cache)
+        for url, response, error, elapsed in results:
+            if error is not None:
+                failures += 1
+            if output is None:
+                if error is not None:
+                    sys.stdout.write("error " + url + " " + error + "\n")
+                else:
+                    sys.stdout.write(str(response.status_code) + " " + url + " " + str(response.body_length) + "\n")
+                sys.stdout.flush()
+                continue
+
+            record = {"url": url, "elapsed_ms": round(elapsed * 1000, 3)}
+            if error is not None:
+                record["error"] = error
+            else:
+                record.update({
+                    "final_url": response.url,
+                    "status": response.status_code,
+                    "redirects": [status_code for status_code, _ in response.redirects],
+                    "content_type": response.content_type,
+                    "length": response.body_length,
+                    "body": response.text()
+                })
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+    finally:
+        if output is not None and output is not sys.stdout:
+            output.close()
+        if redirect_cache is not None:
+            save_redirect_cache(redirect_cache)
+
+    if options.stats:
+        statistics = {"dns": dns_cache.stats()}
+        if redirect_cache is not None:
+            statistics["redirects"] = redirect_cache.stats()
+        sys.stderr.write(json.dumps(statistics) + "\n")
+
+    if failures:
+        sys.stderr.write(str(failures) + " of " + str(len(urls)) + " URLs could not be fetched\n")
+        sys.exit(7)
 
 
 if __name__ == '__main__':
     requested_url = sys.argv
-    check_argument_correctness(requested_url)
-    perform_http_get(requested_url[1])
+    if len(requested_url) > 1 and requested_url[1] == "--batch":
+        perform_batch_get(requested_url[1:])
+    else:
+        options = check_argument_correctness(requested_url)
+        perform_http_get(requested_url[1], open_redirect_cache(options["redirect_cache"],
+                                                               options["no_redirect_cache"],
+                                                               options["clear_redirect_cache"]))
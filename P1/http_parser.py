@@ -0,0 +1,252 @@
+import re
+
+# Largest request line plus headers accepted by default, longer headers are answered with 431
+MAX_HEADER_BYTES = 16 * 1024
+
+# Largest request body accepted by default, longer bodies are answered with 413
+MAX_BODY_BYTES = 1024 * 1024
+
+# Largest chunk-size line of a chunked body, including chunk extensions
+MAX_CHUNK_LINE_BYTES = 1024
+
+# Content-Length values and chunk sizes, str.isdigit and int(..., 16) also accept "²", "0x", "_" and "+"
+DECIMAL_LENGTH = re.compile(r"[0-9]+")
+HEXADECIMAL_LENGTH = re.compile(rb"[0-9A-Fa-f]+")
+
+
+class HttpParseError(Exception):
+    """
+    Raised when the bytes received cannot be parsed as an HTTP request.
+    The connection has to be closed after the error response, the parser cannot resynchronize.
+    """
+
+    def __init__(self, status_code: int, phrase: str):
+        super().__init__(str(status_code) + " " + phrase)
+        self.status_code = status_code
+        self.phrase = phrase
+
+
+class HttpRequest:
+    """
+    A parsed HTTP request.
+    Header names are stored in lower case; repeated headers are joined with ", ".
+    """
+
+    def __init__(self, method: str, target: str, version: str, headers: dict):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+        self.body = b""
+
+    @property
+    def keep_alive(self) -> bool:
+        """
+        HTTP/1.1 connections are persistent unless the client sends "Connection: close".
+        HTTP/1.0 connections are only persistent when the client sends "Connection: keep-alive".
+        """
+        connection_tokens = [token.strip().lower() for token in self.headers.get("connection", "").split(",")]
+        if "close" in connection_tokens:
+            return False
+        if self.version == "HTTP/1.1":
+            return True
+        return "keep-alive" in connection_tokens
+
+
+class RequestParser:
+    """
+    Incremental, byte-oriented HTTP/1.x request parser shared by the P1 servers.
+    Bytes are appended to a bytearray as they are received, and the search for the end of the header
+    resumes from where the previous search stopped, so parsing stays linear however the bytes are split.
+    Headers are only decoded once they are complete, so multibyte characters split across reads are kept intact.
+    Request bodies framed by Content-Length or by chunked transfer coding are supported.
+    """
+
+    # States of the body of the request being parsed
+    NO_BODY = 0
+    FIXED_BODY = 1
+    CHUNK_SIZE = 2
+    CHUNK_DATA = 3
+    CHUNK_DATA_END = 4
+    CHUNK_TRAILER = 5
+
+    def __init__(self, max_header_bytes: int = MAX_HEADER_BYTES, max_body_bytes: int = MAX_BODY_BYTES):
+        self.max_header_bytes = max_header_bytes
+        self.max_body_bytes = max_body_bytes
+
+        # Bytes received which have not been consumed by a request yet
+        self.buffer = bytearray()
+
+        # Offset from where the next search for the end of the header starts
+        self.scan_offset = 0
+
+        # Request whose header is complete but whose body is still being received
+        self.pending_request = None
+        self.body_state = RequestParser.NO_BODY
+        self.body = bytearray()
+        self.remaining = 0
+
+    def feed(self, data: bytes):
+        """
+        :param data: Bytes received from the connection
+        :return: None
+        """
+        self.buffer += data
+
+    @property
+    def has_partial_request(self) -> bool:
+        """
+        True when some bytes of a request have been received but the request is not complete yet.
+        """
+        return self.pending_request is not None or len(self.buffer) > 0
+
+    def next_request(self):
+        """
+        :return: The next complete HttpRequest, or None if more bytes are needed
+        Raises HttpParseError for malformed requests and requests exceeding the size limits.
+        """
+        if self.pending_request is None:
+            if not self.parse_header():
+                return None
+        if not self.parse_body():
+            return None
+
+        request = self.pending_request
+        request.body = bytes(self.body)
+        self.pending_request = None
+        self.body_state = RequestParser.NO_BODY
+        self.body = bytearray()
+        return request
+
+    def parse_header(self) -> bool:
+        """
+        :return: True once the header of the next request has been parsed into pending_request
+        """
+        # Empty lines before a request line are ignored as recommended by RFC 7230
+        while self.buffer.startswith(b"\r\n"):
+            del self.buffer[:2]
+            self.scan_offset = max(0, self.scan_offset - 2)
+
+        header_end = self.buffer.find(b"\r\n\r\n", self.scan_offset)
+        if header_end == -1:
+            if len(self.buffer) > self.max_header_bytes:
+                raise HttpParseError(431, "Request Header Fields Too Large")
+            # The terminator may straddle two reads, so keep the last three bytes in the next scan
+            self.scan_offset = max(0, len(self.buffer) - 3)
+            return False
+        if header_end + 4 > self.max_header_bytes:
+            raise HttpParseError(431, "Request Header Fields Too Large")
+
+        header_lines = self.buffer[:header_end].decode("UTF-8", "replace").split("\r\n")
+        del self.buffer[:header_end + 4]
+        self.scan_offset = 0
+
+        request_text = header_lines[0].split(" ")
+        if len(request_text) != 3 or not request_text[0] or not request_text[1]:
+            raise HttpParseError(400, "Bad Request")
+
+        headers = {}
+        for header_line in header_lines[1:]:
+            header_name, separator, header_value = header_line.partition(":")
+            if not separator or not header_name or header_name != header_name.strip():
+                # Also rejects obsolete line folding, a continuation line starts with whitespace
+                raise HttpParseError(400, "Bad Request")
+            header_name = header_name.lower()
+            header_value = header_value.strip()
+            if header_name in headers:
+                headers[header_name] += ", " + header_value
+            else:
+                headers[header_name] = header_value
+
+        self.pending_request = HttpRequest(request_text[0], request_text[1], request_text[2], headers)
+        self.start_body(headers)
+        return True
+
+    def start_body(self, headers: dict):
+        """
+        :param headers: Headers of the pending request
+        :return: None
+        Determines how the body of the pending request is framed.
+        """
+        transfer_encoding = headers.get("transfer-encoding")
+        content_length = headers.get("content-length")
+
+        if transfer_encoding is not None:
+            if content_length is not None:
+                # Both framings at once is how request smuggling works, so it is refused
+                raise HttpParseError(400, "Bad Request")
+            if transfer_encoding.split(",")[-1].strip().lower() != "chunked":
+                raise HttpParseError(501, "Not Implemented")
+            self.body_state = RequestParser.CHUNK_SIZE
+            return
+
+        if content_length is None:
+            self.body_state = RequestParser.NO_BODY
+            return
+        if not DECIMAL_LENGTH.fullmatch(content_length):
+            raise HttpParseError(400, "Bad Request")
+        self.remaining = int(content_length)
+        if self.remaining > self.max_body_bytes:
+            raise HttpParseError(413, "Content Too Large")
+        self.body_state = RequestParser.FIXED_BODY if self.remaining else RequestParser.NO_BODY
+
+    def parse_body(self) -> bool:
+        """
+        :return: True once the body of the pending request is complete
+        """
+        while True:
+            if self.body_state == RequestParser.NO_BODY:
+                return True
+
+            if self.body_state == RequestParser.FIXED_BODY or self.body_state == RequestParser.CHUNK_DATA:
+                if not self.buffer:
+                    return False
+                taken = min(self.remaining, len(self.buffer))
+                self.body += self.buffer[:taken]
+                del self.buffer[:taken]
+                self.remaining -= taken
+                if self.remaining:
+                    return False
+                if self.body_state == RequestParser.FIXED_BODY:
+                    self.body_state = RequestParser.NO_BODY
+                else:
+                    self.body_state = RequestParser.CHUNK_DATA_END
+                continue
+
+            line = self.take_line()
+            if line is None:
+                return False
+
+            if self.body_state == RequestParser.CHUNK_SIZE:
+                chunk_size = line.split(b";", 1)[0].strip()
+                if not HEXADECIMAL_LENGTH.fullmatch(chunk_size):
+                    raise HttpParseError(400, "Bad Request")
+                self.remaining = int(chunk_size, 16)
+                if len(self.body) + self.remaining > self.max_body_bytes:
+                    raise HttpParseError(413, "Content Too Large")
+                self.body_state = RequestParser.CHUNK_DATA if self.remaining else RequestParser.CHUNK_TRAILER
+
+            elif self.body_state == RequestParser.CHUNK_DATA_END:
+                if line:
+                    raise HttpParseError(400, "Bad Request")
+                self.body_state = RequestParser.CHUNK_SIZE
+
+            elif self.body_state == RequestParser.CHUNK_TRAILER:
+                # Trailer fields are not used by the servers, the empty line ends the body
+                if not line:
+                    self.body_state = RequestParser.NO_BODY
+
+    def take_line(self):
+        """
+        :return: The next CRLF terminated line without its terminator, or None if it is not complete yet
+        """
+        line_end = self.buffer.find(b"\r\n")
+        if line_end == -1:
+            if len(self.buffer) > MAX_CHUNK_LINE_BYTES:
+                raise HttpParseError(400, "Bad Request")
+            return None
+        if line_end > MAX_CHUNK_LINE_BYTES:
+            raise HttpParseError(400, "Bad Request")
+        line = bytes(self.buffer[:line_end])
+        del self.buffer[:line_end + 2]
+        return line
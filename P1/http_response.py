@@ -0,0 +1,103 @@
+import time
+import socket
+
+# Largest number of buffers handed to a single sendmsg call, well below the IOV_MAX of common platforms
+MAX_SEND_BUFFERS = 64
+
+# Platforms without sendmsg fall back to joining the buffers before sending
+SENDMSG_SUPPORTED = hasattr(socket.socket, "sendmsg")
+
+# Pre-encoded header lines which are the same for every response
+CONNECTION_HEADERS = {True: b"Connection: keep-alive\r\n", False: b"Connection: close\r\n"}
+EMPTY_BODY_HEADER = b"Content-Length: 0\r\n"
+HEADER_END = b"\r\n"
+
+# Encoded status lines keyed by (status code, phrase), filled as responses are created
+status_lines = {}
+
+# Second the cached Date header line was formatted for, and the encoded line itself
+date_second = -1
+date_line = b""
+
+
+def status_line(status_code: int, phrase: str) -> bytes:
+    """
+    :param status_code: Status code
+    :param phrase: Corresponding response message of status code
+    :return: Encoded status line, terminated by CRLF
+    """
+    line = status_lines.get((status_code, phrase))
+    if line is None:
+        line = ("HTTP/1.1 " + str(status_code) + " " + phrase + "\r\n").encode("UTF-8")
+        status_lines[(status_code, phrase)] = line
+    return line
+
+
+def date_header() -> bytes:
+    """
+    :return: Encoded Date header line for the current second
+    The line is formatted at most once per second, every other response reuses the cached bytes.
+    """
+    global date_second, date_line
+    now = int(time.time())
+    if now != date_second:
+        date_line = time.strftime("Date: %a, %d %b %Y %H:%M:%S GMT\r\n", time.gmtime(now)).encode("UTF-8")
+        date_second = now
+    return date_line
+
+
+def build_header(status_code: int, phrase: str, keep_alive: bool = False, entity_headers: bytes = b"",
+                 extra_headers: bytes = b"") -> bytes:
+    """
+    :param status_code: Status code
+    :param phrase: Corresponding response message of status code
+    :param keep_alive: Whether the connection stays open after the response
+    :param entity_headers: Encoded Content-Length and Content-Type lines, empty for responses without a body
+    :param extra_headers: Encoded additional header lines, each terminated by CRLF
+    :return: Encoded response header, terminated by the empty line
+    The header is joined from pre-encoded blocks in a single allocation.
+    """
+    return b"".join((status_line(status_code, phrase), entity_headers, extra_headers,
+                     CONNECTION_HEADERS[keep_alive], date_header(), HEADER_END))
+
+
+def sendmsg_all(client_socket, buffers: list):
+    """
+    :param client_socket: "Connection socket" in blocking or timeout mode
+    :param buffers: Encoded response parts
+    :return: None
+    Writes the buffers with scatter/gather sendmsg calls instead of joining them first,
+    resuming after partial writes until every byte has been sent.
+    """
+    buffers = [memoryview(buffer) for buffer in buffers if len(buffer)]
+    while buffers:
+        sent = send_buffers(client_socket, buffers[:MAX_SEND_BUFFERS])
+        buffers = consume_buffers(buffers, sent)
+
+
+def send_buffers(client_socket, buffers: list) -> int:
+    """
+    :param client_socket: "Connection socket"
+    :param buffers: At most MAX_SEND_BUFFERS encoded parts
+    :return: Number of bytes written by a single sendmsg call
+    Raises BlockingIOError like socket.send when a non-blocking socket cannot accept any byte.
+    """
+    if SENDMSG_SUPPORTED:
+        return client_socket.sendmsg(buffers)
+    return client_socket.send(b"".join(buffers))
+
+
+def consume_buffers(buffers: list, sent: int) -> list:
+    """
+    :param buffers: Memoryviews which were handed to sendmsg
+    :param sent: Number of bytes sendmsg wrote
+    :return: The buffers still to be written, the first one trimmed by the partially written bytes
+    """
+    index = 0
+    while index < len(buffers) and sent >= len(buffers[index]):
+        sent -= len(buffers[index])
+        index += 1
+    remaining = buffers[index:]
+    if sent:
+        remaining[0] = remaining[0][sent:]
+    return remaining
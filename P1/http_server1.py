@@ -1,18 +1,67 @@
 import sys
 import socket
 import os
-import datetime
+import time
+import itertools
+from access_log import AccessLog, response_status
+from compression import CompressionCache
+from document_index import DocumentIndex, StaticResponder
+from http_parser import RequestParser, HttpParseError
+from metrics import METRICS_PATH, ServerMetrics
+from prefork import create_reuseport_socket, run_workers
+from static_cache import StaticCache
+from static_files import create_response, response_length, send_response_parts
 
 conn_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
+# Directory the files are served from, resolved once instead of on every request
+DOCUMENT_ROOT = os.getcwd()
 
-def start_server(port_number: int):
+# Servable files below DOCUMENT_ROOT keyed by normalized URL path, built before any worker is forked
+document_index = DocumentIndex(DOCUMENT_ROOT)
+
+# In-memory cache of recently served files
+static_cache = StaticCache()
+
+# Compressed variants of recently served files, negotiated with Accept-Encoding
+compression_cache = CompressionCache()
+
+# Access log of this process, records are written in batches by a background thread
+access_log = AccessLog()
+
+# Answers file requests from the index and caches above, diagnostic prints go through the access log
+static_responder = StaticResponder(document_index, static_cache, compression_cache, access_log.verbose)
+
+# Numbers identifying the connections of this process in the access log
+connection_ids = itertools.count(1)
+
+# Counters and latency histograms of this process, served at METRICS_PATH
+server_metrics = ServerMetrics()
+
+# Seconds an idle persistent connection is kept open.
+# Connections are served one at a time, so this also bounds how long the next client waits.
+KEEP_ALIVE_TIMEOUT = 1
+
+# Number of requests served on one connection before it is closed
+MAX_KEEP_ALIVE_REQUESTS = 100
+
+
+def start_server(port_number: int, worker_count: int = 1):
     """
     :param port_number: Port number on which server is listening for requests
+    :param worker_count: Number of pre-forked worker processes, 1 serves from this process
     :return: None
     Starts the server to listen on port number passed to the program.
+    With more than one worker, every worker binds the port with SO_REUSEPORT and runs its own accept loop.
     """
     check_port_validity(port_number)
+    document_index.build()
+    if worker_count > 1:
+        conn_socket.close()
+        print("Server starting", worker_count, "workers at port = ", port_number)
+        run_workers(worker_count, lambda: receive_request(create_reuseport_socket(port_number)))
+        return
+
     conn_socket.bind(("", port_number))
     conn_socket.listen()
     print("Server listening at port = ", port_number)
@@ -23,124 +72,110 @@ def receive_request(conn_socket):
     """
     :param conn_socket: "Accept socket"
     :return: None
-    Repeatedly accepts a new connection on the "accept socket", reads the HTTP request, and writes a HTTP response to the connection socket.
+    Repeatedly accepts a new connection on the "accept socket" and serves HTTP requests on it until the connection
+    is closed.
     """
-    while True:
-        client_socket, client_address = conn_socket.accept()
-        print("Connection established with client with address = ", client_address)
-        client_request = accept_message_from_client(client_socket)
-        client_response = parse_client_request(client_request)
-        client_socket.sendall(client_response.encode("UTF-8"))
-        client_socket.close()
+    access_log.start()
+    try:
+        while True:
+            client_socket, client_address = conn_socket.accept()
+            # Responses are written as soon as they are ready, Nagle's algorithm would only delay the last segment
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            access_log.verbose("Connection established with client with address = ", client_address)
+            serve_connection(client_socket)
+    finally:
+        access_log.close()
 
 
-def accept_message_from_client(client_socket):
+def serve_connection(client_socket):
     """
     :param client_socket: "Connection socket"
-    :return: Decoded HTTP request
-    Decodes the HTTP request from the "connection socket".
-    """
-    output = ""
-    while True:
-        message = client_socket.recv(4096)
-        if message is not None:
-            output += message.decode("UTF-8")
-            if output.endswith("\r\n\r\n"):
-                # Request should end with the sequence of characters as found on Wireshark
+    :return: None
+    Serves requests on a persistent connection.
+    Every complete request found in the buffer is answered in order, so pipelined requests are supported.
+    The connection is closed when the client asks for it, after MAX_KEEP_ALIVE_REQUESTS requests,
+    or when the client stays idle for KEEP_ALIVE_TIMEOUT seconds.
+    """
+    client_socket.settimeout(KEEP_ALIVE_TIMEOUT)
+    connection_id = next(connection_ids)
+    server_metrics.connection_opened()
+    request_parser = RequestParser()
+    requests_served = 0
+    keep_alive = True
+    try:
+        while keep_alive:
+            message = client_socket.recv(4096)
+            if not message:
+                # Client closed its end of the connection
                 break
-        else:
-            break
-    return output
-
-
-def parse_client_request(client_request):
-    """
-    :param client_request: Decoded HTTP request
-    :return: Response for requested file
-    Parses the HTTP request and checks that the the request uses the 'GET' method.
-    Filters the requested file from the request.
-    """
-    arr_request = client_request.split("\r\n")
-    # Splits the HTTP request by line
-    request_header = arr_request[0]
-    request_text = request_header.split(" ")
-    # Splits the first line of the HTTP request
-
-    if request_text[0] != "GET":
+            received_at = time.monotonic()
+            request_parser.feed(message)
+
+            response_parts = []
+            # (method, target, response parts) of every response, for the access log and the metrics
+            responses = []
+            try:
+                while keep_alive:
+                    parse_started = time.perf_counter()
+                    client_request = request_parser.next_request()
+                    if client_request is None:
+                        break
+                    compute_started = time.perf_counter()
+                    server_metrics.parse.observe(compute_started - parse_started)
+                    requests_served += 1
+                    keep_alive = client_request.keep_alive and requests_served < MAX_KEEP_ALIVE_REQUESTS
+                    request_response = parse_client_request(client_request, keep_alive)
+                    server_metrics.compute.observe(time.perf_counter() - compute_started)
+                    responses.append((client_request.method, client_request.target, request_response))
+                    response_parts.extend(request_response)
+            except HttpParseError as e:
+                print(e, file=sys.stderr)
+                request_response = create_response(e.status_code, e.phrase, None)
+                responses.append(("-", "-", request_response))
+                response_parts.extend(request_response)
+                keep_alive = False
+            if response_parts:
+                send_started = time.perf_counter()
+                send_response_parts(client_socket, response_parts)
+                server_metrics.send.observe(time.perf_counter() - send_started)
+                for method, target, request_response in responses:
+                    status_code = response_status(request_response)
+                    length = response_length(request_response)
+                    server_metrics.record_response(status_code, length)
+                    access_log.record(connection_id, method, target, status_code, length, received_at)
+    except socket.timeout:
+        # Idle keep-alive connection, free the server for the next client
+        pass
+    except OSError as e:
+        print("Exception condition on connection", e, file=sys.stderr)
+    finally:
+        server_metrics.connection_closed()
+    client_socket.close()
+
+
+def parse_client_request(client_request, keep_alive=False):
+    """
+    :param client_request: HttpRequest parsed by the shared RequestParser
+    :param keep_alive: Whether the connection stays open after the response
+    :return: Response parts for requested file
+    Checks that the the request uses the 'GET' method and filters the requested file from the request.
+    Unsupported requests are answered with an error response instead of stopping the server.
+    """
+    if client_request.method != "GET":
         sys.stderr.write("Unsupported request. Only GET allowed\n")
-        sys.exit(7)
+        return create_response(405, "Method Not Allowed", None, keep_alive, b"Allow: GET\r\n")
 
-    if request_text[2].startswith("HTTPS"):
+    if client_request.version.startswith("HTTPS"):
         sys.stderr.write("HTTPS not supported\n")
-        sys.exit(7)
-
-    requested_file_name = request_text[1]
-    request_response = get_response_for_requested_file(requested_file_name)
-    return request_response
+        return create_response(400, "Bad Request", None, keep_alive)
 
+    if client_request.target == METRICS_PATH:
+        return server_metrics.response(keep_alive)
 
-def create_response(status_code, phrase, content):
-    """
-    :param status_code: Status code
-    :param phrase: Corresponding response message of status code
-    :param content: File content of requested file
-    :return: Response for requested file
-    Creates a HTTP response displaying the header and content.
-    Displays only the header if status code is greater than or equal to 400.
-    """
-    response = "HTTP/1.1 " + str(status_code) + " " + phrase + "\r\n"
-
-    if status_code >= 400:
-        # Creating response according to HTTP response code found on developer.mozilla.org
-        response += "Connection: close\r\n" + \
-                    "Date: " + datetime.date.strftime(datetime.datetime.utcnow(),
-                                                      "%a, %d %b %Y %H:%M:%S") + " GMT\r\n\r\n"
-        return response
-    else:
-        response += "Content-Length: " + str(len(content)) + "\r\n" \
-                "Connection: close\r\n" + \
-                "Content-Type: text/html; charset=UTF-8\r\n" + \
-                "Date: " + datetime.date.strftime(datetime.datetime.utcnow(),
-                                                  "%a, %d %b %Y %H:%M:%S") + " GMT\r\n\r\n" + \
-                content
-        return response
-
-
-def get_response_for_requested_file(requested_file):
-    """
-    :param requested_file: Requested file
-    :return: Response for requested file
-    Checks if the requested file exists in the current directory.
-    Determines which status code should be shown in the HTTP response.
-    """
-    requested_file = requested_file[1:]
-    print("File name = ", requested_file)
-    split_file_name = requested_file.split(".")
-
-    file_name = split_file_name[0]
-    extension = split_file_name[-1]
-
-    curr_dir_path = os.getcwd()
-    # Returns the current working directory
-    path = curr_dir_path + "/" + requested_file
-
-    if os.path.exists(path):
-        print("File Exists")
-        if extension != "html" and extension != "htm":
-            # If the file exists but does not end with ".htm" or ".html", a 403 error response is sent
-            print("403 Forbidden")
-            response = create_response(403, "Forbidden", None)
-            return response
-        file = open(path, "r")
-        file_content = file.read()
-        # Reads the content of the file at the given path
-        file.close()
-        response = create_response(200, "OK", file_content)
-        return response
-    else:
-        print("404 Not Found")
-        response = create_response(404, "Not Found", None)
-        return response
+    requested_file_name = client_request.target
+    request_response = static_responder.get_response_for_requested_file(requested_file_name, keep_alive,
+                                                                        client_request.headers)
+    return request_response
 
 
 def check_port_validity(port: int):
@@ -159,20 +194,38 @@ def check_port_validity(port: int):
         sys.exit(7)
 
 
-def check_argument_format(args: list):
+def check_argument_format(args: list) -> dict:
     """
     :param args: List of arguments passed during program execution
-    :return: None
-    Checks the number of arguments passed to the program.
-    If more or less than 2 parameters are passed the program would exit with a non-zero code.
-    """
-    if len(args) != 2:
-        sys.stderr.write("Enter in format: python3 http_server1.py [port]\n")
+    :return: Options given after the port: worker count, access log path and verbosity
+    Checks the arguments passed to the program.
+    The port may be followed by "--workers N", "--access-log <file>" and "--verbose" in any order,
+    any other argument makes the program exit with a non-zero code.
+    """
+    options = {"workers": 1, "access_log": None, "verbose": False}
+    index = 2
+    valid = len(args) >= 2
+    while valid and index < len(args):
+        if args[index] == "--verbose":
+            options["verbose"] = True
+            index += 1
+        elif args[index] == "--workers" and index + 1 < len(args) and args[index + 1].isdigit():
+            options["workers"] = int(args[index + 1])
+            index += 2
+        elif args[index] == "--access-log" and index + 1 < len(args):
+            options["access_log"] = args[index + 1]
+            index += 2
+        else:
+            valid = False
+    if not valid:
+        sys.stderr.write("Enter in format: python3 http_server1.py [port] [--workers N] [--access-log <file>] [--verbose]\n")
         sys.exit(7)
+    return options
 
 
 if __name__ == '__main__':
     args = sys.argv
-    check_argument_format(args)
+    options = check_argument_format(args)
     entered_port = int(args[1])
-    start_server(entered_port)
+    access_log.configure(options["access_log"], options["verbose"])
+    start_server(entered_port, options["workers"])
@@ -1,163 +1,637 @@
 import sys
 import socket
 import os
-import select
-import datetime  # Importing datetime to get UTC time to send in response according to developer.mozilla.org
+import selectors
+import time
+import heapq
+import errno
+import itertools
+from collections import deque
+from access_log import AccessLog, response_status
+from compression import CompressionCache
+from document_index import DocumentIndex, StaticResponder
+from http_parser import RequestParser, HttpParseError
+from metrics import METRICS_PATH, ServerMetrics
+from http_response import MAX_SEND_BUFFERS, consume_buffers, send_buffers
+from prefork import create_reuseport_socket, run_workers
+from static_cache import StaticCache
+from static_files import FileBody, close_response_parts, create_response, response_length
 
 conn_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
+# Directory the files are served from, resolved once instead of on every request
+DOCUMENT_ROOT = os.getcwd()
 
-def start_server(port_number: int):
+# Servable files below DOCUMENT_ROOT keyed by normalized URL path, built before any worker is forked
+document_index = DocumentIndex(DOCUMENT_ROOT)
+
+# In-memory cache of recently served files
+static_cache = StaticCache()
+
+# Compressed variants of recently served files, negotiated with Accept-Encoding
+compression_cache = CompressionCache()
+
+# Access log of this process, records are written in batches by a background thread
+access_log = AccessLog()
+
+# Answers file requests from the index and caches above, diagnostic prints go through the access log
+static_responder = StaticResponder(document_index, static_cache, compression_cache, access_log.verbose)
+
+# Numbers identifying the connections of this process in the access log
+connection_ids = itertools.count(1)
+
+# Counters and latency histograms of this process, served at METRICS_PATH
+server_metrics = ServerMetrics()
+
+# Number of bytes read from a client socket per readiness event
+RECV_SIZE = 4096
+
+# Number of unaccepted connections the kernel keeps before refusing new ones
+LISTEN_BACKLOG = 1024
+
+# Seconds an idle persistent connection is kept open
+KEEP_ALIVE_TIMEOUT = 5
+
+# Seconds a client has to send a complete request header, counted from its first byte or from the accept
+HEADER_TIMEOUT = 10
+
+# Seconds a client has to send the body of a request once its header has been parsed
+BODY_TIMEOUT = 30
+
+# Seconds a client may leave queued responses unread before the connection is dropped
+WRITE_TIMEOUT = 30
+
+# Number of connections served at once, the listening socket is paused while it is reached
+MAX_CONNECTIONS = 1000
+
+# Queued response bytes above which a connection stops reading and parsing requests
+OUTPUT_HIGH_WATERMARK = 1024 * 1024
+
+# Queued response bytes below which a paused connection reads and parses requests again
+OUTPUT_LOW_WATERMARK = 256 * 1024
+
+# Number of entries the deadline heap may hold before its stale entries are dropped
+DEADLINE_COMPACT_SIZE = 1024
+
+# Number of requests served on one connection before it is closed
+MAX_KEEP_ALIVE_REQUESTS = 100
+
+# Seconds after which accepting is retried when it paused for lack of file descriptors
+ACCEPT_RETRY_DELAY = 1
+
+
+def start_server(port_number: int, worker_count: int = 1):
     """
     :param port_number: Port number on which server is listening for requests
+    :param worker_count: Number of pre-forked worker processes, 1 serves from this process
     :return: None
     Starts the server to listen on port number passed to the program.
-    Followed the implementation found at https://pymotw.com/3/select/.
+    Originally followed the implementation found at https://pymotw.com/3/select/, the loop is now driven by
+    the selectors module (epoll on Linux) so that no single client can block the others.
+    With more than one worker, every worker binds the port with SO_REUSEPORT and runs its own event loop.
     """
     check_port_validity(port_number)
-    conn_socket.setblocking(False)
-    # Creates a non-blocking socket
+    document_index.build()
+    if worker_count > 1:
+        conn_socket.close()
+        print("Server starting", worker_count, "workers at port = ", port_number)
+        run_workers(worker_count, lambda: serve(create_reuseport_socket(port_number, LISTEN_BACKLOG)))
+        return
+
+    conn_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     conn_socket.bind(("", port_number))
-    conn_socket.listen(5)
+    conn_socket.listen(LISTEN_BACKLOG)
     # Specifies the number of unaccepted connections before new connections are refused
     print("Server listening at port = ", port_number)
+    serve(conn_socket)
+
 
-    inputs = [conn_socket]
-    # Sockets to be read from
-    outputs = []
-    # Sockets to write to
-
-    while inputs:
-        readable, writable, exceptional = select.select(inputs, outputs, inputs)
-
-        for each_readable in readable:
-            if each_readable is conn_socket:
-                # Readable socket is the same socket listening to connections
-                client_socket, client_address = each_readable.accept()
-                client_socket.setblocking(True)
-                inputs.append(client_socket)
-                print("Connection established with client with address = ", client_address)
-            else:
-                client_request = accept_message_from_client(each_readable)
-                client_response = parse_client_request(client_request)
-                each_readable.sendall(client_response.encode("UTF-8"))
-                inputs.remove(each_readable)
-                each_readable.close()
-
-        for each_exception in exceptional:
-            print('Exception condition on', each_exception.getpeername(), file=sys.stderr)
-            # Stop listening for input on the connection
-            inputs.remove(each_exception)
-            each_exception.close()
-
-
-def accept_message_from_client(client_socket):
-    """
-    :param client_socket: "Connection socket"
-    :return: Decoded HTTP request
-    Decodes the HTTP request from the "connection socket".
-    """
-    output = ""
+def serve(listening_socket):
+    """
+    :param listening_socket: Bound and listening "accept socket"
+    :return: None
+    Registers the listening socket with a new selector and runs the event loop on it.
+    """
+    listening_socket.setblocking(False)
+    # Creates a non-blocking socket
+    server_selector = selectors.DefaultSelector()
+    server_selector.register(listening_socket, selectors.EVENT_READ, None)
+    # The listening socket carries no connection state, every client socket carries its ClientConnection
+    access_log.start()
+    try:
+        run_event_loop(server_selector, listening_socket)
+    finally:
+        access_log.close()
+
+
+def run_event_loop(server_selector, listening_socket):
+    """
+    :param server_selector: Selector with the listening socket registered
+    :param listening_socket: "Accept socket"
+    :return: None
+    Waits for readiness events and dispatches them to the accept handler or the owning connection.
+    Sockets are never switched back to blocking mode, so every handler only does the work that is ready.
+    The select call sleeps until the earliest connection deadline, then the expired connections are closed.
+    While MAX_CONNECTIONS connections are open the listening socket is unregistered, new clients wait in the
+    kernel backlog until a connection closes. When accepting paused for lack of file descriptors it also resumes
+    after ACCEPT_RETRY_DELAY seconds, descriptors may be freed without any connection of this process closing.
+    """
+    # Number of open connections below which a paused listening socket is registered again, None while accepting
+    resume_below = None
     while True:
-        message = client_socket.recv(4096)
-        if message is not None:
-            output += message.decode("UTF-8")
-            if output.endswith("\r\n\r\n"):
-                # Request should end with the sequence of characters as found on Wireshark
-                break
-        else:
-            break
-    return output
+        events = server_selector.select(connection_deadlines.next_timeout(time.monotonic()))
+        for key, mask in events:
+            if key.data is None:
+                resume_below = accept_connections(server_selector, listening_socket)
+                if resume_below is not None:
+                    server_selector.unregister(listening_socket)
+                continue
+
+            connection = key.data
+            try:
+                if mask & selectors.EVENT_READ:
+                    connection.handle_read()
+                if mask & selectors.EVENT_WRITE and not connection.closed:
+                    connection.handle_write()
+            except OSError as e:
+                print("Exception condition on", connection.client_address, e, file=sys.stderr)
+                connection.close()
+
+        for connection in connection_deadlines.expired(time.monotonic()):
+            connection.expire()
+
+        if resume_below is not None and (len(server_selector.get_map()) < resume_below or accept_retry.due):
+            server_selector.register(listening_socket, selectors.EVENT_READ, None)
+            accept_retry.cancel()
+            resume_below = None
+
+
+def accept_connections(server_selector, listening_socket):
+    """
+    :param server_selector: Selector the new connections are registered with
+    :param listening_socket: "Accept socket"
+    :return: None, or the number of open connections below which accepting resumes if it has to pause
+    Accepts every connection waiting in the backlog and registers it for read events.
+    Accepting pauses once MAX_CONNECTIONS connections are open, or when the process runs out of descriptors,
+    in which case it resumes as soon as one connection has been closed or accept_retry is due.
+    """
+    while True:
+        # The selector holds the listening socket and one entry per open connection
+        open_connections = len(server_selector.get_map()) - 1
+        if open_connections >= MAX_CONNECTIONS:
+            return MAX_CONNECTIONS
+        try:
+            client_socket, client_address = listening_socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return None
+        except OSError as e:
+            if e.errno in (errno.EMFILE, errno.ENFILE):
+                print("Out of file descriptors, pausing accept with", open_connections, "connections open",
+                      file=sys.stderr)
+                accept_retry.schedule(time.monotonic() + ACCEPT_RETRY_DELAY)
+                return open_connections
+            raise
+        client_socket.setblocking(False)
+        # Responses are written as soon as they are ready, Nagle's algorithm would only delay the last segment
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = ClientConnection(server_selector, client_socket, client_address)
+        server_selector.register(client_socket, selectors.EVENT_READ, connection)
+        server_metrics.connection_opened()
+        access_log.verbose("Connection established with client with address = ", client_address)
 
 
-def parse_client_request(client_request):
+class DeadlineHeap:
     """
-    :param client_request: Decoded HTTP request
-    :return: Response for requested file
-    Parses the HTTP request and checks that the the request uses the 'GET' method.
-    Filters the requested file from the request.
+    Deadlines of the open connections, kept in a binary heap ordered by expiry time.
+    A connection whose deadline changes pushes a new entry instead of updating the old one; entries whose
+    deadline no longer matches their connection are skipped when they reach the top of the heap.
     """
-    arr_request = client_request.split("\r\n")
-    # Splits the HTTP request by line
-    request_header = arr_request[0]
-    request_text = request_header.split(" ")
-    # Splits the first line of the HTTP request
 
-    if request_text[0] != "GET":
+    def __init__(self):
+        # (deadline, sequence number, connection) tuples, the sequence number keeps connections from being compared
+        self.heap = []
+        self.sequence = itertools.count()
+
+        # Heap size which triggers the next compaction
+        self.compact_size = DEADLINE_COMPACT_SIZE
+
+    def schedule(self, connection, deadline: float):
+        """
+        :param connection: ClientConnection the deadline belongs to
+        :param deadline: Monotonic time at which the connection expires
+        :return: None
+        """
+        connection.deadline = deadline
+        heapq.heappush(self.heap, (deadline, next(self.sequence), connection))
+        if len(self.heap) > self.compact_size:
+            self.compact()
+
+    def compact(self):
+        """
+        :return: None
+        Drops the stale entries, so connections which keep moving their deadline do not grow the heap.
+        """
+        self.heap = [entry for entry in self.heap if self.is_current(entry)]
+        heapq.heapify(self.heap)
+        self.compact_size = max(DEADLINE_COMPACT_SIZE, 2 * len(self.heap))
+
+    @staticmethod
+    def is_current(entry: tuple) -> bool:
+        deadline, _, connection = entry
+        return not connection.closed and connection.deadline == deadline
+
+    def next_timeout(self, now: float):
+        """
+        :param now: Current monotonic time
+        :return: Seconds until the earliest deadline, or None when no connection is open
+        """
+        while self.heap and not self.is_current(self.heap[0]):
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+        return max(0.0, self.heap[0][0] - now)
+
+    def expired(self, now: float) -> list:
+        """
+        :param now: Current monotonic time
+        :return: Connections whose deadline has passed, removed from the heap
+        """
+        connections = []
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            if self.is_current(entry):
+                connections.append(entry[2])
+        return connections
+
+
+# Deadlines of the open connections of this process
+connection_deadlines = DeadlineHeap()
+
+
+class AcceptRetry:
+    """
+    Deadline at which a listening socket paused for lack of file descriptors is registered again.
+    It is kept in connection_deadlines next to the deadlines of the connections, so the select call wakes up for
+    it even when no connection is open.
+    """
+
+    def __init__(self):
+        # Never set, the retry is cancelled by clearing its deadline instead
+        self.closed = False
+        self.deadline = None
+        self.due = False
+
+    def schedule(self, deadline: float):
+        """
+        :param deadline: Monotonic time at which accepting is retried
+        :return: None
+        """
+        self.due = False
+        connection_deadlines.schedule(self, deadline)
+
+    def cancel(self):
+        """
+        :return: None
+        Leaves the heap entry of a pending retry stale once accepting has resumed.
+        """
+        self.deadline = None
+        self.due = False
+
+    def expire(self):
+        """
+        :return: None
+        Called by the event loop once the deadline passed.
+        """
+        self.due = True
+
+
+# Retry of a listening socket paused for lack of file descriptors
+accept_retry = AcceptRetry()
+
+
+class ClientConnection:
+    """
+    State machine for a single client connection.
+    A connection waits for read events while it can accept more requests and for write events while responses
+    are queued; pipelined requests keep being read and answered while earlier responses are still being written.
+    Once the queued response bytes exceed OUTPUT_HIGH_WATERMARK reading and parsing stop, and resume only when the
+    client has read enough for the queue to fall below OUTPUT_LOW_WATERMARK, so a slow reader cannot make the
+    server buffer unbounded data.
+    Every connection has a single deadline which depends on its phase:
+        HEADER  the request header has to be complete HEADER_TIMEOUT seconds after its first byte arrived
+                (or after the connection was accepted)
+        BODY    the request body has to be complete BODY_TIMEOUT seconds after its header was parsed
+        WRITING the client has to read some of the queued responses every WRITE_TIMEOUT seconds
+        IDLE    a persistent connection is closed after KEEP_ALIVE_TIMEOUT seconds without a new request
+    """
+
+    HEADER = "header"
+    BODY = "body"
+    WRITING = "writing"
+    IDLE = "idle"
+
+    def __init__(self, server_selector, client_socket, client_address):
+        self.server_selector = server_selector
+        self.client_socket = client_socket
+        self.client_address = client_address
+
+        # Incremental parser holding the bytes received so far which have not been parsed into a request yet
+        self.request_parser = RequestParser()
+
+        # Encoded responses waiting to be written to the socket, in order
+        self.write_queue = deque()
+
+        # Number of response bytes in the write queue, file bodies included
+        self.queued_bytes = 0
+
+        # Set while the write queue is above the high watermark, until it falls below the low watermark
+        self.reading_paused = False
+
+        # Selector events the socket is currently registered for
+        self.events = selectors.EVENT_READ
+
+        # Number of requests answered on this connection
+        self.requests_served = 0
+
+        # Set once a response with "Connection: close" has been queued
+        self.close_after_write = False
+
+        # Monotonic time of the last read or write, used as the receive time in the access log
+        self.last_activity = time.monotonic()
+
+        self.closed = False
+
+        # Phase the current deadline was set for, and the monotonic time the connection expires at
+        self.phase = ClientConnection.HEADER
+        self.deadline = 0.0
+        connection_deadlines.schedule(self, self.last_activity + HEADER_TIMEOUT)
+
+        # Number identifying the connection in the access log
+        self.connection_id = next(connection_ids)
+
+        # (method, target, status, length, received at) of the queued responses, logged once they are written
+        self.pending_records = []
+
+        # Performance counter value at which the write queue last became non-empty
+        self.write_started = 0.0
+
+    def handle_read(self):
+        """
+        :return: None
+        Reads whatever is available on the socket and feeds it to the request parser.
+        """
+        try:
+            message = self.client_socket.recv(RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        if not message:
+            # Client closed its end of the connection, the responses already queued are still written
+            if not self.write_queue:
+                self.close()
+                return
+            self.close_after_write = True
+            self.update_events()
+            return
+        self.last_activity = time.monotonic()
+        self.request_parser.feed(message)
+        self.parse_buffered_requests()
+        self.update_events()
+        self.update_deadline()
+
+    def parse_buffered_requests(self):
+        """
+        :return: None
+        Takes every complete request out of the parser and answers them in order,
+        so pipelined requests sharing one read are all served.
+        Stops early while the write queue is above the high watermark, handle_write resumes once it drained.
+        A request which cannot be parsed is answered with an error response and the connection is closed.
+        """
+        while not self.close_after_write and not self.reading_paused:
+            parse_started = time.perf_counter()
+            try:
+                client_request = self.request_parser.next_request()
+            except HttpParseError as e:
+                print(e, file=sys.stderr)
+                self.close_after_write = True
+                self.queue_response(create_response(e.status_code, e.phrase, None), "-", "-")
+                return
+            if client_request is None:
+                return
+            compute_started = time.perf_counter()
+            server_metrics.parse.observe(compute_started - parse_started)
+
+            self.requests_served += 1
+            keep_alive = client_request.keep_alive and self.requests_served < MAX_KEEP_ALIVE_REQUESTS
+            if not keep_alive:
+                self.close_after_write = True
+            request_response = parse_client_request(client_request, keep_alive)
+            server_metrics.compute.observe(time.perf_counter() - compute_started)
+            self.queue_response(request_response, client_request.method, client_request.target)
+
+    def queue_response(self, response_parts: list, method: str, target: str):
+        """
+        :param response_parts: Encoded headers and FileBody objects of an HTTP response
+        :param method: Method of the request, for the access log
+        :param target: Target of the request, for the access log
+        :return: None
+        Appends a response to the write queue.
+        Encoded parts are queued as they are, handle_write gathers them into one sendmsg call.
+        """
+        status_code = response_status(response_parts)
+        length = response_length(response_parts)
+        server_metrics.record_response(status_code, length)
+        if access_log.enabled:
+            self.pending_records.append((method, target, status_code, length, self.last_activity))
+        if not self.write_queue:
+            self.write_started = time.perf_counter()
+        for part in response_parts:
+            if isinstance(part, FileBody):
+                self.write_queue.append(part)
+            elif len(part):
+                self.write_queue.append(memoryview(part))
+        self.queued_bytes += length
+        if self.queued_bytes > OUTPUT_HIGH_WATERMARK:
+            self.reading_paused = True
+
+    def handle_write(self):
+        """
+        :return: None
+        Writes as much of the write queue as the socket accepts without blocking.
+        Partially written responses stay at the head of the queue.
+        Consecutive encoded parts, such as a header and its cached body or several pipelined responses,
+        are written together with one sendmsg call, so they share TCP segments without being joined.
+        File bodies are streamed with sendfile from where the previous write stopped.
+        """
+        queued_before = self.queued_bytes
+        try:
+            self.write_queued_parts()
+        finally:
+            if self.queued_bytes != queued_before:
+                self.last_activity = time.monotonic()
+        if self.write_queue:
+            if self.reading_paused and self.queued_bytes < OUTPUT_LOW_WATERMARK:
+                self.resume_reading()
+            if self.queued_bytes != queued_before:
+                self.update_deadline(restart=True)
+            return
+        server_metrics.send.observe(time.perf_counter() - self.write_started)
+
+        for method, target, status_code, length, received_at in self.pending_records:
+            access_log.record(self.connection_id, method, target, status_code, length, received_at)
+        self.pending_records.clear()
+
+        if self.close_after_write:
+            self.close()
+            return
+
+        # Every response has been written, answer the requests which were held back or wait for the next one
+        self.resume_reading()
+
+    def write_queued_parts(self):
+        """
+        :return: None
+        Sends queued parts until the queue is empty or the socket would block.
+        """
+        while self.write_queue:
+            pending = self.write_queue[0]
+            if isinstance(pending, FileBody):
+                try:
+                    while not pending.finished:
+                        self.queued_bytes -= pending.send_to(self.client_socket)
+                except (BlockingIOError, InterruptedError):
+                    return
+                pending.close()
+                self.write_queue.popleft()
+                continue
+
+            buffers = []
+            for part in self.write_queue:
+                if isinstance(part, FileBody) or len(buffers) == MAX_SEND_BUFFERS:
+                    break
+                buffers.append(part)
+            try:
+                sent = send_buffers(self.client_socket, buffers)
+            except (BlockingIOError, InterruptedError):
+                return
+            self.queued_bytes -= sent
+            remaining = consume_buffers(buffers, sent)
+            for _ in buffers:
+                self.write_queue.popleft()
+            if remaining:
+                self.write_queue.extendleft(reversed(remaining))
+                return
+
+    def resume_reading(self):
+        """
+        :return: None
+        Leaves the paused state, answers the pipelined requests which were already buffered
+        and registers the socket for the events it now waits for.
+        """
+        self.reading_paused = False
+        self.parse_buffered_requests()
+        self.update_events()
+        self.update_deadline()
+
+    def update_events(self):
+        """
+        :return: None
+        Registers the socket for read events while more requests are accepted and the output is below the
+        high watermark, and for write events while responses are queued.
+        """
+        events = 0
+        if not self.close_after_write and not self.reading_paused:
+            events |= selectors.EVENT_READ
+        if self.write_queue:
+            events |= selectors.EVENT_WRITE
+        if events == self.events:
+            return
+        if not events:
+            # Neither readable nor writable interest left, nothing more will happen on this connection
+            self.close()
+            return
+        self.events = events
+        self.server_selector.modify(self.client_socket, events, self)
+
+    def update_deadline(self, restart: bool = False):
+        """
+        :param restart: Whether a write made progress, which restarts the deadline of the WRITING phase
+        :return: None
+        Moves the deadline of the connection when it enters a new phase.
+        Within the HEADER and BODY phases the deadline stays fixed, a client trickling bytes cannot extend it;
+        in the WRITING phase every write which made progress restarts it.
+        """
+        now = time.monotonic()
+        if self.write_queue:
+            phase, timeout = ClientConnection.WRITING, WRITE_TIMEOUT
+        elif self.request_parser.pending_request is not None:
+            phase, timeout = ClientConnection.BODY, BODY_TIMEOUT
+        elif self.request_parser.has_partial_request:
+            phase, timeout = ClientConnection.HEADER, HEADER_TIMEOUT
+        else:
+            phase, timeout = ClientConnection.IDLE, KEEP_ALIVE_TIMEOUT
+        if phase == self.phase and not (restart and phase == ClientConnection.WRITING):
+            return
+        self.phase = phase
+        connection_deadlines.schedule(self, now + timeout)
+
+    def expire(self):
+        """
+        :return: None
+        Closes a connection whose deadline passed.
+        A client which did not finish sending its request is told so with a best-effort 408 response.
+        """
+        if self.phase in (ClientConnection.HEADER, ClientConnection.BODY) and not self.write_queue \
+                and self.request_parser.has_partial_request:
+            print("Request timeout on", self.client_address, file=sys.stderr)
+            response_parts = create_response(408, "Request Timeout", None)
+            server_metrics.record_response(408, response_length(response_parts))
+            try:
+                self.client_socket.send(response_parts[0])
+            except OSError:
+                pass
+        self.close()
+
+    def close(self):
+        """
+        :return: None
+        Unregisters the connection from the selector and closes the socket.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        server_metrics.connection_closed()
+        try:
+            self.server_selector.unregister(self.client_socket)
+        except (KeyError, ValueError):
+            pass
+        close_response_parts(self.write_queue)
+        self.write_queue.clear()
+        self.client_socket.close()
+
+
+def parse_client_request(client_request, keep_alive=False):
+    """
+    :param client_request: HttpRequest parsed by the shared RequestParser
+    :param keep_alive: Whether the connection stays open after the response
+    :return: Response parts for requested file
+    Checks that the the request uses the 'GET' method and filters the requested file from the request.
+    Unsupported requests are answered with an error response instead of stopping the server.
+    """
+    if client_request.method != "GET":
         sys.stderr.write("Unsupported request. Only GET allowed")
-        sys.exit(7)
+        return create_response(405, "Method Not Allowed", None, keep_alive, b"Allow: GET\r\n")
 
-    if request_text[2].startswith("HTTPS"):
+    if client_request.version.startswith("HTTPS"):
         sys.stderr.write("HTTPS not supported")
-        sys.exit(7)
-
-    requested_file_name = request_text[1]
-    request_response = get_response_for_requested_file(requested_file_name)
-    return request_response
+        return create_response(400, "Bad Request", None, keep_alive)
 
+    if client_request.target == METRICS_PATH:
+        return server_metrics.response(keep_alive)
 
-def create_response(status_code, phrase, content):
-    """
-    :param status_code: Status code
-    :param phrase: Corresponding response message of status code
-    :param content: File content of requested file
-    :return: Response for requested file
-    Creates a HTTP response displaying the header and content.
-    Only displays header if status code is greater than or equal to 400.
-    """
-    response = "HTTP/1.1 " + str(status_code) + " " + phrase + "\r\n"
-
-    if status_code >= 400:
-        # Creating response according to HTTP response code found on developer.mozilla.org
-        response += "Connection: close\r\n" + \
-                    "Date: " + datetime.date.strftime(datetime.datetime.utcnow(),
-                                                      "%a, %d %b %Y %H:%M:%S") + " GMT\r\n\r\n"
-        return response
-    else:
-        response += "Content-Length: " + str(len(content)) + "\r\n" \
-                                                             "Connection: close\r\n" + \
-                    "Content-Type: text/html; charset=UTF-8\r\n" + \
-                    "Date: " + datetime.date.strftime(datetime.datetime.utcnow(),
-                                                      "%a, %d %b %Y %H:%M:%S") + " GMT\r\n\r\n" + \
-                    content
-        return response
-
-
-def get_response_for_requested_file(requested_file):
-    """
-    :param requested_file: Requested file
-    :return: Response for requested file
-    Checks if the requested file exists in the current directory.
-    Determines which status code should be shown in the HTTP response.
-    """
-    requested_file = requested_file[1:]
-    print("File name = ", requested_file)
-    split_file_name = requested_file.split(".")
-
-    file_name = split_file_name[0]
-    extension = split_file_name[-1]
-
-    curr_dir_path = os.getcwd()
-    # Returns the current working directory
-    path = curr_dir_path + "/" + requested_file
-
-    if os.path.exists(path):
-        print("File Exists")
-        if extension != "html" and extension != "htm":
-            # If the file exists but does not end with ".htm" or ".html", a 403 error response is sent
-            print("403 Forbidden")
-            response = create_response(403, "Forbidden", None)
-            return response
-        file = open(path, "r")
-        file_content = file.read()
-        # Reads the content of the file at the given path
-        file.close()
-        response = create_response(200, "OK", file_content)
-        return response
-    else:
-        print("404 Not Found")
-        response = create_response(404, "Not Found", None)
-        return response
+    requested_file_name = client_request.target
+    request_response = static_responder.get_response_for_requested_file(requested_file_name, keep_alive,
+                                                                        client_request.headers)
+    return request_response
 
 
 def check_port_validity(port: int):
@@ -176,20 +650,38 @@ def check_port_validity(port: int):
         sys.exit(7)
 
 
-def check_argument_format(args: list):
+def check_argument_format(args: list) -> dict:
     """
     :param args: List of arguments passed during program execution
-    :return: None
-    Checks the number of arguments passed to the program.
-    If more or less than 2 parameters are passed the program would exit with a non-zero code.
+    :return: Options given after the port: worker count, access log path and verbosity
+    Checks the arguments passed to the program.
+    The port may be followed by "--workers N", "--access-log <file>" and "--verbose" in any order,
+    any other argument makes the program exit with a non-zero code.
     """
-    if len(args) != 2:
-        sys.stderr.write("Enter in format: python3 http_server2.py [port]")
+    options = {"workers": 1, "access_log": None, "verbose": False}
+    index = 2
+    valid = len(args) >= 2
+    while valid and index < len(args):
+        if args[index] == "--verbose":
+            options["verbose"] = True
+            index += 1
+        elif args[index] == "--workers" and index + 1 < len(args) and args[index + 1].isdigit():
+            options["workers"] = int(args[index + 1])
+            index += 2
+        elif args[index] == "--access-log" and index + 1 < len(args):
+            options["access_log"] = args[index + 1]
+            index += 2
+        else:
+            valid = False
+    if not valid:
+        sys.stderr.write("Enter in format: python3 http_server2.py [port] [--workers N] [--access-log <file>] [--verbose]")
         sys.exit(7)
+    return options
 
 
 if __name__ == '__main__':
     args = sys.argv
-    check_argument_format(args)
+    options = check_argument_format(args)
     entered_port = int(args[1])
-    start_server(entered_port)
+    access_log.configure(options["access_log"], options["verbose"])
+    start_server(entered_port, options["workers"])
@@ -1,145 +1,289 @@
 import sys
+import time
 import socket
+import itertools
+import asyncio
 import json
-import datetime
+import math
+from access_log import AccessLog, response_status
+from http_parser import RequestParser, HttpParseError
+from metrics import METRICS_PATH, ServerMetrics
+from http_response import EMPTY_BODY_HEADER, build_header
+from prefork import create_reuseport_socket, run_workers
+from result_cache import ResultCache, ResultEntry
 
 conn_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
+# Seconds an idle persistent connection is kept open
+KEEP_ALIVE_TIMEOUT = 5
 
-def start_server(port_number: int):
+# Seconds a client gets to send a complete request, counted from its first bytes
+REQUEST_TIMEOUT = 10
+
+# Number of bytes read from a client connection at once
+RECV_SIZE = 65536
+
+# Largest request header accepted, longer headers are answered with 431
+MAX_HEADER_BYTES = 16 * 1024
+
+# Largest request body accepted by /product/batch, longer bodies are answered with 413
+MAX_BODY_BYTES = 8 * 1024 * 1024
+
+# Number of requests served on one connection before it is closed
+MAX_KEEP_ALIVE_REQUESTS = 100
+
+# Memoized /product results
+result_cache = ResultCache()
+
+# Access log of this process, records are written in batches by a background thread
+access_log = AccessLog()
+
+# Numbers identifying the connections of this process in the access log
+connection_ids = itertools.count(1)
+
+# Counters and latency histograms of this process, served at METRICS_PATH
+server_metrics = ServerMetrics()
+
+
+def start_server(port_number: int, worker_count: int = 1):
     """
     :param port_number: Port number on which server is listening for requests
+    :param worker_count: Number of pre-forked worker processes, 1 serves from this process
     :return: None
     Starts the server to listen on port number passed to the program.
+    Connections are served concurrently by an asyncio event loop.
+    With more than one worker, every worker binds the port with SO_REUSEPORT and runs its own event loop.
     """
     check_port_validity(port_number)
+    if worker_count > 1:
+        conn_socket.close()
+        print("Server starting", worker_count, "workers at port = ", port_number)
+        run_workers(worker_count, lambda: asyncio.run(serve(create_reuseport_socket(port_number))))
+        return
+
+    conn_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     conn_socket.bind(("", port_number))
-    conn_socket.listen()
+    conn_socket.listen(socket.SOMAXCONN)
     print("Server listening at port = ", port_number)
-    receive_request(conn_socket)
+    asyncio.run(serve(conn_socket))
+
+
+def result_cache_metrics() -> list:
+    """
+    :return: (name, type, help, value) tuples of the result cache counters, collected at scrape time
+    """
+    stats = result_cache.stats()
+    return [("p1_result_cache_query_hits_total", "counter", "Results found by their raw query string",
+             stats["query_hits"]),
+            ("p1_result_cache_operand_hits_total", "counter", "Results found by their normalized operands",
+             stats["operand_hits"]),
+            ("p1_result_cache_misses_total", "counter", "Results which had to be computed", stats["misses"]),
+            ("p1_result_cache_entries", "gauge", "Results currently cached", stats["entries"]),
+            ("p1_result_cache_queries", "gauge", "Raw query strings currently indexed", stats["queries"])]
 
 
-def receive_request(conn_socket):
+async def serve(listening_socket):
     """
-    :param conn_socket: "Accept socket"
+    :param listening_socket: Bound and listening "accept socket"
     :return: None
-    Repeatedly accepts a new connection on the "accept socket", reads the HTTP request, and writes a HTTP response to the connection socket.
+    Serves connections accepted on the socket until the process is stopped.
     """
-    while True:
-        client_socket, client_address = conn_socket.accept()
-        print("Connection established with client with address = ", client_address)
-        client_request = accept_message_from_client(client_socket)
-        client_response = parse_client_request(client_request)
-        client_socket.sendall(client_response.encode("UTF-8"))
-        client_socket.close()
+    server_metrics.add_collector(result_cache_metrics)
+    access_log.start()
+    try:
+        server = await asyncio.start_server(serve_connection, sock=listening_socket)
+        async with server:
+            await server.serve_forever()
+    finally:
+        access_log.close()
 
 
-def accept_message_from_client(client_socket):
+async def serve_connection(reader, writer):
     """
-    :param client_socket: "Connection socket"
-    :return: Decoded HTTP request
-    Decodes the HTTP request from the "connection socket".
+    :param reader: Stream the request bytes are read from
+    :param writer: Stream the responses are written to
+    :return: None
+    Serves requests on a persistent connection.
+    Requests are parsed incrementally by the shared RequestParser as bytes arrive,
+    and pipelined requests are answered in order.
+    The connection is closed when the client asks for it, after MAX_KEEP_ALIVE_REQUESTS requests,
+    when a started request is not complete REQUEST_TIMEOUT seconds after its first bytes arrived
+    or when the client stays idle for KEEP_ALIVE_TIMEOUT seconds between requests.
     """
-    output = ""
-    while True:
-        message = client_socket.recv(4096)
-        if message is not None:
-            output += message.decode("UTF-8")
-        elif not message or message.endswith("\r\n\r\n"):
-            print(output)
-            break
-        return output
+    access_log.verbose("Connection established with client with address = ", writer.get_extra_info("peername"))
+    # Responses are written as soon as they are ready, Nagle's algorithm would only delay the last segment.
+    # Recent asyncio versions already set it on TCP transports, it is set here like in the other servers
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    loop = asyncio.get_running_loop()
+    connection_id = next(connection_ids)
+    server_metrics.connection_opened()
+    request_parser = RequestParser(MAX_HEADER_BYTES, MAX_BODY_BYTES)
+    request_deadline = None
+    received_at = time.monotonic()
+    requests_served = 0
+    keep_alive = True
+    try:
+        while keep_alive:
+            parse_started = time.perf_counter()
+            try:
+                client_request = request_parser.next_request()
+            except HttpParseError as e:
+                print(e, file=sys.stderr)
+                request_response = create_response(e.status_code, e.phrase, None)
+                writer.writelines(request_response)
+                length = sum(map(len, request_response))
+                server_metrics.record_response(e.status_code, length)
+                access_log.record(connection_id, "-", "-", e.status_code, length, received_at)
+                break
+
+            if client_request is None:
+                if request_parser.has_partial_request:
+                    if request_deadline is None:
+                        request_deadline = loop.time() + REQUEST_TIMEOUT
+                    timeout = request_deadline - loop.time()
+                else:
+                    timeout = REQUEST_TIMEOUT if requests_served == 0 else KEEP_ALIVE_TIMEOUT
+                try:
+                    message = await asyncio.wait_for(reader.read(RECV_SIZE), max(timeout, 0))
+                except asyncio.TimeoutError:
+                    # Idle connection, or a request which is sent too slowly
+                    break
+                if not message:
+                    # Client closed its end of the connection
+                    break
+                received_at = time.monotonic()
+                request_parser.feed(message)
+                continue
 
+            compute_started = time.perf_counter()
+            server_metrics.parse.observe(compute_started - parse_started)
+            request_deadline = None
+            requests_served += 1
+            keep_alive = client_request.keep_alive and requests_served < MAX_KEEP_ALIVE_REQUESTS
+            request_response = parse_client_request(client_request, keep_alive)
+            send_started = time.perf_counter()
+            server_metrics.compute.observe(send_started - compute_started)
+            writer.writelines(request_response)
+            # Only waits when the transport buffer is above its high-water mark
+            await writer.drain()
+            server_metrics.send.observe(time.perf_counter() - send_started)
+            status_code = response_status(request_response)
+            length = sum(map(len, request_response))
+            server_metrics.record_response(status_code, length)
+            access_log.record(connection_id, client_request.method, client_request.target, status_code, length,
+                              received_at)
+        await writer.drain()
+    except ConnectionError as e:
+        print("Exception condition on connection", e, file=sys.stderr)
+    finally:
+        server_metrics.connection_closed()
+        writer.close()
 
-def parse_client_request(client_request):
+
+def parse_client_request(client_request, keep_alive=False):
     """
-    :param client_request: Decoded HTTP request
+    :param client_request: HttpRequest parsed by the shared RequestParser
+    :param keep_alive: Whether the connection stays open after the response
     :return: Calculated query result
-    Parses the HTTP request and checks that the the request uses the 'GET' method.
+    Checks that the the request uses the 'GET' method, or the 'POST' method for the batch endpoint.
     Filters the query parameters from the request.
+    Unsupported requests are answered with an error response instead of stopping the server.
     """
-    arr_request = client_request.split("\r\n")
-    # Splits the HTTP request by line
-    request_header = arr_request[0]
-    request_text = request_header.split(" ")
-    # Splits the first line of the HTTP request
+    if client_request.method == "POST" and client_request.target == "/product/batch":
+        return calculate_batch_result(client_request.body, keep_alive)
 
-    if request_text[0] != "GET":
+    if client_request.method != "GET":
         sys.stderr.write("Unsupported request. Only GET allowed")
-        sys.exit(7)
+        return create_response(405, "Method Not Allowed", None, keep_alive, b"Allow: GET, POST\r\n")
 
-    if request_text[2].startswith("HTTPS"):
+    if client_request.version.startswith("HTTPS"):
         sys.stderr.write("HTTPS not supported")
-        sys.exit(7)
+        return create_response(400, "Bad Request", None, keep_alive)
+
+    if client_request.target == METRICS_PATH:
+        return server_metrics.response(keep_alive)
 
-    query_part = request_text[1]
-    api_result = calculate_query_result(query_part)
+    query_part = client_request.target
+    api_result = calculate_query_result(query_part, keep_alive)
     return api_result
 
 
-def create_response(status_code, phrase, content):
+def create_response(status_code, phrase, content, keep_alive=False, extra_headers=b""):
     """
     :param status_code: Status code
     :param phrase: Corresponding response message of status code
-    :param content: JSON object containing query parameters and result
-    :return: Response for requested URL
+    :param content: JSON string or cached ResultEntry containing query parameters and result
+    :param keep_alive: Whether the connection stays open after the response
+    :param extra_headers: Encoded additional header lines, each terminated by CRLF
+    :return: Response parts for requested URL, the encoded header followed by the body
     Creates a HTTP response displaying the header and content if status code is less than 400.
+    Error responses carry "Content-Length: 0" so that persistent connections stay framed.
+    The header is joined from pre-encoded blocks, and the body of a cached result is sent as is.
     """
-    response = "HTTP/1.1 " + str(status_code) + " " + phrase + "\r\n"
-
     if status_code < 400:
         # Creating response according to HTTP response code found on developer.mozilla.org
-        response += "Content-Length: " + str(len(content)) + "\r\n" + \
-                    "Connection: close\r\n" + \
-                    "Content-Type: application/json; charset=UTF-8\r\n" + \
-                    "Date: " + datetime.date.strftime(datetime.datetime.utcnow(),
-                                                      "%a, %d %b %Y %H:%M:%S") + " GMT\r\n\r\n" + \
-                    content
-    return response
+        if not isinstance(content, ResultEntry):
+            content = ResultEntry(content)
+        return [build_header(status_code, phrase, keep_alive, content.header_block, extra_headers), content.body]
+    return [build_header(status_code, phrase, keep_alive, EMPTY_BODY_HEADER, extra_headers)]
 
 
-def calculate_query_result(query_parameters):
+def calculate_query_result(query_parameters, keep_alive=False):
     """
-    :param status_code: Query parameters from URL entered
+    :param query_parameters: Query parameters from URL entered
+    :param keep_alive: Whether the connection stays open after the response
     :return: Response for requested URL
     Determines which status code should be shown in the HTTP response.
     Calculates the result from multiplying query parameters.
     Creates a JSON object containing query parameters and result.
+    Results are memoized: a query string seen before is answered without being parsed,
+    and operands seen before under a different spelling are answered without being multiplied.
     """
     params = query_parameters.split("?")
     if params[0] != "/product":
         # Returns a 404 error response if a URL other than "/product" is requested
-        print("404 Not Found")
-        response = create_response(404, "Not Found", None)
+        access_log.verbose("404 Not Found")
+        response = create_response(404, "Not Found", None, keep_alive)
         return response
 
     if len(params) == 1 or params[1] == "":
         # Returns a 400 error response if there are no parameters given
-        print("400 Bad Request")
-        response = create_response(400, "Bad Request", None)
+        access_log.verbose("400 Bad Request")
+        response = create_response(400, "Bad Request", None, keep_alive)
         return response
 
     query_params = params[1]
+    cache_entry = result_cache.get_by_query(query_params)
+    if cache_entry is not None:
+        return create_response(200, "OK", cache_entry, keep_alive)
+
     individual_params = query_params.split("&")
     # Splits the given parameters
-    ans = 1.0
     variable_values = []
     for each_param in individual_params:
         queried_variable = each_param.split("=")
-        variable_name = queried_variable[0]
-        variable_value = queried_variable[1]
         try:
+            variable_name = queried_variable[0]
+            variable_value = queried_variable[1]
             # Checks for float or int as per https://www.programiz.com/python-programming/examples/check-string-number
             value = float(variable_value)
             variable_values.append(value)
-            ans *= value
 
-        except ValueError:
+        except (ValueError, IndexError):
             # Returns a 400 error response if a given parameter is not a number
-            print("400 Bad Request")
-            response = create_response(400, "Bad Request", None)
+            access_log.verbose("400 Bad Request")
+            response = create_response(400, "Bad Request", None, keep_alive)
             return response
 
+    operands_key = result_cache.normalize(variable_values)
+    cache_entry = result_cache.get_by_operands(operands_key)
+    if cache_entry is not None:
+        result_cache.put(query_params, operands_key, cache_entry)
+        return create_response(200, "OK", cache_entry, keep_alive)
+
+    # Multiplies in operand order starting from 1.0, exactly like the previous loop did
+    ans = math.prod(variable_values, start=1.0)
+
     # Checks if the result is infinity or negative infinity
     if ans == float("inf"):
         ans = "inf"
@@ -155,10 +299,45 @@ def calculate_query_result(query_parameters):
         sort_keys=False, indent=4)
     # Followed JSON implementation from https://stackoverflow.com/questions/52893297/how-to-write-the-response-in-a-file-with-json-format-using-python
     # and https://pynative.com/python-json-dumps-and-dump-for-json-encoding/
-    response_content = create_response(200, "OK", json_content)
+    cache_entry = ResultEntry(json_content)
+    result_cache.put(query_params, operands_key, cache_entry)
+    response_content = create_response(200, "OK", cache_entry, keep_alive)
     return response_content
 
 
+def calculate_batch_result(request_body: bytes, keep_alive=False):
+    """
+    :param request_body: JSON array of operand lists, e.g. [[1, 2], [3, 4.5]]
+    :param keep_alive: Whether the connection stays open after the response
+    :return: Response for the batch request
+    Calculates the product of every operand list in one pass with math.prod.
+    The results are returned in request order as compact JSON, with infinity reported as "inf" or "-inf"
+    like the single /product endpoint does.
+    """
+    try:
+        batch = json.loads(request_body)
+        if not isinstance(batch, list) or not batch or not all(
+                isinstance(operands, list) and operands and
+                all(type(value) in (int, float) for value in operands) for operands in batch):
+            raise ValueError("not a non-empty list of non-empty number lists")
+        # JSON integers are unbounded, one beyond the float range raises OverflowError here instead of in math.prod
+        batch = [[float(value) for value in operands] for operands in batch]
+    except (ValueError, OverflowError, RecursionError):
+        # Returns a 400 error response if the body is not a non-empty list of non-empty number lists,
+        # including bodies nested too deeply for the JSON decoder
+        access_log.verbose("400 Bad Request")
+        return create_response(400, "Bad Request", None, keep_alive)
+
+    results = [math.prod(operands, start=1.0) for operands in batch]
+    for index, result in enumerate(results):
+        if math.isinf(result) or math.isnan(result):
+            # JSON has no literals for these values
+            results[index] = str(result)
+
+    json_content = json.dumps({"operation": "product", "results": results}, separators=(",", ":"))
+    return create_response(200, "OK", json_content, keep_alive)
+
+
 def check_port_validity(port: int):
     """
     :param port: Port number entered
@@ -175,20 +354,38 @@ def check_port_validity(port: int):
         sys.exit(7)
 
 
-def check_argument_format(args: list):
+def check_argument_format(args: list) -> dict:
     """
     :param args: List of arguments passed during program execution
-    :return: None
-    Checks the number of arguments passed to the program.
-    If more or less than 2 parameters are passed the program would exit with a non-zero code.
+    :return: Options given after the port: worker count, access log path and verbosity
+    Checks the arguments passed to the program.
+    The port may be followed by "--workers N", "--access-log <file>" and "--verbose" in any order,
+    any other argument makes the program exit with a non-zero code.
     """
-    if len(args) != 2:
-        sys.stderr.write("Enter in format: python3 http_server3.py [port]")
+    options = {"workers": 1, "access_log": None, "verbose": False}
+    index = 2
+    valid = len(args) >= 2
+    while valid and index < len(args):
+        if args[index] == "--verbose":
+            options["verbose"] = True
+            index += 1
+        elif args[index] == "--workers" and index + 1 < len(args) and args[index + 1].isdigit():
+            options["workers"] = int(args[index + 1])
+            index += 2
+        elif args[index] == "--access-log" and index + 1 < len(args):
+            options["access_log"] = args[index + 1]
+            index += 2
+        else:
+            valid = False
+    if not valid:
+        sys.stderr.write("Enter in format: python3 http_server3.py [port] [--workers N] [--access-log <file>] [--verbose]")
         sys.exit(7)
+    return options
 
 
 if __name__ == '__main__':
     args = sys.argv
-    check_argument_format(args)
+    options = check_argument_format(args)
     entered_port = int(args[1])
-    start_server(entered_port)
+    access_log.configure(options["access_log"], options["verbose"])
+    start_server(entered_port, options["workers"])
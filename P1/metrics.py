@@ -0,0 +1,141 @@
+import os
+import time
+import bisect
+from array import array
+from http_response import build_header
+
+# Reserved request target the metrics are served at
+METRICS_PATH = "/metrics"
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Status codes the servers answer with, any other code is counted as "other"
+STATUS_CODES = (200, 206, 304, 400, 403, 404, 405, 408, 413, 416, 431, 500, 501)
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket is +Inf
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5)
+
+
+class Histogram:
+    """
+    Histogram with fixed buckets, stored in preallocated arrays so that observing a value allocates no container.
+    """
+
+    def __init__(self, bounds: tuple = LATENCY_BUCKETS):
+        self.bounds = bounds
+        # Non-cumulative count of every bucket, the extra last bucket holds values above the largest bound
+        self.counts = array("q", [0] * (len(bounds) + 1))
+        self.total = array("d", [0.0])
+
+    def observe(self, value: float):
+        """
+        :param value: Observed duration in seconds
+        :return: None
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total[0] += value
+
+    def render(self, name: str, labels: str) -> list:
+        """
+        :param name: Metric name
+        :param labels: Label pairs shared by every line, e.g. 'phase="parse"'
+        :return: Lines of the histogram in Prometheus text format
+        """
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(name + '_bucket{' + labels + ',le="' + repr(bound) + '"} ' + str(cumulative))
+        cumulative += self.counts[-1]
+        lines.append(name + '_bucket{' + labels + ',le="+Inf"} ' + str(cumulative))
+        lines.append(name + "_sum{" + labels + "} " + repr(self.total[0]))
+        lines.append(name + "_count{" + labels + "} " + str(cumulative))
+        return lines
+
+
+class ServerMetrics:
+    """
+    Instrumentation of a server process: responses per status code, latency histograms of the parse, compute
+    and send phases of a request, open connections and bytes sent.
+    Every value lives in a preallocated array, recording a request allocates no container.
+    Each prefork worker keeps its own metrics, a scrape reports the worker which accepted it.
+    """
+
+    def __init__(self):
+        self.status_index = {status_code: index for index, status_code in enumerate(STATUS_CODES)}
+        self.status_counts = array("q", [0] * (len(STATUS_CODES) + 1))
+        self.parse = Histogram()
+        self.compute = Histogram()
+        self.send = Histogram()
+
+        # Open connections, connections accepted and response bytes sent
+        self.counters = array("q", [0, 0, 0])
+        self.started_at = time.time()
+
+        # Functions returning additional (name, type, help, value) tuples at scrape time
+        self.collectors = []
+
+    def connection_opened(self):
+        self.counters[0] += 1
+        self.counters[1] += 1
+
+    def connection_closed(self):
+        self.counters[0] -= 1
+
+    def record_response(self, status_code: int, bytes_sent: int):
+        """
+        :param status_code: Status code of the response
+        :param bytes_sent: Length of the response, header included
+        :return: None
+        """
+        self.status_counts[self.status_index.get(status_code, len(STATUS_CODES))] += 1
+        self.counters[2] += bytes_sent
+
+    def add_collector(self, collector):
+        """
+        :param collector: Function returning a list of (name, type, help, value) tuples
+        :return: None
+        """
+        self.collectors.append(collector)
+
+    def render(self) -> bytes:
+        """
+        :return: Every metric encoded in Prometheus text exposition format
+        """
+        lines = ["# HELP p1_http_responses_total Responses sent, by status code",
+                 "# TYPE p1_http_responses_total counter"]
+        for status_code, count in zip(STATUS_CODES, self.status_counts):
+            lines.append('p1_http_responses_total{code="' + str(status_code) + '"} ' + str(count))
+        lines.append('p1_http_responses_total{code="other"} ' + str(self.status_counts[-1]))
+
+        lines.append("# HELP p1_http_request_phase_seconds Time spent parsing requests, computing responses "
+                     "and sending them")
+        lines.append("# TYPE p1_http_request_phase_seconds histogram")
+        for phase, histogram in (("parse", self.parse), ("compute", self.compute), ("send", self.send)):
+            lines.extend(histogram.render("p1_http_request_phase_seconds", 'phase="' + phase + '"'))
+
+        values = [("p1_http_active_connections", "gauge", "Connections currently open", self.counters[0]),
+                  ("p1_http_connections_total", "counter", "Connections accepted", self.counters[1]),
+                  ("p1_http_response_bytes_total", "counter", "Response bytes sent, headers included",
+                   self.counters[2]),
+                  ("p1_process_start_time_seconds", "gauge", "Unix time the metrics were created at",
+                   self.started_at),
+                  ("p1_process_id", "gauge", "Process id of the worker which answered the scrape", os.getpid())]
+        for collector in self.collectors:
+            values.extend(collector())
+        for name, metric_type, description, value in values:
+            lines.append("# HELP " + name + " " + description)
+            lines.append("# TYPE " + name + " " + metric_type)
+            lines.append(name + " " + str(value))
+        return ("\n".join(lines) + "\n").encode("UTF-8")
+
+    def response(self, keep_alive: bool = False) -> list:
+        """
+        :param keep_alive: Whether the connection stays open after the response
+        :return: Response parts of a scrape of METRICS_PATH
+        """
+        body = self.render()
+        entity_headers = ("Content-Length: " + str(len(body)) + "\r\n" +
+                          "Content-Type: " + METRICS_CONTENT_TYPE + "\r\n").encode("UTF-8")
+        return [build_header(200, "OK", keep_alive, entity_headers), body]
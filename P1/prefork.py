@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+import signal
+import socket
+import traceback
+
+# Seconds workers get to finish after SIGTERM before they are killed
+SHUTDOWN_GRACE_PERIOD = 10
+
+# A worker which dies sooner than this after starting is restarted only after this many seconds,
+# so a worker failing on start does not turn into a fork loop
+RESTART_DELAY = 1.0
+
+
+class ShutdownRequested(Exception):
+    """
+    Raised in the master process when it receives SIGTERM or SIGINT.
+    """
+
+
+def create_reuseport_socket(port_number: int, backlog: int = socket.SOMAXCONN):
+    """
+    :param port_number: Port number on which server is listening for requests
+    :param backlog: Number of unaccepted connections before new connections are refused
+    :return: Listening socket bound with SO_REUSEPORT
+    Every worker binds its own socket to the same port, and the kernel spreads new connections across them.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        sys.stderr.write("SO_REUSEPORT is not supported on this platform\n")
+        sys.exit(7)
+
+    listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    listening_socket.bind(("", port_number))
+    listening_socket.listen(backlog)
+    return listening_socket
+
+
+def run_workers(worker_count: int, serve_worker):
+    """
+    :param worker_count: Number of worker processes
+    :param serve_worker: Function run in every worker, it binds its own socket and serves requests until exit
+    :return: None
+    Forks the workers and supervises them.
+    A worker which exits is restarted, until SIGTERM or SIGINT asks the master to shut down.
+    On shutdown every worker receives SIGTERM and is killed if it has not exited after SHUTDOWN_GRACE_PERIOD.
+    """
+    def request_shutdown(signum, frame):
+        raise ShutdownRequested()
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+    # Maps the pid of every running worker to the monotonic time it was started at
+    workers = {}
+    try:
+        for _ in range(worker_count):
+            start_worker(workers, serve_worker)
+
+        while True:
+            pid, status = os.wait()
+            started_at = workers.pop(pid, None)
+            if started_at is None:
+                continue
+            print("Worker", pid, "exited with status", os.waitstatus_to_exitcode(status), "- restarting",
+                  file=sys.stderr)
+            if time.monotonic() - started_at < RESTART_DELAY:
+                time.sleep(RESTART_DELAY)
+            start_worker(workers, serve_worker)
+    except ShutdownRequested:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        stop_workers(workers)
+
+
+def start_worker(workers: dict, serve_worker):
+    """
+    :param workers: Running workers keyed by pid
+    :param serve_worker: Function run in the worker
+    :return: None
+    Forks a worker. The child never returns from this function.
+    """
+    pid = os.fork()
+    if pid != 0:
+        workers[pid] = time.monotonic()
+        return
+
+    exit_code = 0
+    try:
+        # Ctrl-C reaches the whole process group, the master turns it into SIGTERM for the workers
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, stop_worker)
+        serve_worker()
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 0
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+
+
+def stop_worker(signum, frame):
+    """
+    Signal handler of the workers, unwinds the event loop so sockets and files are closed before exiting.
+    """
+    sys.exit(0)
+
+
+def stop_workers(workers: dict):
+    """
+    :param workers: Running workers keyed by pid
+    :return: None
+    Sends SIGTERM to every worker and waits for them, killing those still running after SHUTDOWN_GRACE_PERIOD.
+    """
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    deadline = time.monotonic() + SHUTDOWN_GRACE_PERIOD
+    while workers and time.monotonic() < deadline:
+        pid, _ = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            time.sleep(0.05)
+            continue
+        workers.pop(pid, None)
+
+    for pid in workers:
+        print("Worker", pid, "did not exit in time, killing it", file=sys.stderr)
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+    workers.clear()
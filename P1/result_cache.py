@@ -0,0 +1,98 @@
+from collections import OrderedDict
+
+# Number of results kept by default, the raw query index holds at most as many query strings
+DEFAULT_MAX_ENTRIES = 10000
+
+
+class ResultEntry:
+    """
+    A cached /product result: its encoded JSON body and its pre-encoded entity headers.
+    """
+
+    def __init__(self, json_content: str):
+        self.body = json_content.encode("UTF-8")
+        self.header_block = ("Content-Length: " + str(len(self.body)) + "\r\n" +
+                             "Content-Type: application/json; charset=UTF-8\r\n").encode("UTF-8")
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of /product results.
+    Results are keyed by the normalized operand tuple, in which operand order is preserved
+    and every operand is canonicalized with repr(float(value)), so "2", "2.0" and "2e0" share an entry.
+    A second index keyed by the raw query string lets repeated queries skip parsing entirely.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+
+        # Least recently used entries are at the front of both indexes
+        self.by_query = OrderedDict()
+        self.by_operands = OrderedDict()
+
+        # Hits on the raw query index, hits on the operand index after parsing, and full misses
+        self.query_hits = 0
+        self.operand_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(operands: list) -> tuple:
+        """
+        :param operands: Parsed operand values
+        :return: Hashable key with one canonical string per operand
+        repr keeps -0.0 apart from 0.0 and makes nan usable as a key.
+        """
+        return tuple(repr(value) for value in operands)
+
+    def get_by_query(self, raw_query: str):
+        """
+        :param raw_query: Query string as sent by the client
+        :return: ResultEntry, or None if this exact query string has not been seen
+        """
+        entry = self.by_query.get(raw_query)
+        if entry is not None:
+            self.by_query.move_to_end(raw_query)
+            self.query_hits += 1
+        return entry
+
+    def get_by_operands(self, operands_key: tuple):
+        """
+        :param operands_key: Normalized operand tuple
+        :return: ResultEntry, or None on a miss
+        """
+        entry = self.by_operands.get(operands_key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.by_operands.move_to_end(operands_key)
+        self.operand_hits += 1
+        return entry
+
+    def put(self, raw_query: str, operands_key: tuple, entry: ResultEntry):
+        """
+        :param raw_query: Query string as sent by the client
+        :param operands_key: Normalized operand tuple
+        :param entry: Result for the operands
+        :return: None
+        Stores the result under both keys, evicting least recently used entries beyond max_entries.
+        """
+        self.by_operands[operands_key] = entry
+        self.by_operands.move_to_end(operands_key)
+        self.by_query[raw_query] = entry
+        self.by_query.move_to_end(raw_query)
+        while len(self.by_operands) > self.max_entries:
+            self.by_operands.popitem(last=False)
+        while len(self.by_query) > self.max_entries:
+            self.by_query.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        :return: Hit and miss counters and current sizes
+        """
+        return {
+            "query_hits": self.query_hits,
+            "operand_hits": self.operand_hits,
+            "misses": self.misses,
+            "entries": len(self.by_operands),
+            "queries": len(self.by_query)
+        }
@@ -0,0 +1,122 @@
+import os
+import time
+from collections import OrderedDict
+from static_files import MIN_COMPRESS_BYTES, build_entity_headers, build_validator_headers, file_validators
+
+# Total number of body bytes kept in memory by default
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Files larger than this are never cached, they are streamed with sendfile instead
+DEFAULT_MAX_ENTRY_BYTES = 1024 * 1024
+
+# Seconds during which a cache entry is trusted without calling stat on its file again
+DEFAULT_REVALIDATE_INTERVAL = 1.0
+
+
+class CacheEntry:
+    """
+    A cached static file: its body bytes, its pre-encoded entity headers, its validators
+    and the file metadata it was read with.
+    """
+
+    def __init__(self, body: bytes, stat_result: os.stat_result):
+        self.body = body
+        self.length = len(body)
+        self.header_block = build_entity_headers(self.length)
+        self.etag, self.last_modified = file_validators(stat_result)
+        self.validator_headers = build_validator_headers(self.etag, self.last_modified,
+                                                         self.length >= MIN_COMPRESS_BYTES)
+        self.mtime = int(stat_result.st_mtime)
+        self.mtime_ns = stat_result.st_mtime_ns
+        self.size = stat_result.st_size
+        self.inode = stat_result.st_ino
+        self.checked_at = time.monotonic()
+
+    def matches(self, stat_result: os.stat_result) -> bool:
+        """
+        :param stat_result: Current metadata of the file
+        :return: True if the file has not changed since it was cached
+        """
+        return (self.mtime_ns == stat_result.st_mtime_ns and self.size == stat_result.st_size and
+                self.inode == stat_result.st_ino)
+
+    def slice(self, start: int, end: int):
+        """
+        :param start: First byte of the range
+        :param end: Last byte of the range, inclusive
+        :return: Read-only view of the range, the body bytes are not copied
+        """
+        return memoryview(self.body)[start:end + 1]
+
+
+class StaticCache:
+    """
+    Byte-bounded LRU cache of static files keyed by their resolved path.
+    Entries are revalidated with stat (mtime, size and inode) at most once per revalidate_interval seconds,
+    so a hot page is served from memory without touching the file system.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, max_entry_bytes: int = DEFAULT_MAX_ENTRY_BYTES,
+                 revalidate_interval: float = DEFAULT_REVALIDATE_INTERVAL):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.revalidate_interval = revalidate_interval
+
+        # Least recently used entries are at the front
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+
+    def get(self, path: str):
+        """
+        :param path: Resolved path of the requested file
+        :return: CacheEntry, or None if the file is not cached or changed on disk
+        """
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+
+        now = time.monotonic()
+        if now - entry.checked_at >= self.revalidate_interval:
+            try:
+                stat_result = os.stat(path)
+            except OSError:
+                stat_result = None
+            if stat_result is None or not entry.matches(stat_result):
+                self.evict(path)
+                return None
+            entry.checked_at = now
+
+        self.entries.move_to_end(path)
+        return entry
+
+    def load(self, path: str):
+        """
+        :param path: Resolved path of the requested file
+        :return: CacheEntry for the file, or None if the file is too large to be cached
+        Reads the file and stores it in the cache, evicting least recently used entries to stay within max_bytes.
+        """
+        with open(path, "rb") as file:
+            stat_result = os.fstat(file.fileno())
+            if stat_result.st_size > self.max_entry_bytes:
+                return None
+            entry = CacheEntry(file.read(), stat_result)
+
+        if entry.length > self.max_entry_bytes:
+            # The file grew between fstat and read
+            return None
+
+        self.evict(path)
+        while self.entries and self.current_bytes + entry.length > self.max_bytes:
+            self.evict(next(iter(self.entries)))
+        self.entries[path] = entry
+        self.current_bytes += entry.length
+        return entry
+
+    def evict(self, path: str):
+        """
+        :param path: Resolved path of a cached file
+        :return: None
+        """
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.current_bytes -= entry.length
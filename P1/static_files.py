@@ -0,0 +1,414 @@
+import os
+import mmap
+import errno
+import select
+import socket
+import datetime
+import email.utils
+import binascii
+from http_response import EMPTY_BODY_HEADER, build_header, sendmsg_all
+
+# Largest number of bytes handed to a single sendfile or send call
+SEND_CHUNK_SIZE = 1 << 20
+
+# errno values meaning sendfile cannot be used for this file / socket pair, so the mmap path is used instead
+SENDFILE_UNSUPPORTED = (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP)
+
+# Content type of every file served by the P1 file servers
+HTML_CONTENT_TYPE = "text/html; charset=UTF-8"
+
+# Requests asking for more ranges than this are answered with the full body
+MAX_RANGES = 16
+
+# Files smaller than this are always sent uncompressed, the saving would not be worth the Vary header
+MIN_COMPRESS_BYTES = 1024
+
+# Separates the parts of a multipart/byteranges body
+BYTERANGES_BOUNDARY = "P1_BYTERANGES_" + binascii.hexlify(os.urandom(8)).decode("ascii")
+
+
+def build_entity_headers(content_length: int, content_type: str = HTML_CONTENT_TYPE,
+                         content_encoding: str = None) -> bytes:
+    """
+    :param content_length: Length of the body in bytes
+    :param content_type: Media type of the body
+    :param content_encoding: Content coding of the body, None for the identity coding
+    :return: Encoded Content-Length, Content-Type and Content-Encoding header lines
+    """
+    entity_headers = "Content-Length: " + str(content_length) + "\r\n" + \
+                     "Content-Type: " + content_type + "\r\n"
+    if content_encoding is not None:
+        entity_headers += "Content-Encoding: " + content_encoding + "\r\n"
+    return entity_headers.encode("UTF-8")
+
+
+def build_validator_headers(etag: str, last_modified: str, negotiated: bool = False) -> bytes:
+    """
+    :param etag: ETag of the file
+    :param last_modified: Last-Modified header value of the file
+    :param negotiated: Whether the response depends on Accept-Encoding, which adds a Vary header
+    :return: Encoded ETag, Last-Modified, Accept-Ranges and Vary header lines
+    Computed once per opened or cached file, so responses reuse the encoded lines.
+    """
+    validator_headers = "ETag: " + etag + "\r\n" + \
+                        "Last-Modified: " + last_modified + "\r\n" + \
+                        "Accept-Ranges: bytes\r\n"
+    if negotiated:
+        validator_headers += "Vary: Accept-Encoding\r\n"
+    return validator_headers.encode("UTF-8")
+
+
+def file_validators(stat_result: os.stat_result):
+    """
+    :param stat_result: Metadata of a served file
+    :return: Tuple of the ETag and the Last-Modified header values
+    The ETag is derived from the inode, size and modification time, so it changes whenever the file does.
+    """
+    etag = '"%x-%x-%x"' % (stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+    last_modified = datetime.datetime.fromtimestamp(int(stat_result.st_mtime), datetime.timezone.utc)
+    return etag, datetime.date.strftime(last_modified, "%a, %d %b %Y %H:%M:%S") + " GMT"
+
+
+class FileBody:
+    """
+    Body of a static file response which is streamed from the file descriptor instead of being read into memory.
+    Bytes are sent with os.sendfile, falling back to memoryview slices of an mmap of the file
+    on platforms or file systems where sendfile is not available.
+    """
+
+    def __init__(self, file_descriptor: int, offset: int, length: int):
+        self.file_descriptor = file_descriptor
+        self.offset = offset
+        self.length = length
+
+        # Number of body bytes already written to the socket
+        self.sent = 0
+
+        self.use_sendfile = hasattr(os, "sendfile")
+        self.mapped_file = None
+        self.mapped_view = None
+
+        # Validators of the file, only set on bodies created by open()
+        self.etag = None
+        self.last_modified = None
+        self.mtime = None
+        self.mtime_ns = None
+
+        # Content coding of the file, set when a precompressed sibling is sent in place of the requested file
+        self.content_encoding = None
+
+    @classmethod
+    def open(cls, path: str):
+        """
+        :param path: Path of the file to be sent
+        :return: FileBody covering the whole file
+        Opens the file and takes its length in bytes and its validators from os.fstat.
+        """
+        return cls.from_descriptor(os.open(path, os.O_RDONLY))
+
+    @classmethod
+    def from_descriptor(cls, file_descriptor: int):
+        """
+        :param file_descriptor: Descriptor of a file opened for reading, owned by the returned body
+        :return: FileBody covering the whole file
+        """
+        stat_result = os.fstat(file_descriptor)
+        file_body = cls(file_descriptor, 0, stat_result.st_size)
+        file_body.etag, file_body.last_modified = file_validators(stat_result)
+        file_body.mtime = int(stat_result.st_mtime)
+        file_body.mtime_ns = stat_result.st_mtime_ns
+        file_body.validator_headers = build_validator_headers(file_body.etag, file_body.last_modified,
+                                                              file_body.length >= MIN_COMPRESS_BYTES)
+        return file_body
+
+    def slice(self, start: int, end: int):
+        """
+        :param start: First byte of the range, relative to this body
+        :param end: Last byte of the range, inclusive
+        :return: FileBody over a duplicate descriptor, so it can be closed independently of this one
+        """
+        return FileBody(os.dup(self.file_descriptor), self.offset + start, end - start + 1)
+
+    @property
+    def finished(self) -> bool:
+        return self.sent >= self.length
+
+    def send_to(self, client_socket) -> int:
+        """
+        :param client_socket: "Connection socket"
+        :return: Number of bytes sent
+        Sends the next chunk of the body.
+        Raises BlockingIOError when a non-blocking socket is not ready for writing.
+        """
+        position = self.offset + self.sent
+        chunk_size = min(self.length - self.sent, SEND_CHUNK_SIZE)
+        if chunk_size <= 0:
+            return 0
+
+        if self.use_sendfile:
+            try:
+                sent = os.sendfile(client_socket.fileno(), self.file_descriptor, position, chunk_size)
+            except OSError as e:
+                if e.errno not in SENDFILE_UNSUPPORTED:
+                    raise
+                self.use_sendfile = False
+            else:
+                if sent == 0:
+                    # The file shrank underneath us, the promised Content-Length cannot be honoured
+                    raise ConnectionAbortedError("File truncated while sending")
+                self.sent += sent
+                return sent
+
+        if self.mapped_view is None:
+            self.mapped_file = mmap.mmap(self.file_descriptor, 0, access=mmap.ACCESS_READ)
+            self.mapped_view = memoryview(self.mapped_file)
+        sent = client_socket.send(self.mapped_view[position:position + chunk_size])
+        self.sent += sent
+        return sent
+
+    def send_all(self, client_socket):
+        """
+        :param client_socket: "Connection socket" in blocking or timeout mode
+        :return: None
+        Sends the remaining body, waiting for the socket to become writable when needed.
+        """
+        while not self.finished:
+            try:
+                self.send_to(client_socket)
+            except BlockingIOError:
+                # Sockets with a timeout are non-blocking at the OS level, so wait for them here
+                _, writable, _ = select.select([], [client_socket], [], client_socket.gettimeout())
+                if not writable:
+                    raise socket.timeout("timed out")
+
+    def close(self):
+        """
+        :return: None
+        Releases the mapping, if any, and the file descriptor.
+        """
+        if self.mapped_view is not None:
+            self.mapped_view.release()
+            self.mapped_file.close()
+            self.mapped_view = None
+            self.mapped_file = None
+        if self.file_descriptor != -1:
+            os.close(self.file_descriptor)
+            self.file_descriptor = -1
+
+
+class RangeBody:
+    """
+    Body of a 206 Partial Content response, made of encoded bytes and FileBody parts.
+    """
+
+    def __init__(self, parts: list, content_type: str):
+        self.parts = parts
+        self.content_type = content_type
+        self.length = sum(part.length if isinstance(part, FileBody) else len(part) for part in parts)
+
+
+def is_not_modified(request_headers: dict, etag: str, mtime: int) -> bool:
+    """
+    :param request_headers: Request headers with lower case names
+    :param etag: Current ETag of the file
+    :param mtime: Modification time of the file in whole seconds
+    :return: True if the client's copy is current and a 304 response can be sent
+    If-None-Match takes precedence over If-Modified-Since as required by RFC 7232.
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        client_etags = [client_etag.strip() for client_etag in if_none_match.split(",")]
+        # Weak comparison, a W/ prefix does not prevent a match
+        return "*" in client_etags or any(client_etag.replace("W/", "", 1) == etag for client_etag in client_etags)
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is None:
+        return False
+    try:
+        client_time = email.utils.parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if client_time.tzinfo is None:
+        client_time = client_time.replace(tzinfo=datetime.timezone.utc)
+    return mtime <= client_time.timestamp()
+
+
+def parse_range_header(request_headers: dict, size: int, etag: str, last_modified: str):
+    """
+    :param request_headers: Request headers with lower case names
+    :param size: Length of the full body in bytes
+    :param etag: Current ETag of the file
+    :param last_modified: Current Last-Modified value of the file
+    :return: None if the full body should be sent, otherwise a list of inclusive (start, end) byte ranges.
+             An empty list means that none of the ranges can be satisfied.
+    Malformed or unsupported Range headers are ignored, as are ranges guarded by a stale If-Range.
+    """
+    range_header = request_headers.get("range")
+    if range_header is None:
+        return None
+    if_range = request_headers.get("if-range")
+    if if_range is not None and if_range.strip() not in (etag, last_modified):
+        return None
+
+    unit, _, range_specs = range_header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+
+    byte_ranges = []
+    for range_spec in range_specs.split(","):
+        first, separator, last = range_spec.strip().partition("-")
+        if not separator:
+            return None
+        try:
+            if first == "":
+                # Suffix range, the last N bytes of the file
+                suffix_length = int(last)
+                if suffix_length <= 0:
+                    continue
+                start, end = max(0, size - suffix_length), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and end < start:
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start >= size:
+            continue
+        byte_ranges.append((start, end))
+
+    if len(byte_ranges) > MAX_RANGES:
+        return None
+    return byte_ranges
+
+
+def build_range_body(byte_ranges: list, size: int, slice_body) -> tuple:
+    """
+    :param byte_ranges: Satisfiable inclusive (start, end) ranges
+    :param size: Length of the full body in bytes
+    :param slice_body: Function returning the body part for an inclusive (start, end) range
+    :return: Tuple of the RangeBody and the encoded extra header lines of the 206 response
+    A single range is sent as is with a Content-Range header, several ranges as a multipart/byteranges body.
+    """
+    if len(byte_ranges) == 1:
+        start, end = byte_ranges[0]
+        content_range = "Content-Range: bytes " + str(start) + "-" + str(end) + "/" + str(size) + "\r\n"
+        return RangeBody([slice_body(start, end)], HTML_CONTENT_TYPE), content_range.encode("UTF-8")
+
+    parts = []
+    for start, end in byte_ranges:
+        part_header = "\r\n--" + BYTERANGES_BOUNDARY + "\r\n" + \
+                      "Content-Type: " + HTML_CONTENT_TYPE + "\r\n" + \
+                      "Content-Range: bytes " + str(start) + "-" + str(end) + "/" + str(size) + "\r\n\r\n"
+        parts.append(part_header.encode("UTF-8"))
+        parts.append(slice_body(start, end))
+    parts.append(("\r\n--" + BYTERANGES_BOUNDARY + "--\r\n").encode("UTF-8"))
+    return RangeBody(parts, "multipart/byteranges; boundary=" + BYTERANGES_BOUNDARY), b""
+
+
+def send_response_parts(client_socket, response_parts: list):
+    """
+    :param client_socket: "Connection socket" in blocking or timeout mode
+    :param response_parts: Encoded headers and bodies, in the order they are written
+    :return: None
+    Writes a list of response parts, streaming file bodies without copying them into memory.
+    Consecutive encoded parts go out together in one sendmsg call, without being joined first.
+    Every FileBody in the list is closed, even if sending fails.
+    """
+    try:
+        pending_bytes = []
+        for part in response_parts:
+            if isinstance(part, FileBody):
+                if pending_bytes:
+                    sendmsg_all(client_socket, pending_bytes)
+                    pending_bytes = []
+                part.send_all(client_socket)
+            else:
+                pending_bytes.append(part)
+        if pending_bytes:
+            sendmsg_all(client_socket, pending_bytes)
+    finally:
+        close_response_parts(response_parts)
+
+
+def response_length(response_parts: list) -> int:
+    """
+    :param response_parts: Encoded headers and bodies
+    :return: Number of bytes the response parts add up to
+    """
+    return sum(part.length if isinstance(part, FileBody) else len(part) for part in response_parts)
+
+
+def close_response_parts(response_parts):
+    """
+    :param response_parts: Encoded headers and bodies
+    :return: None
+    Closes every FileBody in the given response parts.
+    """
+    for part in response_parts:
+        if isinstance(part, FileBody):
+            part.close()
+
+
+def create_response(status_code, phrase, content, keep_alive=False, extra_headers=b""):
+    """
+    :param status_code: Status code
+    :param phrase: Corresponding response message of status code
+    :param content: CacheEntry, FileBody or RangeBody of requested file, None for responses without a body
+    :param keep_alive: Whether the connection stays open after the response
+    :param extra_headers: Encoded additional header lines, each terminated by CRLF
+    :return: Response parts for requested file, the encoded header followed by the body
+    Creates a HTTP response displaying the header and content.
+    Displays only the header if there is no content.
+    Error responses carry "Content-Length: 0" so that persistent connections stay framed.
+    The Content-Length of a file is its size in bytes as reported by os.fstat.
+    The header is joined from pre-encoded blocks and the body is kept as a separate part,
+    so the two are written with one sendmsg call without being copied together.
+    """
+    if content is None:
+        # Creating response according to HTTP response code found on developer.mozilla.org
+        entity_headers = EMPTY_BODY_HEADER if status_code >= 400 else b""
+        return [build_header(status_code, phrase, keep_alive, entity_headers, extra_headers)]
+
+    if isinstance(content, RangeBody):
+        entity_headers, body_parts = build_entity_headers(content.length, content.content_type), content.parts
+    elif isinstance(content, FileBody):
+        entity_headers = build_entity_headers(content.length, content_encoding=content.content_encoding)
+        body_parts = [content]
+    else:
+        # Cached files keep their encoded Content-Length and Content-Type lines
+        entity_headers, body_parts = content.header_block, [content.body]
+    return [build_header(status_code, phrase, keep_alive, entity_headers, extra_headers)] + body_parts
+
+
+def create_file_response(file_content, request_headers, keep_alive=False):
+    """
+    :param file_content: CacheEntry or FileBody of requested file
+    :param request_headers: Request headers with lower case names
+    :param keep_alive: Whether the connection stays open after the response
+    :return: Response parts for requested file
+    Answers conditional requests with 304 Not Modified when the client's copy is current,
+    and Range requests with 206 Partial Content (or 416 when no range can be satisfied).
+    """
+    validator_headers = file_content.validator_headers
+
+    if is_not_modified(request_headers, file_content.etag, file_content.mtime):
+        close_response_parts([file_content])
+        return create_response(304, "Not Modified", None, keep_alive, validator_headers)
+
+    byte_ranges = parse_range_header(request_headers, file_content.length, file_content.etag,
+                                     file_content.last_modified)
+    if byte_ranges is None:
+        return create_response(200, "OK", file_content, keep_alive, validator_headers)
+
+    if not byte_ranges:
+        close_response_parts([file_content])
+        return create_response(416, "Range Not Satisfiable", None, keep_alive,
+                               ("Content-Range: bytes */" + str(file_content.length) + "\r\n").encode("UTF-8"))
+
+    range_body, range_headers = build_range_body(byte_ranges, file_content.length, file_content.slice)
+    # Every FileBody part has its own descriptor, the one of the full file is no longer needed
+    close_response_parts([file_content])
+    return create_response(206, "Partial Content", range_body, keep_alive, validator_headers + range_headers)
+
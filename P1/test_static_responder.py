@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+from compression import CompressionCache
+from document_index import DocumentIndex, StaticResponder
+from static_cache import StaticCache
+
+
+def status_line(response_parts: list) -> bytes:
+    """
+    :param response_parts: Response parts returned by StaticResponder
+    :return: Status line of the response, without its CRLF
+    """
+    return response_parts[0].split(b"\r\n", 1)[0]
+
+
+class UnreadableFileTest(unittest.TestCase):
+    """
+    An indexed HTML file which the server process may not read.
+    """
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.path = os.path.join(self.root.name, "secret.html")
+        with open(self.path, "w") as file:
+            file.write("<html>secret</html>")
+        os.chmod(self.path, 0)
+        self.addCleanup(os.chmod, self.path, 0o644)
+
+        document_index = DocumentIndex(self.root.name)
+        document_index.build()
+        self.responder = StaticResponder(document_index, StaticCache(), CompressionCache(),
+                                         verbose=lambda *args: None)
+
+    @unittest.skipIf(os.geteuid() == 0, "root may read files with mode 000")
+    def test_unreadable_file_is_forbidden(self):
+        response_parts = self.responder.get_response_for_requested_file("/secret.html", keep_alive=True)
+        self.assertEqual(status_line(response_parts), b"HTTP/1.1 403 Forbidden")
+        self.assertIn(b"Connection: keep-alive\r\n", response_parts[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
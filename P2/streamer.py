@@ -4,18 +4,214 @@ from lossy_socket import LossyUDP
 # do not import anything else from socket except INADDR_ANY
 from socket import INADDR_ANY
 from concurrent.futures import ThreadPoolExecutor
-from threading import Timer
+from collections import deque
 import threading
+import itertools
+import heapq
+import bisect
 import time
 import hashlib
 import struct
 
+# Header following the checksum: SEQ number, ACK flag, FIN flag, cumulative ACK number, number of SACK blocks,
+# timestamp of the packet and timestamp echoed back from the packet being acknowledged
+PACKET_HEADER_FORMAT = '!i??iBII'
+
+# A SACK block: first and one past the last SEQ number of a run of segments received out of order
+SACK_BLOCK_FORMAT = '!ii'
+
+# Largest number of SACK blocks carried by an ACK packet
+MAX_SACK_BLOCKS = 4
+
+# Largest payload of a segment:
+#   1472 - 16(checksum bytes) - 19(header bytes) = 1437 bytes
+CHUNK_SIZE = 1472 - 16 - struct.calcsize(PACKET_HEADER_FORMAT)
+
+# Number of segments which may be sent and not yet acknowledged, by default
+DEFAULT_WINDOW_SIZE = 64
+
+# Retransmission timeout in seconds until the first RTT sample has been taken
+INITIAL_RTO = 0.25
+
+# Bounds of the retransmission timeout in seconds, whatever the RTT samples and the backoff say.
+# The delivery delay of LossyUDP is bounded, a longer backoff would only leave the link idle after a loss burst
+MIN_RTO = 0.05
+MAX_RTO = 1.0
+
+# Gains of the smoothed RTT and of the RTT variation, and the variation multiplier, as given in RFC 6298
+RTT_ALPHA = 1 / 8
+RTT_BETA = 1 / 4
+RTO_K = 4
+
+# Resolution in seconds of the timer scheduler, the G of RFC 6298
+CLOCK_GRANULARITY = 0.001
+
+# Seconds close keeps answering the FIN of the other side once both FIN packets have been acknowledged
+CLOSE_LINGER = 2
+
+# Longest interval in seconds between two FIN packets. The other side only answers during its CLOSE_LINGER,
+# so the FIN is sent several times within it however much the retransmission timeout has backed off
+MAX_FIN_TIMEOUT = CLOSE_LINGER / 4
+
+# Number of in-order segments received before an ACK is sent without waiting for DELAYED_ACK_TIMEOUT
+ACK_EVERY = 2
+
+# Seconds an ACK for in-order data may be delayed, hoping to acknowledge the next segment with it
+DELAYED_ACK_TIMEOUT = 0.05
+
+# Number of segments sent after a segment which have to be acknowledged before it is considered lost,
+# and number of ACKs which do not advance the cumulative ACK number after which the oldest segment is lost
+DUPACK_THRESHOLD = 3
+
+# Multiple of the smoothed RTT after which the last segment is sent again when no ACK has arrived
+PROBE_TIMEOUT_RTTS = 2
+
+
+class Segment:
+    """
+    A data segment which has been sent and awaits its acknowledgement.
+    """
+
+    def __init__(self, sequence_number: int, data_bytes: bytes):
+        self.sequence_number = sequence_number
+        self.data_bytes = data_bytes
+        self.length = len(data_bytes)
+
+        # Number of times the segment has been sent
+        self.transmissions = 0
+
+        # SEQ number of the first segment sent after the latest transmission, only acknowledged segments from it on
+        # show that the segment was lost, and whether the segment waits to be sent again by the sender thread
+        self.later_from = None
+        self.lost = False
+
+        # ScheduledTimer of the next retransmission, cancelled when the segment is acknowledged
+        self.timer = None
+
+
+class RttEstimator:
+    """
+    Retransmission timeout of a connection, computed from RTT samples as described in RFC 6298:
+    the smoothed RTT plus four times the RTT variation, clamped to [MIN_RTO, MAX_RTO].
+    Every timeout doubles it until a new sample arrives.
+    """
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = INITIAL_RTO
+
+    def add_sample(self, rtt: float):
+        """
+        :param rtt: Measured round trip time in seconds
+        :return: None
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+        self.rto = min(max(self.srtt + max(CLOCK_GRANULARITY, RTO_K * self.rttvar), MIN_RTO), MAX_RTO)
+
+    def back_off(self):
+        """
+        :return: None
+        """
+        self.rto = min(self.rto * 2, MAX_RTO)
+
+
+class ScheduledTimer:
+    """
+    Handle of a callback scheduled on a TimerScheduler.
+    Cancelling only marks the handle, the scheduler skips it when its deadline comes, so cancel is O(1).
+    """
+
+    def __init__(self, deadline: float, callback, args: tuple):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerScheduler:
+    """
+    Runs scheduled callbacks from a single thread, in the order of their deadlines,
+    which are kept in a min-heap. Replaces one threading.Timer thread per callback, so the number of
+    threads stays the same however many segments are in flight.
+    Cancelled timers stay in the heap until their deadline, which is at most one retransmission timeout away.
+    """
+
+    def __init__(self):
+        # (deadline, sequence number, ScheduledTimer) tuples, the sequence number keeps timers from being compared
+        self.heap = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.stopped = False
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def schedule(self, delay: float, callback, *args) -> ScheduledTimer:
+        """
+        :param delay: Seconds after which the callback runs
+        :param callback: Function to be called from the scheduler thread
+        :param args: Arguments of the callback
+        :return: ScheduledTimer which can be cancelled
+        """
+        timer = ScheduledTimer(time.monotonic() + delay, callback, args)
+        with self.condition:
+            heapq.heappush(self.heap, (timer.deadline, next(self.sequence), timer))
+            if self.heap[0][2] is timer:
+                # The new timer is due before the one the scheduler thread is waiting for
+                self.condition.notify()
+        return timer
+
+    def run(self):
+        """
+        :return: None
+
+        A thread function which waits for the earliest deadline and runs the callback which is due.
+        Callbacks run outside of the lock, so they can schedule new timers.
+        """
+        while True:
+            with self.condition:
+                while not self.stopped:
+                    if self.heap and self.heap[0][2].cancelled:
+                        heapq.heappop(self.heap)
+                        continue
+                    timeout = self.heap[0][0] - time.monotonic() if self.heap else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self.condition.wait(timeout)
+                if self.stopped:
+                    return
+                timer = heapq.heappop(self.heap)[2]
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                print("Exception in timer = ", e)
+
+    def stop(self):
+        """
+        :return: None
+
+        Stops the scheduler thread, timers which are still pending never run.
+        """
+        with self.condition:
+            self.stopped = True
+            self.heap.clear()
+            self.condition.notify()
+
 
 class Streamer:
     def __init__(self, dst_ip, dst_port,
-                 src_ip=INADDR_ANY, src_port=0):
+                 src_ip=INADDR_ANY, src_port=0, window_size=DEFAULT_WINDOW_SIZE, window_bytes=None):
         """Default values listen on all network interfaces, chooses a random source port,
-           and does not introduce any simulated packet loss."""
+           and does not introduce any simulated packet loss.
+           window_size limits the number of unacknowledged segments in flight,
+           window_bytes (if given) additionally limits the number of unacknowledged payload bytes."""
         self.socket = LossyUDP()
         self.socket.bind((src_ip, src_port))
         self.dst_ip = dst_ip
@@ -24,16 +220,39 @@ class Streamer:
         # Maintains the sequence number of the packet at the receiver's end
         self.receive_buffer = {}
 
-        # Maintains the sequence number of the packet at the sender's end
+        # Maps the sequence number of every segment in flight to its Segment, until it is acknowledged
         self.send_buffer = {}
 
-        # Maintains the sequence number of the packet that have been sent and await acknowledgement from receiver's end
-        self.sent_ack_buffer = {}
+        # Segments beyond the send window, waiting for acknowledgements to slide the window forward
+        self.send_queue = deque()
 
-        # Maintains the current sequence number for both the hosts. It is incremented each time a new
-        # packet is created and sent over the network
+        # Sliding window: send_base is the oldest unacknowledged sequence number,
+        # next_seq the sequence number given to the next segment taken from the send queue
+        self.send_base = 0
+        self.next_seq = 0
+        self.window_size = window_size
+        self.window_bytes = window_bytes
+        self.bytes_in_flight = 0
+
+        # Guards the send side state, which the application thread, the listener and the timers all change.
+        # close waits on it until every segment has been acknowledged
+        self.window_condition = threading.Condition()
+
+        # Sequence number of the next packet handed to the application by recv
         self.curr_sequence_number = 0
 
+        # Cumulative ACK number: every segment below it has been received, although not necessarily read by recv
+        self.receive_ack_number = 0
+
+        # Guards receive_buffer and receive_ack_number, which the listener and recv both change
+        self.receive_lock = threading.Lock()
+
+        # Number of in-order segments received since the last ACK, and the timer of the delayed ACK, if any.
+        # The timer only sets ack_pending, the sender thread sends the ACK
+        self.segments_since_ack = 0
+        self.delayed_ack_timer = None
+        self.ack_pending = False
+
         # The sequence number of the closing packet that would be sent out
         self.close_sequence_number = None
 
@@ -47,20 +266,31 @@ class Streamer:
         # Empty bytes string that is sent as a data in ACK, FIN, and ACK FIN packets
         self.empty_bytes = b''
 
-        # A buffer which handles the queues smaller packets and sends them when queue is full
+        # Holds the bytes of a partial segment while earlier segments are unacknowledged
         # Used to implement Nagle's Algorithm
         self.nagle_send_buffer = self.empty_bytes
 
-        # Maintains a previous version of the buffer which is used to check if
-        # the application has sent all available data to the program
-        self.old_data = self.empty_bytes
+        # Runs the retransmission and delayed ACK timers
+        self.scheduler = TimerScheduler()
 
-        # Timer to check if the buffer has reached the limit
-        # Used to implement Nagle's Algorithm
-        self.nagle_timer = threading.Timer(0.5, self.run_nagle_algo)  #
+        # Retransmission timeout derived from the RTT samples of this connection
+        self.rtt_estimator = RttEstimator()
+
+        # Origin of the timestamps carried in the header, and the timestamp the next ACK echoes back
+        self.clock_origin = time.monotonic()
+        self.echo_timestamp = 0
+
+        # Loss detection: ACKs received since the cumulative ACK number last advanced, and segments detected
+        # as lost, which the sender thread retransmits before sending new segments
+        self.duplicate_acks = 0
+        self.retransmit_queue = deque()
+
+        # ScheduledTimer of the tail loss probe
+        self.probe_timer = None
 
         executor = ThreadPoolExecutor(max_workers=1)
         executor.submit(self.listener)
+        threading.Thread(target=self.run_sender, daemon=True).start()
 
     def send(self, data_bytes: bytes) -> None:
         """
@@ -69,88 +299,294 @@ class Streamer:
         :return: None
 
         The function receives all the data that needs to be sent over and adds it to the buffer.
-        Upon receiving data from application, it triggers Nagle's Algorithm
+        Upon receiving data from application, it triggers Nagle's Algorithm and wakes up the sender thread.
+        Segments beyond the window stay queued and are sent as acknowledgements slide the window forward.
         """
         """Note that data_bytes can be larger than one packet."""
-        # Your code goes here!  The code below should be changed!
-        # for now I'm just sending the raw application-level data in one UDP payload
-
-        self.nagle_send_buffer += data_bytes
-        self.run_nagle_algo()
+        with self.window_condition:
+            self.nagle_send_buffer += data_bytes
+            self.run_nagle_algo()
+            self.window_condition.notify_all()
 
-    def run_nagle_algo(self):
+    def run_nagle_algo(self, flush: bool = False):
         """
+        :param flush: Whether a partial segment is queued even though segments are unacknowledged
         :return: None
 
-        The method is called periodically from the timer and the send method.
-        When there is no more data to be added to the buffer, the buffer is chunked into the smaller supported packet size.
-        The checksum is calculated on the chunked data and appended at the beginning of packet bytes.
-        The SEQ number is incremented and the program calls the retransmission logic for the packets.
-        The chunk size is calculated as follows:
-            Chunk size  = 1472 - 16(checksum bytes) - 4(sequence number bytes) - 2(boolean bytes for ACK and FIN)
-                        = 1450 bytes
+        Called with window_condition held, from send, from the listener when an ACK arrives and from close.
+        The buffer is chunked into segments of CHUNK_SIZE bytes, which are queued right away.
+        A remaining partial segment is only queued when no data is in flight, so that small writes made
+        while waiting for an ACK are coalesced into one segment.
+        """
+        full_length = len(self.nagle_send_buffer) - len(self.nagle_send_buffer) % CHUNK_SIZE
+        for bytes_index in range(0, full_length, CHUNK_SIZE):
+            self.send_queue.append(self.nagle_send_buffer[bytes_index:bytes_index + CHUNK_SIZE])
+        self.nagle_send_buffer = self.nagle_send_buffer[full_length:]
 
+        if self.nagle_send_buffer and (flush or (not self.send_buffer and not self.send_queue)):
+            self.send_queue.append(self.nagle_send_buffer)
+            self.nagle_send_buffer = self.empty_bytes
 
+    def window_is_open(self) -> bool:
         """
-        if self.nagle_send_buffer == self.empty_bytes:
-            return
+        :return: True if the segment at the head of the send queue fits into the send window
+        Called with window_condition held. A window in bytes always lets one segment through,
+        so a window smaller than a segment cannot stall the transfer.
+        """
+        if self.next_seq - self.send_base >= self.window_size:
+            return False
+        if self.window_bytes is not None and self.send_buffer and \
+                self.bytes_in_flight + len(self.send_queue[0]) > self.window_bytes:
+            return False
+        return True
 
-        chunk_size = 1450
-        if self.old_data == self.nagle_send_buffer:
-            # Cancel the timer at the time of sending the packets
-            self.nagle_timer.cancel()
-            segmented_bytes = [self.nagle_send_buffer[bytes_index:bytes_index + chunk_size] for bytes_index in
-                               range(0, len(self.nagle_send_buffer), chunk_size)]
-
-            for chunked_data in segmented_bytes:
-                sequence_number = self.curr_sequence_number
-                self.sent_ack_buffer[sequence_number] = False
-                tcp_packet = self.create_tcp_packet(sequence_number, chunked_data, False, False)
-                checksum = self.calculate_checksum(tcp_packet)
-                tcp_packet = checksum + tcp_packet
-                # print("Sending TCP Packet with SEQ = ", sequence_number)
+    def run_sender(self):
+        """
+        :return: None
 
+        A thread function which sends queued segments whenever the send window has room.
+        The checksum is calculated on the segment and appended at the beginning of packet bytes,
+        the segment is remembered until it is acknowledged and its retransmission timer is started.
+        Delayed ACKs go first, then segments queued for retransmission, which already count against the window.
+        Sending from this thread keeps the listener free to process ACKs and the scheduler thread free to run
+        the other timers on time, since LossyUDP.sendto sleeps, and lets send return without waiting for the
+        window to open.
+        """
+        while not self.closed:
+            with self.window_condition:
+                while not self.closed and not self.ack_pending and not self.retransmit_queue and \
+                        (not self.send_queue or not self.window_is_open()):
+                    self.window_condition.wait(1)
+                if self.closed:
+                    return
+                send_ack = self.ack_pending
+                self.ack_pending = False
+                retransmission = False
+                if send_ack:
+                    tcp_packet = None
+                elif self.retransmit_queue:
+                    segment = self.send_buffer.get(self.retransmit_queue.popleft())
+                    if segment is None or not segment.lost:
+                        # Acknowledged in the meantime
+                        continue
+                    tcp_packet = self.prepare_transmission(segment)
+                    retransmission = True
+                    # print("Retransmission of SEQ = ", segment.sequence_number)
+                else:
+                    chunked_data = self.send_queue.popleft()
+                    sequence_number = self.next_seq
+                    self.next_seq += 1
+                    segment = Segment(sequence_number, chunked_data)
+                    self.send_buffer[sequence_number] = segment
+                    self.bytes_in_flight += segment.length
+                    tcp_packet = self.prepare_transmission(segment)
+                    self.schedule_probe()
+                    # print("Sending TCP Packet with SEQ = ", sequence_number)
+
+            if send_ack:
+                with self.receive_lock:
+                    # An immediate ACK may have acknowledged the delayed segments in the meantime
+                    send_ack = self.segments_since_ack > 0
+                if send_ack:
+                    self.send_tcp_ack_packet()
+            elif retransmission:
+                self.retransmit_pack(tcp_packet)
+            else:
                 self.socket.sendto(tcp_packet, (self.dst_ip, self.dst_port))
-                self.send_buffer[sequence_number] = tcp_packet
-                Timer(0.25, self.handle_packet_retransmission, [sequence_number, tcp_packet]).start()
-                self.curr_sequence_number += 1
 
-        else:
-            # Update the data buffer and start the timer again which would check in regular intervals
-            # that the buffer has no more updates/additions
-            self.old_data = self.nagle_send_buffer
-            if not self.nagle_timer.is_alive():
-                self.nagle_timer.start()
+    def prepare_transmission(self, segment: Segment) -> bytes:
+        """
+        :param segment: Segment about to be sent or sent again
+        :return: TCP packet of the segment, stamped with the current time
+        Called with window_condition held. The packet is built for every transmission, so the timestamp the
+        receiver echoes back always belongs to the latest one. The retransmission timer is started again with
+        the current retransmission timeout.
+        """
+        if segment.timer is not None:
+            segment.timer.cancel()
+        segment.transmissions += 1
+        segment.later_from = self.next_seq
+        segment.lost = False
+        tcp_packet = self.create_tcp_packet(segment.sequence_number, segment.data_bytes, False, False,
+                                            timestamp=self.current_timestamp())
+        segment.timer = self.scheduler.schedule(self.rtt_estimator.rto, self.handle_packet_retransmission,
+                                                segment.sequence_number)
+        return self.calculate_checksum(tcp_packet) + tcp_packet
+
+    def current_timestamp(self) -> int:
+        """
+        :return: Microseconds since the Streamer was created, as an unsigned 32 bit number which is never 0
+        The counter wraps around after about 71 minutes, RTT samples are taken modulo 2 ** 32.
+        """
+        return (int((time.monotonic() - self.clock_origin) * 1000000) & 0xffffffff) or 1
+
+    def handle_ack(self, ack_number: int, sack_blocks: list, echo_timestamp: int):
+        """
+        :param ack_number: Cumulative ACK number, every segment below it has been received
+        :param sack_blocks: (start, end) runs of segments received above ack_number, end excluded
+        :param echo_timestamp: Timestamp of the data packet which triggered the ACK, 0 if there is none
+        :return: None
+
+        Forgets every segment the ACK covers and slides send_base past every acknowledged sequence number,
+        then wakes up the sender thread, since the window now has room for more segments.
+        A single ACK may clear many segments, so losing an ACK costs nothing as long as a later one arrives.
+        An ACK which acknowledges new data yields an RTT sample from the echoed timestamp. The timestamp
+        belongs to the transmission which was delivered, so retransmitted segments are sampled too (RFC 7323)
+        and the retransmission timeout recovers from its backoff with the first ACK after a timeout.
+        Every ACK then runs loss detection, so holes reported by the SACK blocks and by duplicate ACKs are
+        retransmitted without waiting for the retransmission timeout.
+        """
+        with self.window_condition:
+            acknowledged_ranges = [(self.send_base, min(ack_number, self.next_seq))]
+            for start, end in sack_blocks:
+                acknowledged_ranges.append((max(start, self.send_base), min(end, self.next_seq)))
+            cleared = 0
+            for start, end in acknowledged_ranges:
+                for sequence_number in range(start, end):
+                    segment = self.send_buffer.pop(sequence_number, None)
+                    if segment is not None:
+                        segment.timer.cancel()
+                        self.bytes_in_flight -= segment.length
+                        cleared += 1
+
+            if ack_number > self.send_base:
+                self.duplicate_acks = 0
+            elif ack_number == self.send_base and self.send_buffer:
+                # An ACK below send_base was overtaken by a later one, it is not a duplicate
+                self.duplicate_acks += 1
+
+            if cleared:
+                if echo_timestamp:
+                    rtt = ((self.current_timestamp() - echo_timestamp) & 0xffffffff) / 1000000
+                    self.rtt_estimator.add_sample(rtt)
+                while self.send_base < self.next_seq and self.send_base not in self.send_buffer:
+                    self.send_base += 1
+                self.run_nagle_algo()
+                self.schedule_probe()
+            if self.detect_losses() or cleared:
+                self.window_condition.notify_all()
+
+    def detect_losses(self) -> bool:
+        """
+        :return: True if segments were queued for retransmission
+        Called with window_condition held.
+        A segment is lost once DUPACK_THRESHOLD segments sent after its latest transmission have been
+        acknowledged (RFC 6675), or, for the oldest segment, after DUPACK_THRESHOLD duplicate ACKs.
+        LossyUDP reorders packets, so a segment which is merely late is overtaken by fewer segments than that
+        most of the time. A retransmission only counts the segments sent after it, so it is not detected as
+        lost again by the ACKs of segments which were in flight with the original transmission. The duplicate
+        ACKs cannot tell which transmission they follow, so they only apply to the first one.
+        """
+        # Segments are added to send_buffer in SEQ order, later_from is counted against the ones still in flight
+        in_flight = list(self.send_buffer)
+        detected = False
+        for index, sequence_number in enumerate(in_flight):
+            segment = self.send_buffer[sequence_number]
+            if segment.lost:
+                continue
+            later_in_flight = len(in_flight) - bisect.bisect_left(in_flight, segment.later_from, index + 1)
+            later_acknowledged = self.next_seq - segment.later_from - later_in_flight
+            if later_acknowledged >= DUPACK_THRESHOLD or \
+                    (sequence_number == self.send_base and segment.transmissions == 1 and
+                     self.duplicate_acks >= DUPACK_THRESHOLD):
+                if sequence_number == self.send_base:
+                    # Counting starts again, the retransmission gets its own duplicate ACKs
+                    self.duplicate_acks = 0
+                segment.lost = True
+                self.retransmit_queue.append(sequence_number)
+                detected = True
+        return detected
+
+    def schedule_probe(self):
+        """
+        :return: None
+        Called with window_condition held, whenever a new segment is sent or an ACK acknowledges data.
+        Restarts the tail loss probe timer, which fires PROBE_TIMEOUT_RTTS smoothed RTTs after the last
+        segment was sent or acknowledged. When only one segment is in flight, the receiver may hold back
+        its ACK for DELAYED_ACK_TIMEOUT, which is added. The probe is not used when the retransmission
+        timeout would fire first.
+        """
+        if self.probe_timer is not None:
+            self.probe_timer.cancel()
+            self.probe_timer = None
+        if not self.send_buffer or self.rtt_estimator.srtt is None:
+            return
+        probe_timeout = PROBE_TIMEOUT_RTTS * self.rtt_estimator.srtt
+        if len(self.send_buffer) == 1:
+            probe_timeout += DELAYED_ACK_TIMEOUT
+        if probe_timeout < self.rtt_estimator.rto:
+            self.probe_timer = self.scheduler.schedule(probe_timeout, self.handle_probe_timeout)
+
+    def handle_probe_timeout(self):
+        """
+        :return: None
+
+        Runs on the scheduler thread when no ACK has arrived for a while although segments are in flight.
+        When the last segments of a burst are lost, no later segment is acknowledged and loss detection never
+        triggers, so the segment with the highest SEQ number is sent again. Its ACK carries SACK blocks which
+        let loss detection repair the other holes, about one RTT later instead of after the retransmission
+        timeout.
+        """
+        with self.window_condition:
+            self.probe_timer = None
+            if self.closed or not self.send_buffer:
+                return
+            segment = self.send_buffer[next(reversed(self.send_buffer))]
+            if segment.lost:
+                return
+            segment.lost = True
+            self.retransmit_queue.append(segment.sequence_number)
+            self.window_condition.notify_all()
+        # print("Tail loss probe for SEQ = ", segment.sequence_number)
 
     @staticmethod
-    def create_tcp_packet(sequence_header: int, data_bytes: bytes, is_ack: bool, is_fin: bool) -> bytes:
+    def create_tcp_packet(sequence_header: int, data_bytes: bytes, is_ack: bool, is_fin: bool,
+                          ack_number: int = -1, sack_blocks: list = (), timestamp: int = 0,
+                          echo_timestamp: int = 0) -> bytes:
         """
         :param sequence_header: SEQ number of the packet
         :param data_bytes: Data bytes of the packet
         :param is_ack: Flag for the packet if it's an ACK packet
         :param is_fin: Flag for the packet if it's an FIN packet
+        :param ack_number: Cumulative ACK number of an ACK packet, -1 for other packets
+        :param sack_blocks: At most MAX_SACK_BLOCKS (start, end) runs received above ack_number
+        :param timestamp: Time the packet is sent at, 0 if the packet carries no timestamp
+        :param echo_timestamp: Timestamp of the packet being acknowledged, 0 if there is none
         :return: TCP Packet in packed format
 
         Packing format -
             i = Integer
             ? = Boolean
+            B = Unsigned byte
+            I = Unsigned integer
             s = Bytes
 
         Packs the data into a format to send to the receiver.
+        The SACK blocks follow the fixed header, the data bytes follow the SACK blocks.
         """
-        packing_format = '!i??' + str(len(data_bytes)) + 's'
-        return struct.pack(packing_format, sequence_header, is_ack, is_fin, data_bytes)
+        packing_format = PACKET_HEADER_FORMAT + SACK_BLOCK_FORMAT[1:] * len(sack_blocks) + str(len(data_bytes)) + 's'
+        sack_values = [edge for sack_block in sack_blocks for edge in sack_block]
+        return struct.pack(packing_format, sequence_header, is_ack, is_fin, ack_number, len(sack_blocks),
+                           timestamp, echo_timestamp, *sack_values, data_bytes)
 
     @staticmethod
     def unpack_tcp_packet(received_bytes: bytes):
         """
         :param received_bytes: Data packet in packed format received from the sender
-        :return: Unpacked format of data
+        :return: Unpacked format of data: SEQ number, ACK flag, FIN flag, cumulative ACK number,
+                 list of SACK blocks, timestamp, echoed timestamp and data bytes
 
         Unpacks the data into a format defined as received from the sender.
+        Raises struct.error if the packet is shorter than its header says.
         """
-        packing_format = '!i??' + str(len(received_bytes) - 6) + 's'
-        return struct.unpack(packing_format, received_bytes)
+        header_size = struct.calcsize(PACKET_HEADER_FORMAT)
+        sequence_header, is_ack, is_fin, ack_number, sack_count, timestamp, echo_timestamp = \
+            struct.unpack(PACKET_HEADER_FORMAT, received_bytes[:header_size])
+        sack_size = struct.calcsize(SACK_BLOCK_FORMAT)
+        sack_blocks = [struct.unpack(SACK_BLOCK_FORMAT, received_bytes[offset:offset + sack_size])
+                       for offset in range(header_size, header_size + sack_count * sack_size, sack_size)]
+        data_bytes = received_bytes[header_size + sack_count * sack_size:]
+        return sequence_header, is_ack, is_fin, ack_number, sack_blocks, timestamp, echo_timestamp, data_bytes
 
     @staticmethod
     def calculate_checksum(packet_data: bytes):
@@ -160,22 +596,93 @@ class Streamer:
         """
         return hashlib.md5(packet_data).digest()
 
-    def send_tcp_ack_packet(self, sequence_header: int, data_bytes: bytes):
+    def send_tcp_ack_packet(self):
         """
-        :param sequence_header: SEQ number of the packet
-        :param data_bytes: Data bytes of the ACK packet
         :return: None
 
-        Creates a TCP ACK packet for the data packet received from the sender.
-        This packet is then sent back to the sender.
+        Creates a TCP ACK packet carrying the cumulative ACK number and SACK blocks describing the segments
+        received out of order. This packet is then sent back to the sender.
         is_ack flag is set to True.
         """
-        tcp_ack_packet = self.create_tcp_packet(sequence_header, data_bytes, True, False)
+        with self.receive_lock:
+            self.segments_since_ack = 0
+            if self.delayed_ack_timer is not None:
+                self.delayed_ack_timer.cancel()
+                self.delayed_ack_timer = None
+            ack_number = self.receive_ack_number
+            sack_blocks = self.build_sack_blocks()
+            echo_timestamp = self.echo_timestamp
+        tcp_ack_packet = self.create_tcp_packet(self.next_seq, self.empty_bytes, True, False, ack_number, sack_blocks,
+                                                self.current_timestamp(), echo_timestamp)
         checksum = self.calculate_checksum(tcp_ack_packet)
         tcp_ack_packet = checksum + tcp_ack_packet
-        # print("ACK SENT for SEQ = ", sequence_header)
+        # print("ACK SENT for SEQ = ", ack_number, sack_blocks)
         self.socket.sendto(tcp_ack_packet, (self.dst_ip, self.dst_port))
 
+    def build_sack_blocks(self) -> list:
+        """
+        :return: Up to MAX_SACK_BLOCKS (start, end) runs of buffered segments above the cumulative ACK number
+
+        Called with receive_lock held. The highest runs are reported first, since the lower ones
+        have most likely been reported by earlier ACKs already.
+        """
+        sack_blocks = []
+        for sequence_number in sorted((key for key in self.receive_buffer if key > self.receive_ack_number),
+                                      reverse=True):
+            if sack_blocks and sack_blocks[-1][0] == sequence_number + 1:
+                sack_blocks[-1] = (sequence_number, sack_blocks[-1][1])
+            elif len(sack_blocks) == MAX_SACK_BLOCKS:
+                break
+            else:
+                sack_blocks.append((sequence_number, sequence_number + 1))
+        return sack_blocks
+
+    def handle_data_packet(self, sequence_number: int, data_bytes: bytes, timestamp: int):
+        """
+        :param sequence_number: SEQ number of the data packet
+        :param data_bytes: Data bytes of the packet
+        :param timestamp: Timestamp of the data packet
+        :return: None
+
+        Buffers the segment and decides when to acknowledge it.
+        Segments are acknowledged every ACK_EVERY segments or after DELAYED_ACK_TIMEOUT. Since the SACK blocks
+        describe every gap, segments arriving out of order do not need an ACK of their own; an ACK is sent
+        right away only for a duplicate segment, which means an earlier ACK was lost, and for a segment which
+        fills a gap, so the sender can slide its window at once.
+        The ACK echoes the timestamp of the first segment it acknowledges, so the sender's RTT samples
+        include the time the ACK was delayed.
+        """
+        with self.receive_lock:
+            if self.segments_since_ack == 0:
+                self.echo_timestamp = timestamp
+            duplicate = sequence_number < self.receive_ack_number or sequence_number in self.receive_buffer
+            if not duplicate:
+                # Packet is added to receive buffer if it is not previously present or already delivered
+                # This may be the case when the packet is retransmitted when the intended ACK is lost
+                self.receive_buffer[sequence_number] = data_bytes
+            in_order = sequence_number == self.receive_ack_number
+            while self.receive_ack_number in self.receive_buffer:
+                self.receive_ack_number += 1
+            filled_gap = in_order and self.receive_ack_number > sequence_number + 1
+
+            self.segments_since_ack += 1
+            send_now = duplicate or filled_gap or self.segments_since_ack >= ACK_EVERY
+            if not send_now and self.delayed_ack_timer is None:
+                self.delayed_ack_timer = self.scheduler.schedule(DELAYED_ACK_TIMEOUT, self.handle_delayed_ack_timeout)
+        if send_now:
+            self.send_tcp_ack_packet()
+
+    def handle_delayed_ack_timeout(self):
+        """
+        :return: None
+
+        Runs on the scheduler thread once DELAYED_ACK_TIMEOUT has passed without another segment to acknowledge.
+        The ACK is left to the sender thread, the scheduler never waits in LossyUDP.sendto.
+        """
+        with self.window_condition:
+            self.ack_pending = True
+            self.window_condition.notify_all()
+
     def retransmit_pack(self, tcp_packet: bytes):
         """
         :param tcp_packet: TCP Packet to be retransmitted
@@ -185,29 +692,29 @@ class Streamer:
         """
         self.socket.sendto(tcp_packet, (self.dst_ip, self.dst_port))
 
-    def handle_packet_retransmission(self, sequence_number: int, tcp_packet: bytes):
+    def handle_packet_retransmission(self, sequence_number: int):
         """
         :param sequence_number: TCP packet SEQ number
-        :param tcp_packet: TCP packet containing the data, header and checksum
         :return: None
 
         If the ACK for the pack sent is not received within the time frame, the packet is retransmitted.
-        It checks the ack_buffer which maintains the boolean status of the ACK for the packets that been sent.
-        Is called every 0.25 seconds until an ACK packet is received against the SEQ number.
+        A segment is in flight for as long as it is in send_buffer, handle_ack removes it.
+        Runs on the scheduler thread once the retransmission timeout has passed without an ACK packet received
+        against the SEQ number. A timeout of the oldest unacknowledged segment doubles the retransmission
+        timeout, so a burst of losses backs off once instead of once per segment.
+        The segment is queued for the sender thread, which sends it before any new segment.
         """
-        if self.closed:
-            return
-        if not self.sent_ack_buffer[sequence_number]:
-            try:
-                self.retransmit_pack(tcp_packet)
-            except Exception as e:
-                print("Exception = ", e)
-            else:
-                # print("Retransmitting Hit. Sending packet again with SEQ = ", sequence_number)
-                Timer(0.25, self.handle_packet_retransmission, [sequence_number, tcp_packet]).start()
-        else:
-            # When the ACK is received, delete its entry from ack_buffer
-            del self.sent_ack_buffer[sequence_number]
+        with self.window_condition:
+            segment = self.send_buffer.get(sequence_number)
+            if self.closed or segment is None:
+                return
+            if sequence_number == self.send_base:
+                self.rtt_estimator.back_off()
+            if not segment.lost:
+                segment.lost = True
+                self.retransmit_queue.append(sequence_number)
+                self.window_condition.notify_all()
+        # print("Retransmitting Hit. Sending packet again with SEQ = ", sequence_number)
 
     def send_close_packet(self, sequence_number: int, data_bytes: bytes):
         """
@@ -219,7 +726,8 @@ class Streamer:
         FIN packet is sent indicating the closing of the transmission.
         is_fin flag is set as true
         """
-        tcp_close_packet = self.create_tcp_packet(sequence_number, data_bytes, False, True)
+        tcp_close_packet = self.create_tcp_packet(sequence_number, data_bytes, False, True,
+                                                  timestamp=self.current_timestamp())
         checksum = self.calculate_checksum(tcp_close_packet)
         tcp_ack_packet = checksum + tcp_close_packet
         self.socket.sendto(tcp_ack_packet, (self.dst_ip, self.dst_port))
@@ -250,14 +758,13 @@ class Streamer:
         # your code goes here!  The code below should be changed!
         # this sample code just calls the recvfrom method on the LossySocket
         while True:
-            if self.curr_sequence_number in self.receive_buffer:
-                data = self.receive_buffer[self.curr_sequence_number]
-                del self.receive_buffer[self.curr_sequence_number]
-                self.curr_sequence_number += 1
-                return data
-            else:
-                # If the buffer is empty or the correct order packet is yet to be received the program waits
-                time.sleep(0.1)
+            with self.receive_lock:
+                data = self.receive_buffer.pop(self.curr_sequence_number, None)
+                if data is not None:
+                    self.curr_sequence_number += 1
+                    return data
+            # If the buffer is empty or the correct order packet is yet to be received the program waits
+            time.sleep(0.1)
 
     def listener(self):
         """
@@ -276,49 +783,50 @@ class Streamer:
                 received_data = received_data[16:]
                 if received_data == b'':
                     continue
+                computed_check_sum = self.calculate_checksum(received_data)
+                # Matching the checksum to ensure data bytes are not corrupted. Packet is ignored if it is corrupted.
+                # The checksum is matched before unpacking, a corrupted SACK block count could not be trusted
+                if packet_check_sum != computed_check_sum:
+                    # print("Received TCP Packet with corrupted data")
+                    continue
+
                 tcp_packet = self.unpack_tcp_packet(received_data)
                 packet_seq_number = tcp_packet[0] # Packet SEQ number
                 is_ack = tcp_packet[1] # ACK flag in the packet
                 is_fin = tcp_packet[2] # FIN flag in the packet
-                data_bytes = tcp_packet[3]
+                ack_number = tcp_packet[3] # Cumulative ACK number of an ACK packet
+                sack_blocks = tcp_packet[4] # SACK blocks of an ACK packet
+                timestamp = tcp_packet[5] # Time the packet was sent at, by the clock of the other host
+                echo_timestamp = tcp_packet[6] # Timestamp of our packet which an ACK acknowledges
+                data_bytes = tcp_packet[7]
 
                 # print("TCP PACKET received SEQ = ", packet_seq_number, "IS ACK = ", is_ack, "IS FIN = ", is_fin)
 
-                computed_check_sum = self.calculate_checksum(received_data)
-                # Matching the checksum to ensure data bytes are not corrupted. Packet is ignored if it is corrupted
-                if packet_check_sum != computed_check_sum:
-                    # print("Received TCP Packet with corrupted data for SEQ number = ", packet_seq_number)
-                    continue
-
                 if is_ack and is_fin:
                     # Packet is ACK FIN packet
-                    self.closed_ack = True
+                    with self.window_condition:
+                        self.closed_ack = True
+                        self.window_condition.notify_all()
                     # print("ACK FIN received")
 
                 elif is_ack:
                     # Packet is ACK packet
-                    self.sent_ack_buffer[packet_seq_number] = True
-                    # print("Received ACK from other machine for SEQ = ", packet_seq_number)
+                    self.handle_ack(ack_number, sack_blocks, echo_timestamp)
+                    # print("Received ACK from other machine for SEQ = ", ack_number, sack_blocks)
 
                 elif is_fin:
                     # Packet is FIN packet
                     data = b'-1'
                     self.send_close_ack_packet(packet_seq_number, data)
-                    self.closed_from_recv = True
+                    with self.window_condition:
+                        self.closed_from_recv = True
+                        self.window_condition.notify_all()
                     # print("FIN packet received")
 
                 else:
                     # Packet is Data packet
-                    ack_data = b'-1'
                     # print("Data packet received with SEQ = ", packet_seq_number)
-
-                    # ACK is sent with a timer of 0.05 seconds
-                    Timer(0.05, self.send_tcp_ack_packet, [packet_seq_number, ack_data]).start()
-                    if packet_seq_number not in self.receive_buffer:
-                        # Packet is added to receive buffer if it is not previously present
-                        # This may be the case when the packet is retransmitted when the intended ACK is lost
-                        self.receive_buffer[packet_seq_number] = data_bytes
-                        # print("Sending ACK for SEQ = ", packet_seq_number)
+                    self.handle_data_packet(packet_seq_number, data_bytes, timestamp)
 
             except Exception as e:
                 print("listener died!")
@@ -330,38 +838,56 @@ class Streamer:
            the necessary ACKs and retransmissions"""
         # your code goes here, especially after you add ACKs and retransmissions.
 
-        # If there are packets in the nagle buffer still waiting to be transmitted, the program goes to sleep
-        while self.nagle_timer.is_alive():
-            time.sleep(1)
+        # The partial segment held back by Nagle's Algorithm is sent right away
+        with self.window_condition:
+            self.run_nagle_algo(flush=True)
+            self.window_condition.notify_all()
 
-        # If there are packets which are yet to receive their ACK, the program waits before closing
+        # If there are packets which are queued or yet to receive their ACK, the program waits before closing
         # the connection
-        while len(self.sent_ack_buffer) != 0:
-            time.sleep(0.05)
+        with self.window_condition:
+            while self.send_queue or self.send_buffer:
+                self.window_condition.wait(0.05)
 
-        is_fin_packet_transmitted = False
         close_data_bytes = b'-1'
-        self.close_sequence_number = self.curr_sequence_number
+        self.close_sequence_number = self.next_seq
+        fin_timeout = min(self.rtt_estimator.rto, MAX_FIN_TIMEOUT)
+        first_fin_sent_at = None
         while True:
-            # If FIN packet and FIN ACK is received, then close the socket connection
-            if self.closed_from_recv and self.closed_ack:
-                break
-
-            if not is_fin_packet_transmitted:
-                self.send_close_packet(self.close_sequence_number, close_data_bytes)
-                packet_send_time = time.time()
-                is_fin_packet_transmitted = True
-                # print("Sending FIN packet")
-            else:
-                # Retransmission logic for FIN packet after 0.25 seconds
-                if time.time() - packet_send_time >= 0.25:
-                    # print("Sending FIN packet")
-                    self.send_close_packet(self.close_sequence_number, close_data_bytes)
-                    packet_send_time = time.time()
-
-        # Closing the connection and giving 2 seconds to perform any tasks currently ongoing before closing the socket
-        time.sleep(2)
+            with self.window_condition:
+                # If FIN packet and FIN ACK is received, then close the socket connection
+                if self.closed_from_recv and self.closed_ack:
+                    break
+                if self.closed_from_recv and first_fin_sent_at is not None and \
+                        time.monotonic() - first_fin_sent_at > CLOSE_LINGER:
+                    # The other side is closing too and only answers our FIN for CLOSE_LINGER seconds once it has
+                    # got it. Every ACK FIN it sent back since our first FIN was lost.
+                    break
+                fin_acknowledged = self.closed_ack
+
+            if fin_acknowledged:
+                # Only the FIN of the other side is missing, it is acknowledged by the listener
+                with self.window_condition:
+                    self.window_condition.wait_for(lambda: self.closed_from_recv, MAX_RTO)
+                continue
+
+            # print("Sending FIN packet")
+            self.send_close_packet(self.close_sequence_number, close_data_bytes)
+            if first_fin_sent_at is None:
+                first_fin_sent_at = time.monotonic()
+
+            # Retransmission logic for FIN packet, backing off after every unanswered FIN
+            with self.window_condition:
+                self.window_condition.wait_for(lambda: self.closed_ack, fin_timeout)
+            fin_timeout = min(fin_timeout * 2, MAX_FIN_TIMEOUT)
+
+        # Closing the connection and giving CLOSE_LINGER seconds to perform any tasks currently ongoing before
+        # closing the socket
+        time.sleep(CLOSE_LINGER)
         self.closed = True
+        self.scheduler.stop()
+        with self.window_condition:
+            self.window_condition.notify_all()
         self.socket.stoprecv()
         time.sleep(1)
         self.socket.close()
@@ -0,0 +1,67 @@
+import socket
+import threading
+import time
+import unittest
+import lossy_socket
+from streamer import Streamer, CLOSE_LINGER
+
+# Seconds both sides are given to finish closing, far more than a FIN exchange and the linger take
+CLOSE_DEADLINE = 15
+
+
+def free_udp_port() -> int:
+    """
+    :return: A UDP port on localhost which is currently unused
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(("localhost", 0))
+        return probe.getsockname()[1]
+
+
+def abandon(streamer: Streamer):
+    """
+    :param streamer: Streamer whose close may not have returned
+    :return: None
+    Stops the listener of a Streamer which did not finish closing, its executor thread would keep the
+    interpreter from exiting.
+    """
+    if not streamer.closed:
+        streamer.closed = True
+        streamer.scheduler.stop()
+        streamer.socket.stoprecv()
+
+
+class LateCloseTest(unittest.TestCase):
+    """
+    The second side calls close well after the FIN of the first side has arrived.
+    """
+
+    def setUp(self):
+        lossy_socket.sim = lossy_socket.SimulationParams()
+
+    def test_late_close_on_second_side(self):
+        port_a, port_b = free_udp_port(), free_udp_port()
+        streamer_a = Streamer(dst_ip="localhost", dst_port=port_b, src_ip="localhost", src_port=port_a)
+        streamer_b = Streamer(dst_ip="localhost", dst_port=port_a, src_ip="localhost", src_port=port_b)
+        self.addCleanup(abandon, streamer_a)
+        self.addCleanup(abandon, streamer_b)
+
+        streamer_a.send(b"hello")
+        self.assertEqual(streamer_b.recv(), b"hello")
+
+        close_a = threading.Thread(target=streamer_a.close, daemon=True)
+        close_a.start()
+        # The FIN of A is acknowledged by the listener of B long before B closes
+        time.sleep(CLOSE_LINGER + 1)
+        self.assertTrue(streamer_b.closed_from_recv)
+
+        close_b = threading.Thread(target=streamer_b.close, daemon=True)
+        close_b.start()
+        close_b.join(CLOSE_DEADLINE)
+        close_a.join(CLOSE_DEADLINE)
+        self.assertFalse(close_b.is_alive(), "close of the late side did not return")
+        self.assertFalse(close_a.is_alive(), "close of the first side never got the FIN of the late side")
+
+
+if __name__ == "__main__":
+    unittest.main()